@@ -0,0 +1,311 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+import curriculum_tree
+import curriculums
+import update_course_database
+import util
+from course_store import CourseStore
+from equivalence_index import EquivalenceIndex
+from print_html_table import CurriculumTables, LiteView, TableView
+from replay_server import FILTER_REGEX, listing_course_dto
+
+HISTORY_PATH = "../data/benchmark_history.json"
+
+# Shape of the synthetic data at scale 1 (roughly the master-mathematics dataset)
+TERM_IDS = [term_id for term_id in range(171, 207) if term_id not in [201, 202]]
+NUM_CLASSES = 900
+MEAN_OFFERINGS_PER_CLASS = 6
+# Fraction of the equivalence classes whose newest course is linked in the curriculum tree
+LINKED_CLASSES_FRACTION = 0.7
+NUM_TREE_ENTRIES = 970
+NUM_AREAS = 12
+NUM_CURRICULUM_VERSIONS = 3
+NODES_PER_TREE_PAGE = 300
+COURSE_URL_PREFIX = f"{curriculum_tree.TREE_BASE_URL}/pages/slc.tm.cp/course/"
+# x-indent of the rule nodes on the first levels of the tree
+RULE_NODE_LEVELS = [59, 79, 99, 119, 139]
+
+STAGES = ["update", "upsert", "import", "join", "render", "tree"]
+
+# A stage is only reported as a regression if it got slower by at least this much (timer noise of short stages)
+MIN_SECONDS_REGRESSION = 0.05
+MIN_BYTES_REGRESSION = 256 * 1024
+
+@dataclass
+class Dataset:
+    """Synthetic data of one scale: the courses (all_offered_courses format), the curriculum tree (tree JSON format),
+    and the tree as the scraper sees it (node pages of every curriculum version, see extract_courses_from_nodes)."""
+    scale: int
+    course_dtos: List[Dict[str, Any]]
+    related_course_ids: Dict[int, List[int]]
+    tree: List[Dict[str, Any]]
+    node_pages_by_version: List[List[List[Dict[str, Any]]]]
+
+    def sizes(self) -> Dict[str, int]:
+        return {"courses": len(self.course_dtos), "classes": len({dto["oldestRelatedCourseId"] for dto in self.course_dtos}),
+                "tree_entries": len(self.tree), "tree_pages": sum(len(pages) for pages in self.node_pages_by_version)}
+
+def generate_dataset(scale: int, seed: int = 0) -> Dataset:
+    """Generates `scale` times the synthetic data of scale 1, reproducibly for a given `seed`."""
+    rng = random.Random(seed)
+    num_classes = NUM_CLASSES * scale
+
+    # Offered terms of every class; course ids grow with the term, so the first offering has the oldest id
+    offering_term_ids = [sorted(rng.sample(TERM_IDS, min(len(TERM_IDS), 1 + int(rng.expovariate(1 / (MEAN_OFFERINGS_PER_CLASS - 1))))))
+                         for _ in range(num_classes)]
+    course_ids_by_class: List[List[int]] = [[] for _ in range(num_classes)]
+    course_dtos = []
+    next_course_id = 950_000_000
+    for term_id in TERM_IDS:
+        for class_index in range(num_classes):
+            if term_id not in offering_term_ids[class_index]:
+                continue
+            course_ids_by_class[class_index].append(next_course_id)
+            course_dtos.append({
+                "courseTypeDto": {"key": "VI" if class_index % 6 == 0 else "VO"},
+                "termName": util.term_id_to_name(term_id),
+                "semesterDto": {"id": term_id},
+                "title": f"Synthetic Course {class_index}" + (f" (MA{class_index % 10000:04d})" if class_index % 4 == 0 else ""),
+                "id": next_course_id,
+                "oldestRelatedCourseId": course_ids_by_class[class_index][0],
+            })
+            next_course_id += 1
+    # What the same-courses endpoint returns for every course: the other courses of its class, newest first
+    related_course_ids = {course_id: [related for related in reversed(course_ids) if related != course_id]
+                          for course_ids in course_ids_by_class for course_id in course_ids}
+
+    # Curriculum paths: every area has a core and an elective group (some of them "Theory"), as in the mathematics tree
+    paths = []
+    for area_index in range(NUM_AREAS * scale):
+        area = f"A{area_index} Synthetic Area {area_index}"
+        paths.append(["Elective Modules", "Mathematical Modules", "A Areas of Concentration", area, "Core Modules"])
+        paths.append(["Elective Modules", "Mathematical Modules", "A Areas of Concentration", area, "Theory" if area_index % 3 == 0 else "Further Modules"])
+        paths.append(["Elective Modules", "Interdisciplinary Modules", area])
+    # Tree entries: the linked classes (newest two courses), and entries that only link courses that are not the newest
+    linked_classes = rng.sample(range(num_classes), int(LINKED_CLASSES_FRACTION * num_classes))
+    entries_urls = [[f"{COURSE_URL_PREFIX}{course_id}" for course_id in course_ids_by_class[class_index][-1:-3:-1]] for class_index in linked_classes]
+    old_classes = [class_index for class_index in range(num_classes) if len(course_ids_by_class[class_index]) > 1]
+    while len(entries_urls) < NUM_TREE_ENTRIES * scale:
+        entries_urls.append([f"{COURSE_URL_PREFIX}{course_ids_by_class[rng.choice(old_classes)][0]}"])
+    tree = []
+    for entry_index, urls in enumerate(entries_urls):
+        path = rng.choice(paths)
+        tree.append({"urls": urls, "num_credits": rng.choice([3, 5, 6, 9]),
+                     "module_name": f"[MA{entry_index:05d}] Synthetic Module {entry_index}",
+                     "rule_node_names_by_levels": {str(rank): name for rank, name in enumerate(path)}})
+    # Entries of the same group are next to each other in the tree
+    tree.sort(key=lambda entry: list(entry["rule_node_names_by_levels"].values()))
+
+    # The scraper's view: rule nodes where the path changes, module rows and course links, cut into pages (so entries
+    # continue on the next page). Older curriculum versions mostly repeat the newest one.
+    nodes = []
+    previous_path: List[str] = []
+    for entry in tree:
+        path = list(entry["rule_node_names_by_levels"].values())
+        first_changed_level = next((level for level, (name, previous_name) in enumerate(zip(path, previous_path)) if name != previous_name), min(len(path), len(previous_path)))
+        for level in range(first_changed_level, max(len(path), len(previous_path))):
+            if level < len(path):
+                nodes.append({"kind": "node", "title": "Rule node", "text": path[level], "x": RULE_NODE_LEVELS[level]})
+            else:
+                nodes.append({"kind": "node", "title": "Other node", "text": "", "x": RULE_NODE_LEVELS[level]})
+        nodes.append({"kind": "module", "name": entry["module_name"], "credits": str(entry["num_credits"])})
+        nodes.extend({"kind": "course", "href": url} for url in entry["urls"])
+        previous_path = path
+    node_pages = [nodes[start:start + NODES_PER_TREE_PAGE] for start in range(0, len(nodes), NODES_PER_TREE_PAGE)]
+    return Dataset(scale, course_dtos, related_course_ids, tree, [node_pages] * NUM_CURRICULUM_VERSIONS)
+
+class SyntheticTumOnline:
+    """
+    Stands in for TumOnlineClient in the update stage: answers the course listings and same-courses lookups of
+    update_course_database from a Dataset (every curriculum version lists all courses of a term), like
+    replay_server.py does from the committed data, but without HTTP.
+    """
+    def __init__(self, dataset: Dataset):
+        self.listings_by_term: Dict[int, List[Dict[str, Any]]] = {}
+        for course_dto in dataset.course_dtos:
+            self.listings_by_term.setdefault(course_dto["semesterDto"]["id"], []).append(listing_course_dto(course_dto))
+        self.term_ids_by_course_id = {course_dto["id"]: course_dto["semesterDto"]["id"] for course_dto in dataset.course_dtos}
+        self.related_course_ids = dataset.related_course_ids
+
+    async def get_json(self, url: str, term_id: int | None = None) -> Any:
+        path, _, query = url.partition("?")
+        if "/same-courses/" in path:
+            return {"courses": [{"id": related_course_id, "semesterDto": {"id": self.term_ids_by_course_id[related_course_id]}}
+                                for related_course_id in self.related_course_ids[int(path[path.rfind("/") + 1:])]]}
+        parameters = dict(parameter.split("=", 1) for parameter in query.split("&"))
+        listing = self.listings_by_term.get(int(dict(FILTER_REGEX.findall(parameters["$filter"]))["termId"]), [])
+        skip, top = int(parameters["$skip"]), int(parameters["$top"])
+        # Fresh objects, as if parsed from a response (update_course_database modifies them)
+        return {"courses": [dict(course_dto) for course_dto in listing[skip:skip + top]], "totalCount": len(listing)}
+
+def synthetic_curriculum(directory: str, name: str) -> curriculums.Curriculum:
+    return curriculums.Curriculum(
+        heading="Synthetic Benchmark Curriculum",
+        curriculum_ids=[str(version) for version in range(NUM_CURRICULUM_VERSIONS)],
+        tree_file_path=f"{directory}/curriculum_tree.json",
+        all_offered_courses_path=f"{directory}/all_offered_courses.json",
+        database_path=f"{directory}/{name}.sqlite3",
+        extract_area=curriculums.extract_area_mathematics_master,
+        extra_columns=curriculums.EXTRA_COLUMNS_INFORMATICS,
+        output_file_prefix="synthetic",
+    )
+
+def run_stages(dataset: Dataset, trace_memory: bool) -> Dict[str, Dict[str, float]]:
+    """
+    Runs all stages once on `dataset` in a fresh directory. Returns the seconds of every stage, and (if
+    `trace_memory`) the peak of the Python heap during the stage, on top of what was allocated before it.
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    def measure(stage: str, run: Callable[[], Any]) -> Any:
+        if trace_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        # The stages print progress (e.g. courses missing in the tree), which is not what is measured here
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = run()
+        results[stage] = {"seconds": time.perf_counter() - start}
+        if trace_memory:
+            results[stage]["peak_bytes"] = tracemalloc.get_traced_memory()[1] - memory_before
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        # update_course_database from scratch, against synthetic listings and same-courses lookups: the listings,
+        # the resolution pipeline (with its title dedup and journal) and writing the course store
+        update_curriculum = synthetic_curriculum(directory, "update")
+        measure("update", lambda: asyncio.run(update_course_database.update_course_database(
+            SyntheticTumOnline(dataset), update_curriculum, TERM_IDS[-1], TERM_IDS[0], EquivalenceIndex(f"{directory}/equivalence_index.json"))))
+        with open(update_curriculum.all_offered_courses_path) as f:
+            course_dtos_by_term: Dict[int, List[Dict[str, Any]]] = {}
+            for course_dto in json.load(f)["courses"]:
+                course_dtos_by_term.setdefault(course_dto["semesterDto"]["id"], []).append(course_dto)
+        # The upsert stage writes it again, into a store of its own
+        os.remove(update_curriculum.all_offered_courses_path)
+
+        # Writing the results of update_course_database on their own: every term upserted into the course store, JSON export
+        def upsert():
+            with CourseStore(synthetic_curriculum(directory, "upsert")) as store:
+                for term_id, course_dtos in sorted(course_dtos_by_term.items(), reverse=True):
+                    store.upsert_term(term_id, course_dtos)
+                store.export_json()
+        measure("upsert", upsert)
+        with open(f"{directory}/curriculum_tree.json", "w") as f:
+            json.dump(dataset.tree, f, indent=0)
+
+        # Opening the course store of a fresh checkout (JSON import, equivalence classes), the join of the courses
+        # with the curriculum tree, and rendering the tables and the thin page
+        curriculum = synthetic_curriculum(directory, "render")
+        measure("import", lambda: CourseStore(curriculum).__exit__())
+        tables = measure("join", lambda: CurriculumTables(curriculum))
+        def render():
+            tables.render(TableView(TERM_IDS[-1], f"{directory}/synthetic-current.html"))
+            tables.render(TableView(TERM_IDS[-1], f"{directory}/synthetic-all.html", TERM_IDS[0]))
+            tables.render_lite(LiteView(TERM_IDS[-1], TERM_IDS[0], f"{directory}/synthetic.html", f"{directory}/data/synthetic.json"))
+        measure("render", render)
+
+        # Extracting the course infos from the tree pages of all versions, and merging pages and versions
+        measure("tree", lambda: curriculum_tree.rank_levels(curriculum_tree.merge_version_results(
+            curriculum_tree.merge_page_results(curriculum_tree.extract_courses_from_nodes(page) for page in node_pages)
+            for node_pages in dataset.node_pages_by_version)))
+    return results
+
+def benchmark_scale(dataset: Dataset, repeat: int) -> Dict[str, Dict[str, float]]:
+    """The fastest of `repeat` runs per stage, and the memory peaks of one more run with tracemalloc (which slows it down)."""
+    runs = [run_stages(dataset, trace_memory=False) for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        memory_run = run_stages(dataset, trace_memory=True)
+    finally:
+        tracemalloc.stop()
+    return {stage: {"seconds": min(run[stage]["seconds"] for run in runs), "peak_bytes": memory_run[stage]["peak_bytes"]}
+            for stage in STAGES}
+
+def find_regressions(history: List[Dict[str, Any]], entry: Dict[str, Any], threshold: float, baseline_runs: int) -> List[str]:
+    """
+    Compares `entry` to the median of the last `baseline_runs` entries of `history` from the same machine and Python
+    version, per scale, stage and metric. Runs that regressed themselves are not part of the baseline, so a regression
+    doesn't become the new normal by being repeated. Returns a description of every metric that got worse by more than
+    `threshold`.
+    """
+    comparable = [previous for previous in history if previous["machine"] == entry["machine"] and previous["python"] == entry["python"]
+                  and not previous.get("regressed", False)]
+    regressions = []
+    for scale, stage_results in entry["scales"].items():
+        for stage, metrics in stage_results["stages"].items():
+            for metric, min_regression in [("seconds", MIN_SECONDS_REGRESSION), ("peak_bytes", MIN_BYTES_REGRESSION)]:
+                previous_values = [previous["scales"][scale]["stages"][stage][metric] for previous in comparable
+                                   if stage in previous["scales"].get(scale, {}).get("stages", {})][-baseline_runs:]
+                if len(previous_values) == 0:
+                    continue
+                baseline = statistics.median(previous_values)
+                if metrics[metric] > baseline * (1 + threshold) and metrics[metric] - baseline > min_regression:
+                    regressions.append(f"{scale}x {stage} {metric}: {metrics[metric]:.3f} (baseline {baseline:.3f}, +{metrics[metric] / baseline - 1:.0%})")
+    return regressions
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(usage=
+    """
+    benchmark.py [-h] [--scales SCALE ...] [--repeat N] [--threshold FRACTION] [--history PATH] [--no_record]
+    Times the stages of a regeneration (update_course_database against a synthetic TUMonline, course store, join with
+    the curriculum tree, rendering, curriculum tree merge) on synthetic data at multiple times the size of the master-mathematics data, records the
+    results in a JSON history file, and fails if a stage got slower or needs more memory than in the previous runs.
+    """)
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100], help="The data sizes, as multiples of the master-mathematics data (default: 1 10 100)")
+    parser.add_argument("--repeat", default=3, type=int, help="How often to time every stage (the fastest run counts)")
+    parser.add_argument("--seed", default=0, type=int, help="Seed of the synthetic data")
+    parser.add_argument("--history", default=HISTORY_PATH, help="The JSON file with the results of previous runs")
+    parser.add_argument("--threshold", default=0.25, type=float, help="Fail if a stage is slower or has a higher memory peak than this fraction above the baseline")
+    parser.add_argument("--baseline_runs", default=5, type=int, help="The baseline is the median of this many previous runs")
+    parser.add_argument("--no_record", action="store_true", help="Don't add this run to the history (runs with regressions are added, but not used as a baseline)")
+    args = parser.parse_args()
+
+    entry: Dict[str, Any] = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(), "machine": platform.node(),
+                             "python": platform.python_version(), "seed": args.seed, "scales": {}}
+    for scale in args.scales:
+        dataset = generate_dataset(scale, args.seed)
+        print(f"\nScale {scale}x: {', '.join(f'{count} {name}' for name, count in dataset.sizes().items())}")
+        stage_results = benchmark_scale(dataset, args.repeat)
+        for stage, metrics in stage_results.items():
+            print(f"  {stage:<10} {metrics['seconds']:9.3f}s  peak {metrics['peak_bytes'] / 2**20:9.1f} MiB")
+        entry["scales"][str(scale)] = {"sizes": dataset.sizes(), "stages": stage_results}
+
+    history = []
+    if os.path.isfile(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    regressions = find_regressions(history, entry, args.threshold, args.baseline_runs)
+    entry["regressed"] = len(regressions) > 0
+    if not args.no_record:
+        with open(args.history + ".tmp", "w") as f:
+            json.dump(history + [entry], f, indent=1)
+        os.replace(args.history + ".tmp", args.history)
+        print(f"\nResults added to '{args.history}'")
+    if len(regressions) > 0:
+        print(f"\nRegressions (more than {args.threshold:.0%} above the median of the last {args.baseline_runs} runs):")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
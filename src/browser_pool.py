@@ -0,0 +1,168 @@
+import os
+import time
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.firefox.service import Service
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.wait import WebDriverWait
+
+from curriculum_tree import TREE_BASE_URL
+from curriculums import curriculums
+from instrumentation import metrics
+
+# Any TUMonline page with the language menu works for switching the language (it is stored in the session)
+LANGUAGE_PAGE_URL = f"{TREE_BASE_URL}/wbstpcs.showSpoTree?pStpStpNr={next(iter(curriculums.values())).curriculum_ids[0]}"
+# A worker restarts its browser after this many jobs, or when the browser's processes use more memory than this
+MAX_JOBS_PER_DRIVER = 200
+MAX_DRIVER_RSS_BYTES = 2 * 1024**3
+
+def wait_until_not_loading(driver):
+    WebDriverWait(driver, 60).until(
+        expected_conditions.invisibility_of_element_located((By.CLASS_NAME, "pageLoading"))
+    )
+    WebDriverWait(driver, 60).until(
+        expected_conditions.invisibility_of_element_located((By.ID, "id-loader"))
+    )
+
+class InstrumentedFirefox(webdriver.Firefox):
+    """Firefox driver that counts its WebDriver round trips (every command is one request to geckodriver) and their latencies."""
+    def execute(self, driver_command: str, params: dict | None = None) -> dict:
+        start = time.perf_counter()
+        try:
+            return super().execute(driver_command, params)
+        finally:
+            metrics.count("webdriver.round_trips")
+            metrics.observe("webdriver.round_trip_seconds", time.perf_counter() - start)
+
+def start_driver(gecko_driver_path: str, language_page_url: str = LANGUAGE_PAGE_URL) -> webdriver.Firefox:
+    """Starts a headless Firefox instance and switches TUMonline to English."""
+    options = webdriver.FirefoxOptions()
+    options.set_preference("intl.locale.requested", "en-US") # doesn't help though
+    options.add_argument("-headless")
+
+    metrics.count("webdriver.driver_starts")
+    driver = InstrumentedFirefox(service=Service(gecko_driver_path), options=options)
+    driver.set_script_timeout(20)
+    driver.implicitly_wait(5)
+
+    driver.get(language_page_url)
+    wait_until_not_loading(driver)
+
+    # Switch language to English
+    driver.find_element(By.TAG_NAME, "coa-desktop-language-menu").click()
+    WebDriverWait(driver, 30).until(expected_conditions.element_to_be_clickable(
+        (By.XPATH, "//button[@title='Sprache Englisch'] | //button[@title='Language English']"))).click()
+    return driver
+
+def _process_tree_rss_bytes(pid: int) -> int:
+    """Resident memory of a process and all its descendants (Firefox runs its content in child processes), via /proc."""
+    rss_bytes = 0
+    pids = [pid]
+    while len(pids) > 0:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                rss_bytes += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            pass # The process exited in the meantime
+    return rss_bytes
+
+def driver_rss_bytes(driver: webdriver.Firefox) -> int | None:
+    """Memory used by the driver's browser, or None where it can't be determined (no pid, or no /proc)."""
+    pid = driver.capabilities.get("moz:processID")
+    if pid is None or not os.path.isdir("/proc"):
+        return None
+    return _process_tree_rss_bytes(pid)
+
+# State of the browser worker processes (every worker owns one driver)
+_driver: webdriver.Firefox | None = None
+_driver_jobs = 0
+_gecko_driver_path = ""
+_language_page_url = ""
+
+def _quit_driver():
+    global _driver
+    if _driver is not None:
+        try:
+            _driver.quit()
+        except WebDriverException:
+            pass # Crashed already
+        _driver = None
+
+def _init_worker(gecko_driver_path: str, language_page_url: str):
+    global _gecko_driver_path, _language_page_url
+    _gecko_driver_path, _language_page_url = gecko_driver_path, language_page_url
+    # Pool workers don't run atexit handlers, but they run multiprocessing finalizers when they exit
+    Finalize(None, _quit_driver, exitpriority=10)
+    _worker_driver()
+
+def _driver_is_healthy(driver: webdriver.Firefox) -> bool:
+    try:
+        if driver.execute_script("return 1") != 1:
+            return False
+    except WebDriverException:
+        return False
+    rss_bytes = driver_rss_bytes(driver)
+    return rss_bytes is None or rss_bytes <= MAX_DRIVER_RSS_BYTES
+
+def _worker_driver() -> webdriver.Firefox:
+    """The worker's driver, restarted first if it crashed, leaks memory or has served MAX_JOBS_PER_DRIVER jobs."""
+    global _driver, _driver_jobs
+    if _driver is not None and (_driver_jobs >= MAX_JOBS_PER_DRIVER or not _driver_is_healthy(_driver)):
+        _quit_driver()
+    if _driver is None:
+        _driver = start_driver(_gecko_driver_path, _language_page_url)
+        _driver_jobs = 0
+    _driver_jobs += 1
+    return _driver
+
+def _run_job(function_and_argument: Tuple[Callable[[webdriver.Firefox, Any], Any], Any]) -> Any:
+    function, argument = function_and_argument
+    try:
+        return function(_worker_driver(), argument)
+    except WebDriverException:
+        # Retry once with a fresh browser (e.g. if the browser crashed during the job)
+        metrics.count("webdriver.job_retries")
+        _quit_driver()
+        return function(_worker_driver(), argument)
+    finally:
+        metrics.flush()
+
+class BrowserPool:
+    """
+    Pool of long-lived browser worker processes: every worker starts Firefox and switches TUMonline to English once,
+    and then serves jobs for any curriculum. A job is a module-level function called as `function(driver, argument)`
+    in a worker. Before every job, the worker health-checks its browser and restarts it if it crashed, uses more than
+    MAX_DRIVER_RSS_BYTES, or has served MAX_JOBS_PER_DRIVER jobs.
+
+    The pool can be shared by several threads (e.g. to fetch the trees of several curriculums at the same time).
+    """
+    def __init__(self, size: int, gecko_driver_path: str, language_page_url: str = LANGUAGE_PAGE_URL):
+        self.size = size
+        self._pool = Pool(size, initializer=_init_worker, initargs=(gecko_driver_path, language_page_url))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def map(self, function: Callable[[webdriver.Firefox, Any], Any], arguments: Iterable[Any]) -> List[Any]:
+        return self._pool.map(_run_job, [(function, argument) for argument in arguments])
+
+    def imap(self, function: Callable[[webdriver.Firefox, Any], Any], arguments: Iterable[Any]) -> Iterator[Any]:
+        """Like map, but yields the results in order as they become available."""
+        return self._pool.imap(_run_job, [(function, argument) for argument in arguments])
+
+    def close(self):
+        # Workers quit their browsers when they exit
+        self._pool.close()
+        self._pool.join()
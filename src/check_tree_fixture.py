@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from dataclasses import asdict
+
+import lxml.html
+
+from curriculum_tree import (CourseCurriculumInformation, extract_courses_from_nodes, merge_page_results,
+                             merge_version_results, rank_levels)
+from curriculums import curriculums
+from fetch_curriculum_tree_http import expand_page, tree_nodes
+
+# Checks the HTTP engine of the curriculum tree against a saved tree page: the page as it loads (with collapsed rule,
+# module and offer nodes), the AJAX responses of its plus and "previous year" buttons (requested via href and onclick
+# URLs), and the course infos the Selenium engine scraped for the same modules on TUMonline (taken from
+# data/curriculum_tree_master_mathematics.json). The HTTP engine has to replay the buttons and splice in their
+# responses (see fetch_curriculum_tree_http.replace_with_fragment) to arrive at the same course infos.
+# Also checks that merging the versions of a curriculum (curriculum_tree.merge_version_results) leaves a single
+# version unchanged.
+FIXTURE_DIRECTORY = "../fixtures/curriculum_tree_page"
+
+class SavedResponses:
+    """Stands in for TumOnlineClient: answers the AJAX requests of the page from the fixture's saved responses."""
+    def __init__(self, directory: str, responses: dict):
+        self.directory = directory
+        self.responses = responses
+
+    async def get_text(self, url: str, term_id: int | None = None) -> str:
+        if url not in self.responses:
+            raise KeyError(f"No saved response for {url}")
+        with open(os.path.join(self.directory, self.responses[url])) as f:
+            return f.read()
+
+def check_tree_fixture(directory: str = FIXTURE_DIRECTORY) -> bool:
+    """Returns whether the HTTP engine extracts the expected course infos from the saved page; prints the differences otherwise."""
+    with open(os.path.join(directory, "fixture.json")) as f:
+        fixture = json.load(f)
+    with open(os.path.join(directory, "page.html")) as f:
+        document = lxml.html.fromstring(f.read())
+    with open(os.path.join(directory, "expected.json")) as f:
+        expected_course_infos = json.load(f)
+
+    asyncio.run(expand_page(SavedResponses(directory, fixture["responses"]), document, fixture["url"]))
+    course_infos = rank_levels(merge_page_results([extract_courses_from_nodes(tree_nodes(document, fixture["url"]))]))
+    # Compare as the tree file stores them (with string keys in rule_node_names_by_levels)
+    actual_course_infos = json.loads(json.dumps([asdict(course_info) for course_info in course_infos]))
+
+    if actual_course_infos == expected_course_infos:
+        print(f"OK: the HTTP engine reproduces all {len(expected_course_infos)} course infos of '{directory}'")
+        return True
+    print(f"The HTTP engine's course infos differ from the expected ones of '{directory}':")
+    for index in range(max(len(actual_course_infos), len(expected_course_infos))):
+        actual = actual_course_infos[index] if index < len(actual_course_infos) else None
+        expected = expected_course_infos[index] if index < len(expected_course_infos) else None
+        if actual != expected:
+            print(f"  Entry {index}:\n    expected {json.dumps(expected)}\n    got      {json.dumps(actual)}")
+    return False
+
+def check_single_version_merge() -> bool:
+    """
+    Returns whether merging a single curriculum version (as with --first_version_only) keeps every committed curriculum
+    tree as it is, including modules listed in several areas; prints the curriculums where it doesn't otherwise.
+    """
+    ok = True
+    for curriculum in curriculums.values():
+        with open(curriculum.tree_file_path) as f:
+            course_infos = json.load(f)
+        merged_course_infos = [asdict(course_info) for course_info in merge_version_results([[CourseCurriculumInformation(**course_info) for course_info in course_infos]])]
+        if merged_course_infos != course_infos:
+            print(f"Merging the single version of '{curriculum.tree_file_path}' changed it: {len(course_infos)} entries before, {len(merged_course_infos)} after")
+            ok = False
+    if ok:
+        print(f"OK: merging a single version keeps all {len(curriculums)} curriculum trees unchanged")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(usage="check_tree_fixture.py [-h] [--fixture DIRECTORY]")
+    parser.add_argument("--fixture", default=FIXTURE_DIRECTORY, help="Directory with page.html, fixture.json (page URL and saved responses by URL) and expected.json")
+    args = parser.parse_args()
+    ok = check_tree_fixture(args.fixture)
+    ok = check_single_version_merge() and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+try:
+    import fcntl
+except ImportError: # Windows: stores are not locked between processes
+    fcntl = None
+
+import util
+from curriculums import Curriculum
+from instrumentation import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (
+    id INTEGER PRIMARY KEY,
+    term_id INTEGER NOT NULL,
+    term_name TEXT NOT NULL,
+    title TEXT NOT NULL,
+    course_type TEXT NOT NULL,
+    oldest_related_course_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS courses_term_id ON courses (term_id);
+CREATE INDEX IF NOT EXISTS courses_oldest_related_course_id ON courses (oldest_related_course_id);
+
+-- Materialized view of the courses, one row per equivalence class: its offerings (newest first; the same term
+-- appears once per course offered in it), the newest course, and the gap between the last two offerings.
+-- Kept up to date by every write to the courses table.
+CREATE TABLE IF NOT EXISTS equivalence_classes (
+    oldest_related_course_id INTEGER PRIMARY KEY,
+    newest_course_id INTEGER NOT NULL,
+    newest_term_id INTEGER NOT NULL,
+    previous_term_id INTEGER,
+    first_term_id INTEGER NOT NULL,
+    num_offerings INTEGER NOT NULL,
+    offering_gap INTEGER,
+    offering_term_ids TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS curriculum_tree (
+    position INTEGER PRIMARY KEY,
+    urls TEXT NOT NULL,
+    num_credits INTEGER,
+    module_name TEXT,
+    rule_node_names_by_levels TEXT NOT NULL
+);
+-- Course URLs of the curriculum tree, keyed by the last URL segment ("/<course id>"), to join them with the courses
+CREATE TABLE IF NOT EXISTS curriculum_tree_urls (
+    url_suffix TEXT PRIMARY KEY,
+    position INTEGER NOT NULL REFERENCES curriculum_tree (position)
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+@dataclass
+class EquivalenceClass:
+    """A row of the equivalence_classes view: answers "new", "rare" and "last offered in" without the course history."""
+    oldest_related_course_id: int
+    newest_course_id: int
+    newest_term_id: int
+    # The term of the second newest offering (None if the class was only offered once)
+    previous_term_id: int | None
+    first_term_id: int
+    num_offerings: int
+    # Distance (see util.term_id_distance) between the newest and the second newest offering
+    offering_gap: int | None
+    offering_term_ids: List[int]
+
+    def is_new(self) -> bool:
+        return self.num_offerings == 1
+
+    def is_rare(self, term_id: int) -> bool:
+        """Offered in `term_id`, and not in the two terms before."""
+        return self.offering_gap is not None and self.newest_term_id == term_id and self.offering_gap > 2
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class CourseStore:
+    """
+    SQLite-backed course database of one curriculum: the offered courses of all terms, and the curriculum tree.
+
+    The JSON files (all_offered_courses_path, tree_file_path) stay the diff-friendly, committed form of the data:
+    whenever a JSON file differs from the state the store last imported or exported (e.g. after a git pull), the
+    store re-imports it on opening. Opening a store that is up to date writes nothing. The import and the writing of
+    the JSON files take a lock, so processes opening the same store at the same time (e.g. render workers) don't
+    import it twice or read a half-written JSON file.
+    """
+    def __init__(self, curriculum: Curriculum):
+        self.curriculum = curriculum
+        self.connection = sqlite3.connect(curriculum.database_path)
+        with self._locked():
+            self.connection.executescript(SCHEMA)
+            self._import_json_if_changed("courses_json_sha256", curriculum.all_offered_courses_path, self._import_courses_json)
+            self._import_json_if_changed("tree_json_sha256", curriculum.tree_file_path, self._import_tree_json)
+            if self._get_meta("equivalence_classes_built") is None:
+                # Database from before the view existed
+                with self.connection:
+                    self._refresh_equivalence_classes()
+                    self._set_meta("equivalence_classes_built", "1")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.connection.close()
+
+    @contextmanager
+    def _locked(self):
+        """Holds an exclusive lock on the store (between processes) while the block runs."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.curriculum.database_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield # Closing the file releases the lock
+
+    def _get_meta(self, key: str) -> str | None:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, key: str, value: str):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _import_json_if_changed(self, meta_key: str, path: str, import_json):
+        if not os.path.isfile(path) or self._get_meta(meta_key) == (sha256 := _file_sha256(path)):
+            return
+        with self.connection, open(path) as f, metrics.span("course_store.import", "course_store", path=path):
+            metrics.count("bytes_read.course_store", os.fstat(f.fileno()).st_size)
+            import_json(json.load(f))
+            self._set_meta(meta_key, sha256)
+
+    def _import_courses_json(self, data: Dict[str, Any]):
+        self.connection.execute("DELETE FROM courses")
+        self._insert_course_dtos(data["courses"])
+        self._refresh_equivalence_classes()
+
+    def _import_tree_json(self, course_infos: List[Dict[str, Any]]):
+        self._insert_curriculum_tree(course_infos)
+
+    def _insert_course_dtos(self, course_dtos: Iterable[Dict[str, Any]]):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO courses (id, term_id, term_name, title, course_type, oldest_related_course_id) VALUES (?, ?, ?, ?, ?, ?)",
+            ((int(dto["id"]), int(dto["semesterDto"]["id"]), dto["termName"], dto["title"], dto["courseTypeDto"]["key"],
+              int(dto["oldestRelatedCourseId"])) for dto in course_dtos))
+
+    def term_ids(self) -> Set[int]:
+        return {term_id for (term_id,) in self.connection.execute("SELECT DISTINCT term_id FROM courses")}
+
+    def course_dtos(self, newest_first: bool = False) -> List[Dict[str, Any]]:
+        """Returns the courses in the same format as the all_offered_courses JSON, sorted by term and id."""
+        order = "term_id DESC, id" if newest_first else "term_id, id"
+        return [
+            {"courseTypeDto": {"key": course_type}, "termName": term_name, "semesterDto": {"id": term_id},
+             "title": title, "id": course_id, "oldestRelatedCourseId": oldest_related_course_id}
+            for course_id, term_id, term_name, title, course_type, oldest_related_course_id in self.connection.execute(
+                f"SELECT id, term_id, term_name, title, course_type, oldest_related_course_id FROM courses ORDER BY {order}")
+        ]
+
+    def upsert_term(self, term_id: int, course_dtos: List[Dict[str, Any]]):
+        """
+        Replaces the courses of one term in a single transaction, leaving all other terms untouched. Only the
+        equivalence classes of the term's old and new courses are updated in the equivalence_classes view.
+        """
+        with self.connection:
+            affected_classes = {oldest for (oldest,) in self.connection.execute(
+                "SELECT DISTINCT oldest_related_course_id FROM courses WHERE term_id = ?", (term_id,))}
+            affected_classes.update(int(dto["oldestRelatedCourseId"]) for dto in course_dtos)
+            new_course_ids = [int(dto["id"]) for dto in course_dtos]
+            self.connection.execute(
+                f"DELETE FROM courses WHERE term_id = ? AND id NOT IN ({', '.join('?' * len(new_course_ids))})",
+                (term_id, *new_course_ids))
+            self._insert_course_dtos(course_dtos)
+            self._refresh_equivalence_classes(affected_classes)
+
+    def _refresh_equivalence_classes(self, oldest_related_course_ids: Set[int] | None = None):
+        """Recomputes the equivalence_classes rows of the given classes (or of all classes) from the courses."""
+        if oldest_related_course_ids is None:
+            self.connection.execute("DELETE FROM equivalence_classes")
+            where, parameters = "", ()
+        else:
+            parameters = tuple(oldest_related_course_ids)
+            placeholders = ", ".join("?" * len(parameters))
+            self.connection.execute(f"DELETE FROM equivalence_classes WHERE oldest_related_course_id IN ({placeholders})", parameters)
+            where = f"WHERE oldest_related_course_id IN ({placeholders})"
+        offerings = self.connection.execute(
+            f"SELECT oldest_related_course_id, id, term_id FROM courses {where} ORDER BY oldest_related_course_id, term_id DESC, id", parameters)
+        rows = []
+        for oldest_related_course_id, class_offerings in itertools.groupby(offerings, key=lambda offering: offering[0]):
+            course_ids_and_term_ids = [(course_id, term_id) for _, course_id, term_id in class_offerings]
+            term_ids = [term_id for _, term_id in course_ids_and_term_ids]
+            previous_term_id = term_ids[1] if len(term_ids) > 1 else None
+            rows.append((oldest_related_course_id, course_ids_and_term_ids[0][0], term_ids[0], previous_term_id, term_ids[-1], len(term_ids),
+                         util.term_id_distance(term_ids[0], previous_term_id) if previous_term_id is not None else None, json.dumps(term_ids)))
+        self.connection.executemany("INSERT INTO equivalence_classes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def newest_courses(self) -> List[Tuple[Dict[str, Any], EquivalenceClass]]:
+        """
+        The newest course of every equivalence class (in the format of course_dtos) with its class, sorted by term
+        (newest first) and id.
+        """
+        return [
+            ({"courseTypeDto": {"key": course_type}, "termName": term_name, "semesterDto": {"id": term_id},
+              "title": title, "id": course_id, "oldestRelatedCourseId": oldest_related_course_id},
+             EquivalenceClass(oldest_related_course_id, course_id, term_id, previous_term_id, first_term_id, num_offerings,
+                              offering_gap, json.loads(offering_term_ids)))
+            for (course_id, term_id, term_name, title, course_type, oldest_related_course_id,
+                 previous_term_id, first_term_id, num_offerings, offering_gap, offering_term_ids) in self.connection.execute(
+                """SELECT c.id, c.term_id, c.term_name, c.title, c.course_type, e.oldest_related_course_id,
+                          e.previous_term_id, e.first_term_id, e.num_offerings, e.offering_gap, e.offering_term_ids
+                   FROM equivalence_classes e JOIN courses c ON c.id = e.newest_course_id
+                   ORDER BY e.newest_term_id DESC, e.newest_course_id""")
+        ]
+
+    def export_json(self):
+        """Writes all courses to all_offered_courses_path, sorted and with indent=0 (newlines; more diff-friendly)."""
+        with self._locked():
+            with open(self.curriculum.all_offered_courses_path, "w") as f:
+                json.dump({"courses": self.course_dtos()}, f, indent=0)
+            metrics.count("bytes_written.course_store", os.path.getsize(self.curriculum.all_offered_courses_path))
+            with self.connection:
+                self._set_meta("courses_json_sha256", _file_sha256(self.curriculum.all_offered_courses_path))
+
+    def _insert_curriculum_tree(self, course_infos: List[Dict[str, Any]]):
+        self.connection.execute("DELETE FROM curriculum_tree_urls")
+        self.connection.execute("DELETE FROM curriculum_tree")
+        self.connection.executemany(
+            "INSERT INTO curriculum_tree (position, urls, num_credits, module_name, rule_node_names_by_levels) VALUES (?, ?, ?, ?, ?)",
+            ((position, json.dumps(info["urls"]), info["num_credits"], info["module_name"], json.dumps(info["rule_node_names_by_levels"]))
+             for position, info in enumerate(course_infos)))
+        # If a URL appears in several entries, the last one wins (like building a dict from the tree)
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO curriculum_tree_urls (url_suffix, position) VALUES (?, ?)",
+            ((url[url.rfind("/"):], position) for position, info in enumerate(course_infos) for url in info["urls"]))
+
+    def replace_curriculum_tree(self, course_infos: List[Dict[str, Any]]):
+        """Stores a freshly fetched curriculum tree and writes it to tree_file_path (indent=0, more diff-friendly)."""
+        with self._locked():
+            with open(self.curriculum.tree_file_path, "w") as f:
+                json.dump(course_infos, f, indent=0)
+            metrics.count("bytes_written.course_store", os.path.getsize(self.curriculum.tree_file_path))
+            # Store the tree as it reads back from the JSON file (e.g. with string keys in rule_node_names_by_levels)
+            with self.connection, open(self.curriculum.tree_file_path) as f:
+                self._insert_curriculum_tree(json.load(f))
+                self._set_meta("tree_json_sha256", _file_sha256(self.curriculum.tree_file_path))
+
+    def curriculum_tree(self) -> List[Dict[str, Any]]:
+        return [
+            {"urls": json.loads(urls), "num_credits": num_credits, "module_name": module_name,
+             "rule_node_names_by_levels": json.loads(rule_node_names_by_levels)}
+            for urls, num_credits, module_name, rule_node_names_by_levels in self.connection.execute(
+                "SELECT urls, num_credits, module_name, rule_node_names_by_levels FROM curriculum_tree ORDER BY position")
+        ]
+
+    def curriculum_tree_positions_by_url_suffix(self) -> Dict[str, int]:
+        """Maps the last segment ("/<course id>") of every course URL in the curriculum tree to its tree position."""
+        return dict(self.connection.execute("SELECT url_suffix, position FROM curriculum_tree_urls"))
@@ -0,0 +1,250 @@
+import datetime
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, List, Tuple
+
+from course_store import CourseStore
+from curriculums import Curriculum
+from instrumentation import metrics
+from tumonline_client import TUMONLINE_BASE_URL
+
+TREE_BASE_URL = TUMONLINE_BASE_URL
+# Per-page results of previous scrapes, see load_page_checkpoint
+TREE_CHECKPOINT_DIRECTORY = "../data/tree_checkpoints"
+
+# XPath selectors for the curriculum tree pages, shared by the Selenium and the HTTP engine. Selected (via the same
+# XPath so they are ordered):
+# - the module names indicating the curriculum path (Rule nodes), and other nodes to deactivate previous Rule nods
+# - the rows belonging to credits (rows containing Module nodes)
+# - hrefs pointing to course links.
+NODE_SPAN_SELECTOR = "//tr//td[1]//span//span[contains(@title, ' node')]"
+MODULE_SELECTOR = "//tr[td[1]//span//span[contains(@title, 'Module node')]]"
+COURSE_LINK_SELECTOR = "//a[contains(@href, 'pages/slc.tm.cp/course/')]"
+MODULE_OR_COURSE_LINK_SELECTOR = f"{NODE_SPAN_SELECTOR} | {MODULE_SELECTOR} | {COURSE_LINK_SELECTOR}"
+# Relative to a module row
+MODULE_NAME_SELECTOR = "td[1]//span//span"
+MODULE_CREDITS_SELECTOR = "td[4]//span"
+
+def offer_node_plus_buttons_selector(node_title: str) -> str:
+    # Find table rows that contain an offer node, and select their descendant plus buttons
+    offer_node_selector = f"span[contains(@title, '{node_title}')]"
+    plus_button_selector = "a[contains(@class, 'KnotenLink')][not(contains(@style, 'tee_minus'))]"
+    return f"//tr[.//{offer_node_selector}]//{plus_button_selector}"
+
+# Find course tables with no entries, and locate their "previous year" buttons
+NO_ENTRIES_TABLE_SELECTOR = "td[contains(text(), 'No entries')]"
+PREVIOUS_YEAR_BUTTON_SELECTOR = "a[contains(@title, 'Show previous academic year with entries')]"
+PREVIOUS_YEAR_BUTTONS_SELECTOR = f"//tr[.//{NO_ENTRIES_TABLE_SELECTOR}]//{PREVIOUS_YEAR_BUTTON_SELECTOR}"
+
+def tree_page1_url(curriculum_id: str) -> str:
+    # Node filter "All (expanded)"
+    return f"{TREE_BASE_URL}/wbstpcs.showSpoTree?pStpStpNr={curriculum_id}&pFilterType=20&pPageNr=&pStpKnotenNr=&pStartSemester=W"
+
+def tree_page_url(page1_url: str, page: int) -> str:
+    return page1_url.replace("pPageNr=", f"pPageNr={page}")
+
+@dataclass
+class CourseCurriculumInformation:
+    urls: List[str]
+    num_credits: int | None
+    module_name: str | None
+    rule_node_names_by_levels: Dict[int, str | None]
+
+# The course infos of one page, as well as the Credits of the last entry on the page (since that might carry over
+# to the next page), the module name of the last entry (same here), and the rule nodes active at the end of the page
+PageResult = Tuple[List[CourseCurriculumInformation], int | None, str | None, Dict[int, str | None]]
+
+def extract_courses_from_nodes(nodes: Iterable[Dict[str, Any]]) -> PageResult:
+    """
+    Associates course links to their number of credits, module name and curriculum path, given the elements matched
+    by MODULE_OR_COURSE_LINK_SELECTOR in document order. Every node is a dict with a "kind" and kind-specific fields:
+    - "node" (rule node or other node): "title" (the title attribute), "text", "x" (indent of the node)
+    - "module" (module node row): "name", "credits" (text of the credits cell, or None)
+    - "course" (course link): "href"
+    """
+    current_credits = None
+    current_module_name = None
+    current_course = None
+    course_infos: List[CourseCurriculumInformation] = []
+    # Rule nodes correspond to groups (electives group, subject areas, "Theory", and similar)
+    current_rule_node_names_by_levels: Dict[int, str | None] = {}
+
+    # By sequentially going through the results, we can associate course links to their amount of credits.
+    for node in nodes:
+        if node["kind"] == "node": # Rule node or other node
+            if "Rule node" in node["title"]:
+                # we identify the levels of rule nodes in the path based on their indent
+                current_rule_node_names_by_levels[node["x"]] = node["text"]
+            else:
+                # reset rule node name at that level (so previous rule nodes don't stay active)
+                current_rule_node_names_by_levels[node["x"]] = None
+        elif node["kind"] == "module": # Module node row
+            current_module_name = node["name"]
+            current_credits = int(node["credits"]) if node["credits"] is not None and node["credits"].isdecimal() else None
+            current_course = None
+        else: # Link to course
+            if current_course is None:
+                current_course = CourseCurriculumInformation(
+                    urls=[node["href"]], num_credits=current_credits, module_name=current_module_name,
+                    rule_node_names_by_levels=current_rule_node_names_by_levels.copy()
+                )
+                course_infos.append(current_course)
+            else:
+                current_course.urls.append(node["href"])
+
+    return (course_infos, current_credits, current_module_name, current_rule_node_names_by_levels)
+
+def page_fingerprint(nodes: Iterable[Dict[str, Any]]) -> str:
+    """
+    Fingerprint of a tree page before expanding it, given its nodes (see extract_courses_from_nodes) at that point:
+    if it is unchanged, the page's checkpoint from the same term is reused instead of expanding the page again.
+    """
+    return hashlib.sha256(json.dumps(list(nodes), sort_keys=True).encode()).hexdigest()
+
+def checkpoint_term(date: datetime.date | None = None) -> str:
+    """
+    The term whose offerings the tree shows on `date` (default: today), e.g. "2024W" for the winter term 2024/25.
+    The offer nodes are collapsed when fingerprinting a page, so checkpoints only stay valid within one term.
+    """
+    date = date or datetime.date.today()
+    if 4 <= date.month <= 9:
+        return f"{date.year}S"
+    return f"{date.year if date.month >= 10 else date.year - 1}W"
+
+@dataclass
+class PageCheckpoint:
+    fingerprint: str
+    # The scrape (see start_tree_run) that wrote the checkpoint
+    run: str
+    result: PageResult
+
+def _page_checkpoint_path(curriculum_id: str, page: int) -> str:
+    return f"{TREE_CHECKPOINT_DIRECTORY}/{curriculum_id}/page-{page}.json"
+
+def _tree_run_path(curriculum_id: str) -> str:
+    return f"{TREE_CHECKPOINT_DIRECTORY}/{curriculum_id}/run.json"
+
+def _write_json_atomically(path: str, content: Any, metrics_name: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(content, f)
+    metrics.count(metrics_name, os.path.getsize(path + ".tmp"))
+    os.replace(path + ".tmp", path)
+
+def start_tree_run(curriculum_id: str, resume: bool = False) -> str:
+    """
+    Starts a scrape of a curriculum version's tree and returns its run id, under which its page checkpoints are saved.
+    With `resume`, the run id of the last scrape is returned instead if that scrape was interrupted (so its already
+    scraped pages can be reused without loading them, see load_page_checkpoint).
+    """
+    path = _tree_run_path(curriculum_id)
+    if resume and os.path.isfile(path):
+        with open(path) as f:
+            tree_run = json.load(f)
+        if not tree_run["finished"]:
+            return tree_run["run"]
+    run = f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+    _write_json_atomically(path, {"run": run, "finished": False}, "bytes_written.tree_checkpoints")
+    return run
+
+def finish_tree_run(curriculum_id: str, run: str):
+    """Marks the scrape `run` of a curriculum version's tree as finished, so it is not resumed again."""
+    _write_json_atomically(_tree_run_path(curriculum_id), {"run": run, "finished": True}, "bytes_written.tree_checkpoints")
+
+def load_page_checkpoint(curriculum_id: str, page: int, term: str | None = None) -> PageCheckpoint | None:
+    """
+    Returns the checkpoint stored for a page of a curriculum version, if any was stored in `term` (default: the
+    current term, see checkpoint_term).
+    """
+    path = _page_checkpoint_path(curriculum_id, page)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+        metrics.count("bytes_read.tree_checkpoints", os.fstat(f.fileno()).st_size)
+    if checkpoint.get("term") != (term or checkpoint_term()):
+        return None
+    # JSON object keys are strings, the levels of rule nodes are ints
+    def levels_from_json(rule_node_names_by_levels: Dict[str, str | None]) -> Dict[int, str | None]:
+        return {int(level): name for level, name in rule_node_names_by_levels.items()}
+    course_infos = [CourseCurriculumInformation(**{**course_info, "rule_node_names_by_levels": levels_from_json(course_info["rule_node_names_by_levels"])})
+                    for course_info in checkpoint["course_infos"]]
+    return PageCheckpoint(checkpoint["fingerprint"], checkpoint["run"],
+                          (course_infos, checkpoint["last_credits"], checkpoint["last_module_name"],
+                           levels_from_json(checkpoint["last_rule_node_names_by_levels"])))
+
+def save_page_checkpoint(curriculum_id: str, page: int, run: str, fingerprint: str, result: PageResult):
+    """Stores the result of a page (before merge_page_results, which modifies the course infos)."""
+    course_infos, last_credits, last_module_name, last_rule_node_names_by_levels = result
+    _write_json_atomically(_page_checkpoint_path(curriculum_id, page),
+                           {"fingerprint": fingerprint, "run": run, "term": checkpoint_term(),
+                            "course_infos": [asdict(course_info) for course_info in course_infos],
+                            "last_credits": last_credits, "last_module_name": last_module_name,
+                            "last_rule_node_names_by_levels": last_rule_node_names_by_levels},
+                           "bytes_written.tree_checkpoints")
+
+def merge_page_results(results: Iterable[PageResult]) -> List[CourseCurriculumInformation]:
+    """Merges the results of all pages of a curriculum tree (in page order) into one list."""
+    # The first course nodes on page n+1 can belong to the last module node on page n (or even n-1, etc. if the module node has enough entries).
+    # Loop through all pages and set the module node of entries without module node that are at the page start to the previous page's last module node.
+    last_credits_on_previous_page = None
+    last_module_name_on_previous_page = None
+    last_rule_node_names_by_levels_on_previous_page: Dict[int, str | None] = {}
+    all_curriculum_course_infos = []
+    for (curriculum_course_infos, last_credits_on_page,
+         last_module_name_on_page, last_rule_node_names_by_levels) in results:
+        for course_info in curriculum_course_infos:
+            if course_info.num_credits is not None:
+                break
+            assert last_credits_on_previous_page is not None
+            course_info.num_credits = last_credits_on_previous_page
+            course_info.module_name = last_module_name_on_previous_page
+        for course_info in curriculum_course_infos:
+            course_info.rule_node_names_by_levels = {**last_rule_node_names_by_levels_on_previous_page, **course_info.rule_node_names_by_levels}
+            course_info.rule_node_names_by_levels = {key: value for key, value in course_info.rule_node_names_by_levels.items() if value is not None}
+
+        last_module_name_on_previous_page = last_module_name_on_page or last_module_name_on_previous_page
+        last_credits_on_previous_page = last_credits_on_page or last_credits_on_previous_page
+        last_rule_node_names_by_levels_on_previous_page = {**last_rule_node_names_by_levels_on_previous_page, **last_rule_node_names_by_levels}
+
+        all_curriculum_course_infos.extend(curriculum_course_infos)
+    return all_curriculum_course_infos
+
+def merge_version_results(course_infos_by_version: Iterable[List[CourseCurriculumInformation]]) -> List[CourseCurriculumInformation]:
+    """
+    Merges the trees of several curriculum versions, given newest version first (see curriculums.newest_versions_first).
+    The entries of every version are kept as they are (a module can be listed in several areas of the same version),
+    except for course URLs that a newer version already lists: these are removed, so where versions disagree, the
+    newest version's path wins. Entries of older versions whose URLs all appeared already are dropped.
+    """
+    newer_versions_urls = set()
+    merged_course_infos = []
+    for course_infos in course_infos_by_version:
+        version_urls = set()
+        for course_info in course_infos:
+            version_urls.update(course_info.urls)
+            new_urls = [url for url in course_info.urls if url not in newer_versions_urls]
+            if len(new_urls) == 0 and len(course_info.urls) > 0:
+                continue
+            course_info.urls = new_urls
+            merged_course_infos.append(course_info)
+        newer_versions_urls.update(version_urls)
+    return merged_course_infos
+
+def rank_levels(course_infos: List[CourseCurriculumInformation]) -> List[CourseCurriculumInformation]:
+    """
+    Replaces the levels of the rule nodes in `course_infos` (their indents, which the engines measure differently:
+    rendered x positions vs. left padding in the HTML) by their rank among all levels of the tree, 0 being the
+    outermost, and orders the rule node names by it. Both engines write the same levels this way.
+    """
+    ranks = {level: rank for rank, level in enumerate(sorted({level for course_info in course_infos for level in course_info.rule_node_names_by_levels}))}
+    for course_info in course_infos:
+        course_info.rule_node_names_by_levels = {ranks[level]: name for level, name in sorted(course_info.rule_node_names_by_levels.items())}
+    return course_infos
+
+def save_curriculum_tree(curriculum: Curriculum, course_infos: List[CourseCurriculumInformation]):
+    with CourseStore(curriculum) as store:
+        store.replace_curriculum_tree([asdict(course_info) for course_info in course_infos])
+        print(f"""Results written to '{curriculum.database_path}' and json file '{curriculum.tree_file_path}'""")
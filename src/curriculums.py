@@ -1,5 +1,11 @@
+import functools
+import json
+import re
+import unicodedata
+from collections import defaultdict
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List
+from datetime import date
+from typing import Any, Callable, Dict, List, Tuple
 
 
 @dataclass
@@ -8,8 +14,12 @@ class Curriculum:
     curriculum_ids: List[str]
     tree_file_path: str
     all_offered_courses_path: str
+    # SQLite course database (see course_store.py); the JSON files above are its diff-friendly export
+    database_path: str
     extract_area: Callable[[List[str]], str | None]
     extra_columns: Dict[str, Callable[[Any], str]]
+    # File name prefix of the generated HTML tables in docs/ (e.g. "dea" -> "dea-ss26.html", "dea-all.html")
+    output_file_prefix: str
 
 
 def extract_area_master_information_systems(curriculum_path: List[str]) -> str | None:
@@ -84,41 +94,139 @@ curriculums: Dict[str, Curriculum] = {
     "bachelor-informatics": Curriculum(
         heading="Lectures in Bachelor Informatics",
         all_offered_courses_path="../data/all_offered_courses_bachelor_informatics.json",
+        database_path="../data/courses_bachelor_informatics.sqlite3",
         tree_file_path="../data/curriculum_tree_bachelor_informatics.json",
         curriculum_ids=["5371", "4998", "4748", "4591", "4283", "1304"],
         extract_area=extract_area_informatics_bachelor,
         extra_columns={},
+        output_file_prefix="bachelor-informatics",
     ),
     "master-informatics": Curriculum(
         heading="Elective Modules in Master Informatics",
         all_offered_courses_path="../data/all_offered_courses_master_informatics.json",
+        database_path="../data/courses_master_informatics.sqlite3",
         tree_file_path="../data/curriculum_tree_master_informatics.json",
         curriculum_ids=["5217", "4731", "4594", "4271", "2612"],
         extract_area=extract_area_informatics_master,
         extra_columns=EXTRA_COLUMNS_INFORMATICS,
+        output_file_prefix="master-informatics",
     ),
     "master-dea": Curriculum(
         heading="Lectures in Master Data Engineering and Analytics",
         all_offered_courses_path="../data/all_offered_courses_dea.json",
+        database_path="../data/courses_dea.sqlite3",
         tree_file_path="../data/curriculum_tree_dea.json",
         curriculum_ids=["4733", "4567"],
         extract_area=extract_area_dea,
         extra_columns={},
+        output_file_prefix="dea",
     ),
     "master-information-systems": Curriculum(
         heading="Lectures in Master Information Systems",
         all_offered_courses_path="../data/all_offered_courses_master_information_systems.json",
+        database_path="../data/courses_master_information_systems.sqlite3",
         tree_file_path="../data/curriculum_tree_master_information_systems.json",
-        curriculum_ids=["4997", "404", "4368", "4716", "4734", "4918", "5013"],
+        curriculum_ids=["4997", "5013", "4918", "4734", "4716", "4368", "404"],
         extract_area=extract_area_master_information_systems,
         extra_columns={},
+        output_file_prefix="master-information-systems",
     ),
     "master-mathematics": Curriculum(
         heading="Lectures in Master Mathematics",
         all_offered_courses_path="../data/all_offered_courses_master_mathematics.json",
+        database_path="../data/courses_master_mathematics.sqlite3",
         tree_file_path="../data/curriculum_tree_master_mathematics.json",
         curriculum_ids=["5244", "4852", "4407"],
         extract_area=extract_area_mathematics_master,
         extra_columns={},
+        output_file_prefix="master-mathematics",
     ),
 }
+
+
+# All curriculum versions at TUM (see its first line), from which the batch mode of regenerate.py builds a curriculum
+# for every study program
+CURRICULUM_LIST_PATH = "../data/curriculums-list.json"
+# Data files and tables of these programs go to data/programs/ and docs/programs/
+PROGRAMS_DIRECTORY = "programs"
+# Levels of the curriculum path that make up the area of a course in extract_area_top_levels
+DEFAULT_AREA_LEVELS = 2
+# The version in a curriculum version's name, e.g. " [20231]" in "Informatik [20231], Master of Science"
+CURRICULUM_VERSION_REGEX = re.compile(r"\s*\[[^\]]*\]")
+
+
+def extract_area_top_levels(curriculum_path: List[str], num_levels: int = DEFAULT_AREA_LEVELS) -> str | None:
+    """Generic area extractor for programs without one of their own: the top `num_levels` rule nodes of the path."""
+    if len(curriculum_path) == 0:
+        return None
+    return ": ".join(curriculum_path[:num_levels])
+
+
+def program_key(program_name: str) -> str:
+    """A file-name friendly key for a program, e.g. "informatik-master-of-science"."""
+    ascii_name = unicodedata.normalize("NFKD", program_name).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", ascii_name.lower()).strip("-")
+
+
+def load_curriculum_versions(list_path: str = CURRICULUM_LIST_PATH) -> List[Dict[str, Any]]:
+    with open(list_path) as f:
+        f.readline() # "// Retrieved at: <URL>"
+        return [resource["content"]["cmCurriculumVersionDto"] for resource in json.load(f)["resource"]]
+
+
+def version_recency(version: Dict[str, Any]) -> Tuple[str, str, int]:
+    """Sort key of curriculum versions (from the curriculum list): by validFrom, then validUntil (open-ended last), then id."""
+    return (version["validFrom"], version.get("validUntil", "9999-12-31"), version["id"])
+
+
+def newest_versions_first(curriculum_ids: List[str], list_path: str = CURRICULUM_LIST_PATH) -> List[str]:
+    """
+    `curriculum_ids` ordered newest version first by their dates in the curriculum list (merge_version_results in
+    curriculum_tree.py lets the first version win). Ids the list does not know keep their order.
+    """
+    versions_by_id = {str(version["id"]): version for version in load_curriculum_versions(list_path)}
+    if not all(curriculum_id in versions_by_id for curriculum_id in curriculum_ids):
+        return curriculum_ids
+    return sorted(curriculum_ids, key=lambda curriculum_id: version_recency(versions_by_id[curriculum_id]), reverse=True)
+
+
+def program_curriculums(list_path: str = CURRICULUM_LIST_PATH, offered_on: str | None = None,
+                        area_levels: int = DEFAULT_AREA_LEVELS) -> Dict[str, Curriculum]:
+    """
+    A curriculum for every study program in the curriculum list at `list_path`: its versions are grouped by name
+    (without the version), newest first, and areas are extracted with extract_area_top_levels. Programs that none
+    of `curriculums` covers and that have a version valid on `offered_on` (ISO date, default: today) are included.
+    """
+    versions = load_curriculum_versions(list_path)
+    offered_on = offered_on or date.today().isoformat()
+    known_curriculum_ids = {curriculum_id for curriculum in curriculums.values() for curriculum_id in curriculum.curriculum_ids}
+
+    versions_by_program: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for version in versions:
+        name = next((translation["value"] for translation in version["name"]["translations"]["translation"]
+                     if translation["lang"] == "en" and "value" in translation), version["name"]["value"])
+        versions_by_program[CURRICULUM_VERSION_REGEX.sub("", name)].append(version)
+
+    programs: Dict[str, Curriculum] = {}
+    for name, program_versions in sorted(versions_by_program.items()):
+        if any(str(version["id"]) in known_curriculum_ids for version in program_versions):
+            continue
+        # A program is offered while one of its versions is valid (open-ended versions have no validUntil). Not
+        # offeredUntil: versions stay offered for decades after they expire, to students enrolled in them.
+        if not any(version["validFrom"] <= offered_on <= version.get("validUntil", "9999-12-31") for version in program_versions):
+            continue
+        program_versions.sort(key=version_recency, reverse=True)
+        key = program_key(name)
+        if key in programs:
+            key = f"{key}-{program_versions[0]['id']}"
+        programs[key] = Curriculum(
+            heading=f"Lectures in {name}",
+            all_offered_courses_path=f"../data/{PROGRAMS_DIRECTORY}/all_offered_courses_{key}.json",
+            database_path=f"../data/{PROGRAMS_DIRECTORY}/courses_{key}.sqlite3",
+            tree_file_path=f"../data/{PROGRAMS_DIRECTORY}/curriculum_tree_{key}.json",
+            curriculum_ids=[str(version["id"]) for version in program_versions],
+            extract_area=functools.partial(extract_area_top_levels, num_levels=area_levels),
+            extra_columns={},
+            output_file_prefix=f"{PROGRAMS_DIRECTORY}/{key}",
+        )
+    return programs
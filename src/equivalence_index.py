@@ -0,0 +1,69 @@
+import json
+import os
+from typing import Dict, Iterable, List
+
+class EquivalenceIndex:
+    """
+    Union-find index of course equivalence classes, shared by all curriculums and persisted as JSON at `path`.
+
+    Every class is identified by its oldest related course id (the "oldestRelatedCourseId" of the course database).
+    Courses only need to be looked up (via the same-courses endpoint) if they are not in the index yet.
+    """
+    def __init__(self, path: str = "../data/equivalence_index.json"):
+        self.path = path
+        self._parent: Dict[int, int] = {}
+        # Oldest related course id of each class, stored at the class's root
+        self._oldest_related_course_id: Dict[int, int] = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                for oldest_related_course_id, course_ids in json.load(f)["classes"].items():
+                    self.add_related_courses(course_ids, int(oldest_related_course_id))
+
+    def __contains__(self, course_id: int) -> bool:
+        return course_id in self._parent
+
+    def __len__(self) -> int:
+        return len(self._parent)
+
+    def _find(self, course_id: int) -> int:
+        root = course_id
+        while self._parent[root] != root:
+            root = self._parent[root]
+        # Path compression: point all nodes on the path directly to the root
+        while self._parent[course_id] != root:
+            self._parent[course_id], course_id = root, self._parent[course_id]
+        return root
+
+    def oldest_related_course_id(self, course_id: int) -> int | None:
+        if course_id not in self._parent:
+            return None
+        return self._oldest_related_course_id[self._find(course_id)]
+
+    def add_related_courses(self, course_ids: Iterable[int], oldest_related_course_id: int) -> int:
+        """
+        Puts all `course_ids` into the same class (merging the classes they are in already), and returns the
+        oldest related course id of the merged class.
+        """
+        roots = set()
+        for course_id in course_ids:
+            if course_id not in self._parent:
+                self._parent[course_id] = course_id
+                self._oldest_related_course_id[course_id] = oldest_related_course_id
+            roots.add(self._find(course_id))
+        if len(roots) == 0:
+            return oldest_related_course_id
+        root, *other_roots = roots
+        for other_root in other_roots:
+            self._parent[other_root] = root
+            oldest_related_course_id = min(oldest_related_course_id, self._oldest_related_course_id.pop(other_root))
+        self._oldest_related_course_id[root] = min(oldest_related_course_id, self._oldest_related_course_id[root])
+        return self._oldest_related_course_id[root]
+
+    def save(self):
+        classes: Dict[int, List[int]] = {}
+        for course_id in self._parent:
+            classes.setdefault(self.oldest_related_course_id(course_id), []).append(course_id) # type: ignore
+        with open(self.path + ".tmp", "w") as f:
+            # Sorted and with indent=0 (newlines) to keep diffs small
+            json.dump({"classes": {str(oldest): sorted(course_ids) for oldest, course_ids in sorted(classes.items())}}, f, indent=0)
+        os.replace(self.path + ".tmp", self.path)
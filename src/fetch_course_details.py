@@ -1,14 +1,13 @@
 from dataclasses import dataclass
 from typing import List
 
-import aiohttp
+from tumonline_client import TUMONLINE_REST_BASE_URL, TumOnlineClient
 
 @dataclass
 class CourseIdWithSemesterId:
     course_id: int
     semester_id: int
 
-async def fetch_related_course_ids(session: aiohttp.ClientSession, course_id) -> List[int]:
-    response = await session.get(f"https://campus.tum.de/tumonline/ee/rest/slc.tm.cp/student/courses/same-courses/{course_id}")
-    responseJson = await response.json()
+async def fetch_related_course_ids(client: TumOnlineClient, course_id, term_id: int | None = None) -> List[int]:
+    responseJson = await client.get_json(f"{TUMONLINE_REST_BASE_URL}/slc.tm.cp/student/courses/same-courses/{course_id}", term_id)
     return [int(course["id"]) for course in sorted(responseJson["courses"], key=lambda c: int(c["semesterDto"]["id"]), reverse=True)]
@@ -1,22 +1,26 @@
 import argparse
-import atexit
-import json
+import asyncio
 import time
-from dataclasses import asdict, dataclass
-from multiprocessing import Pool
-from typing import Dict, List, Tuple
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
 
-import selenium
-import selenium.webdriver
 import tqdm
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.service import Service
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.support.wait import WebDriverWait
 from webdriver_manager.firefox import GeckoDriverManager
 
-from curriculums import Curriculum, curriculums
+import fetch_curriculum_tree_http
+import instrumentation
+from browser_pool import BrowserPool, wait_until_not_loading
+from curriculum_tree import (MODULE_CREDITS_SELECTOR, MODULE_NAME_SELECTOR, MODULE_OR_COURSE_LINK_SELECTOR,
+                             PREVIOUS_YEAR_BUTTONS_SELECTOR, CourseCurriculumInformation, PageResult,
+                             extract_courses_from_nodes, finish_tree_run, load_page_checkpoint, merge_page_results,
+                             merge_version_results, offer_node_plus_buttons_selector, page_fingerprint, rank_levels,
+                             save_curriculum_tree, save_page_checkpoint, start_tree_run, tree_page1_url, tree_page_url)
+from curriculums import Curriculum, curriculums, newest_versions_first
+from instrumentation import metrics
+from tumonline_client import TumOnlineClient
 
 def click_button(driver, button):
     driver.execute_script("arguments[0].click()", button)
@@ -33,16 +37,10 @@ def login_tum_online(driver: webdriver.Firefox, username, password):
     driver.find_element(value=login_button_id).click
 
 def get_offer_node_plus_buttons(driver, node_title: str):
-    # Find table rows that contain an offer node, and select their descendant plus buttons
-    offer_node_selector = f"span[contains(@title, '{node_title}')]"
-    plus_button_selector = "a[contains(@class, 'KnotenLink')][not(contains(@style, 'tee_minus'))]"
-    return driver.find_elements(By.XPATH, f"//tr[.//{offer_node_selector}]//{plus_button_selector}")
+    return driver.find_elements(By.XPATH, offer_node_plus_buttons_selector(node_title))
 
 def get_previous_year_buttons_for_courses_without_entries(driver):
-    # Find course tables with no entries, and locate their "previous year" buttons
-    no_entries_table_selector = "td[contains(text(), 'No entries')]"
-    previous_year_button_selector = "a[contains(@title, 'Show previous academic year with entries')]"
-    return driver.find_elements(By.XPATH, f"//tr[.//{no_entries_table_selector}]//{previous_year_button_selector}")
+    return driver.find_elements(By.XPATH, PREVIOUS_YEAR_BUTTONS_SELECTOR)
 
 
 def print_tree(tree, prefix="|--"):
@@ -50,169 +48,194 @@ def print_tree(tree, prefix="|--"):
     for child in tree["children"]:
         print_tree(child, prefix + "|--")
 
-@dataclass
-class CourseCurriculumInformation:
-    urls: List[str]
-    num_credits: int | None
-    module_name: str | None
-    rule_node_names_by_levels: Dict[int, str | None]
-
-def extract_courses_with_credits(driver: webdriver.Firefox) -> Tuple[List[CourseCurriculumInformation], int | None, str | None, Dict[int, str | None]]:
+# Reads all elements matched by MODULE_OR_COURSE_LINK_SELECTOR into nodes for extract_courses_from_nodes, in a single
+# WebDriver round trip (instead of several per element). Mirrors what Selenium reports per element: `location["x"]`
+# is the rounded left page coordinate, `text` the trimmed rendered text, `get_attribute("href")` the absolute URL.
+EXTRACT_TREE_NODES_SCRIPT = """
+const [selector, moduleNameSelector, moduleCreditsSelector] = arguments;
+const evaluate = (xpath, contextNode) =>
+    document.evaluate(xpath, contextNode, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+const text = element => element.innerText.trim();
+const elements = evaluate(selector, document);
+const nodes = [];
+for (let i = 0; i < elements.snapshotLength; i++) {
+    const element = elements.snapshotItem(i);
+    const tagName = element.tagName.toLowerCase();
+    if (tagName === "span") {
+        nodes.push({kind: "node", title: element.getAttribute("title"), text: text(element),
+                    x: Math.round(element.getBoundingClientRect().left + window.scrollX)});
+    } else if (tagName === "tr") {
+        const credits = evaluate(moduleCreditsSelector, element);
+        nodes.push({kind: "module", name: text(evaluate(moduleNameSelector, element).snapshotItem(0)),
+                    credits: credits.snapshotLength > 0 ? text(credits.snapshotItem(0)) : null});
+    } else {
+        nodes.push({kind: "course", href: element.href});
+    }
+}
+return nodes;
+"""
+
+def extract_courses_with_credits(driver: webdriver.Firefox) -> PageResult:
     """
     Returns a list associating course links to their number of credits, as well as the Credits of the last
     entry on the page (since that might carry over to the next page), and the module name of the last entry (same here).
     """
-    # Select (via the same XPath so they are ordered):
-    # - the module names indicating the curriculum path (Rule nodes), and other nodes to deactivate previous Rule nods
-    # - the rows belonging to credits (rows containing Module nodes)
-    # - hrefs pointing to course links.
-    node_span_selector = "//tr//td[1]//span//span[contains(@title, ' node')]"
-    module_selector = "//tr[td[1]//span//span[contains(@title, 'Module node')]]"
-    course_link_selector = "//a[contains(@href, 'pages/slc.tm.cp/course/')]"
-    module_or_course_link_selector = f"{node_span_selector} | {module_selector} | {course_link_selector}"
-
-    current_credits = None
-    current_module_name = None
-    current_course = None
-    course_infos: List[CourseCurriculumInformation] = []
-    # Rule nodes correspond to groups (electives group, subject areas, "Theory", and similar)
-    current_rule_node_names_by_levels: Dict[int, str | None] = {}
-
-    # By sequentially going through the results, we can associate course links to their amount of credits.
-    for element in driver.find_elements(By.XPATH, module_or_course_link_selector):
-        if element.tag_name == "span": # Rule node or other node
-            node_title = element.get_attribute("title")
-            assert node_title is not None
-            if "Rule node" in node_title:
-                # we identify the levels of rule nodes in the path based on their indent
-                current_rule_node_names_by_levels[element.location["x"]] = element.text
-            else:
-                # reset rule node name at that level (so previous rule nodes don't stay active)
-                current_rule_node_names_by_levels[element.location["x"]] = None
-        elif element.tag_name == "tr": # Module node row
-            current_module_name = element.find_element(By.XPATH, "td[1]//span//span").text
-            credits_elements = element.find_elements(By.XPATH, "td[4]//span")
-            current_credits = int(credits_elements[0].text) if len(credits_elements) > 0 and credits_elements[0].text.isdecimal() else None
-            current_course = None
-        else: # Link to course
-            course_link = element.get_attribute("href")
-            assert course_link is not None
-            if current_course is None:
-                current_course = CourseCurriculumInformation(
-                    urls=[course_link], num_credits=current_credits, module_name=current_module_name,
-                    rule_node_names_by_levels=current_rule_node_names_by_levels.copy()
-                )
-                course_infos.append(current_course)
-            else:
-                current_course.urls.append(course_link)
-    
-    return (course_infos, current_credits, current_module_name, current_rule_node_names_by_levels)
-
-def wait_until_not_loading(driver):
-    WebDriverWait(driver, 60).until(
-        expected_conditions.invisibility_of_element_located((By.CLASS_NAME, "pageLoading"))
-    )
-    WebDriverWait(driver, 60).until(
-        expected_conditions.invisibility_of_element_located((By.ID, "id-loader"))
-    )
-
-def prepare_driver(curriculum: Curriculum, gecko_driver_path: str):
-    global driver
-    # Start a headless Firefox instance
-    options = webdriver.FirefoxOptions()
-    options.set_preference("intl.locale.requested", "en-US") # doesn't help though
-    options.add_argument("-headless")
-
-    driver = webdriver.Firefox(service=Service(gecko_driver_path),
-                               options=options)
-    driver.set_script_timeout(20)
-    driver.implicitly_wait(5)
-
-    # Navigate to curriculum tree site
-    tree_url = f"https://campus.tum.de/tumonline/wbstpcs.showSpoTree?pStpStpNr={curriculum.curriculum_ids[0]}"
-    driver.get(tree_url)
-    wait_until_not_loading(driver)
-    
-    # Switch language to English
-    driver.find_element(By.TAG_NAME, "coa-desktop-language-menu").click()
-    time.sleep(5)
-    driver.find_element(By.XPATH, f"//button[@title='Sprache Englisch'] | //button[@title='Language English']").click()
+    return extract_courses_from_nodes(extract_tree_nodes(driver))
+
+def extract_tree_nodes(driver: webdriver.Firefox) -> List[Dict[str, Any]]:
+    return driver.execute_script(EXTRACT_TREE_NODES_SCRIPT, MODULE_OR_COURSE_LINK_SELECTOR, MODULE_NAME_SELECTOR, MODULE_CREDITS_SELECTOR)
+
+# Expansion modes of fetch_curriculum_course_infos:
+# - bulk: click all pending buttons of a kind in one script call, then wait until the DOM and the network are idle
+# - clicks: click every button with its own WebDriver call, and wait fixed times after page loads
+EXPAND_MODES = ["bulk", "clicks"]
+
+# Resolves once the page is quiet: no pending XHR/fetch requests, no DOM mutations for `quietMs`, and no visible
+# loading indicator (or after `timeoutMs`). Clicks the buttons matched by `selector` (if given) first, after
+# starting to track requests, so the requests they trigger are waited for.
+CLICK_AND_WAIT_UNTIL_IDLE_SCRIPT = """
+const [selector, quietMs, timeoutMs, done] = arguments;
+if (window.__pendingRequests === undefined) {
+    window.__pendingRequests = 0;
+    const track = promise => {
+        window.__pendingRequests++;
+        return promise.finally(() => window.__pendingRequests--);
+    };
+    const send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+        track(new Promise(resolve => this.addEventListener("loadend", resolve)));
+        return send.apply(this, args);
+    };
+    const fetch = window.fetch;
+    window.fetch = (...args) => track(fetch(...args));
+}
+let lastMutation = performance.now();
+const observer = new MutationObserver(() => { lastMutation = performance.now(); });
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+
+let clicked = 0;
+const clickStart = performance.now();
+if (selector !== null) {
+    const buttons = document.evaluate(selector, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (let i = 0; i < buttons.snapshotLength; i++) {
+        buttons.snapshotItem(i).click();
+        clicked++;
+    }
+}
+const clickMs = performance.now() - clickStart;
+const isLoading = () => [...document.querySelectorAll(".pageLoading, #id-loader")]
+    .some(element => element.offsetParent !== null);
+const start = performance.now();
+(function poll() {
+    const now = performance.now();
+    if ((window.__pendingRequests === 0 && !isLoading() && now - lastMutation >= quietMs) || now - start >= timeoutMs) {
+        observer.disconnect();
+        done({clicked: clicked, clickMs: clickMs, timedOut: now - start >= timeoutMs});
+    } else {
+        setTimeout(poll, 25);
+    }
+})();
+"""
+# The DOM has to be unchanged for this long to count as idle, and waiting gives up after the timeout (below the
+# driver's script timeout)
+IDLE_QUIET_MS = 300
+IDLE_TIMEOUT_MS = 15000
 
-    atexit.register(lambda: driver.close() if driver is not None else ())
+@dataclass
+class PageTimings:
+    """Time one page spent issuing expansions (clicks, script calls) vs. waiting for their results."""
+    expanding_seconds: float = 0.0
+    waiting_seconds: float = 0.0
+    # Whether the page's result came from its checkpoint (without expanding the page)
+    from_checkpoint: bool = False
 
-def get_page1_url_and_num_pages(curriculum):
-    global driver
-    assert isinstance(driver, selenium.webdriver.Firefox)
+@dataclass
+class PageJob:
+    curriculum_id: str
+    page: int
+    page1_url: str
+    expand_mode: str
+    # The scrape of the curriculum version (see start_tree_run): its checkpoints are reused without loading the page
+    run: str
+
+def click_and_wait_until_idle(driver, selector: str | None, timings: PageTimings) -> int:
+    """
+    Clicks all buttons matching `selector` (if any) in one script call and waits until the page is idle. Raises a
+    TimeoutException if it does not become idle within IDLE_TIMEOUT_MS (so the BrowserPool retries the page).
+    """
+    start = time.perf_counter()
+    result = driver.execute_async_script(CLICK_AND_WAIT_UNTIL_IDLE_SCRIPT, selector, IDLE_QUIET_MS, IDLE_TIMEOUT_MS)
+    # The script times the clicks itself; the rest of the call is waiting for the page
+    expanding_seconds = result["clickMs"] / 1000
+    timings.expanding_seconds += expanding_seconds
+    timings.waiting_seconds += time.perf_counter() - start - expanding_seconds
+    if result["timedOut"]:
+        raise TimeoutException(f"Page did not become idle within {IDLE_TIMEOUT_MS / 1000} s")
+    return result["clicked"]
+
+def get_page1_url_and_num_pages(driver: webdriver.Firefox, curriculum_id: str) -> Tuple[str, int]:
+    with metrics.span("tree.page1", "tree", curriculum_id=curriculum_id):
+        # # Switch node filter to All (Expanded)
+        driver.get(tree_page1_url(curriculum_id))
+        wait_until_not_loading(driver)
 
-    # # Switch node filter to All (Expanded)
-    driver.get(f"https://campus.tum.de/tumonline/wbstpcs.showSpoTree?pStpStpNr={curriculum.curriculum_ids[0]}&pFilterType=20&pPageNr=&pStpKnotenNr=&pStartSemester=W")
-    wait_until_not_loading(driver)
+        num_pages = int(driver.find_element(By.CLASS_NAME, "coTableNaviPageSelect").text.split("\n")[-1].removeprefix("of "))
+        return driver.current_url, num_pages
 
-    page1_url = driver.current_url
-    num_pages = int(driver.find_element(By.CLASS_NAME, "coTableNaviPageSelect").text.split("\n")[-1].removeprefix("of "))
-    return page1_url, num_pages
+def fetch_curriculum_tree(curriculum: Curriculum, browser_pool: BrowserPool, expand_mode: str = "bulk",
+                          all_versions: bool = True, resume: bool = False) -> List[CourseCurriculumInformation]:
+    """
+    Scrape the curriculum tree of `curriculum` with the browser sessions of `browser_pool`, write the course infos
+    to the curriculum's tree file and return them.
 
-driver = None
+    With `all_versions`, the trees of all curriculum versions are scraped (their pages are spread over the pool
+    together) and merged, see merge_version_results. Otherwise only the first (newest) version is scraped.
 
-def main():
-    parser = argparse.ArgumentParser(usage=
+    Every page's result is checkpointed as soon as it is scraped. Pages that look the same as in their checkpoint
+    from this term before expanding (see page_fingerprint) reuse it; with `resume`, pages already scraped by the
+    interrupted previous run are not even loaded.
     """
-    fetch_curriculum_tree.py [-h] --curriculum CURRICULUM
-    Curriculum: valid options are `master-informatics', 'master-dea'
-    """)
-    parser.add_argument("--curriculum", required=True, default="master-informatics",
-                        type=str, help="One of ['master-informatics', 'master-dea']")
-    parser.add_argument("--parallel_drivers", default=1,
-                        type=int, help="How many browser sessions to start in parallel to process different pages quicker")
-    args = parser.parse_args()
-    curriculum = curriculums[args.curriculum]
+    curriculum_ids = newest_versions_first(curriculum.curriculum_ids)
+    curriculum_ids = curriculum_ids if all_versions else curriculum_ids[:1]
+    runs = [start_tree_run(curriculum_id, resume) for curriculum_id in curriculum_ids]
+    page1_urls_and_num_pages = browser_pool.map(get_page1_url_and_num_pages, curriculum_ids)
+    jobs = [PageJob(curriculum_id, page, page1_url, expand_mode, run)
+            for curriculum_id, run, (page1_url, num_pages) in zip(curriculum_ids, runs, page1_urls_and_num_pages) for page in range(1, num_pages+1)]
+    results_and_timings = list(tqdm.tqdm(browser_pool.imap(fetch_curriculum_course_infos, jobs), desc="Pages", total=len(jobs)))
+
+    print_page_timings([f"Version {job.curriculum_id}, page {job.page}" for job in jobs], [timings for _, timings in results_and_timings])
+    with metrics.span("tree.merge", "tree", curriculum=curriculum.output_file_prefix):
+        # The jobs are ordered by version, then page
+        version_results = []
+        for _, num_pages in page1_urls_and_num_pages:
+            version_results.append(merge_page_results(result for result, _ in results_and_timings[:num_pages]))
+            results_and_timings = results_and_timings[num_pages:]
+        all_curriculum_course_infos = rank_levels(merge_version_results(version_results))
+        save_curriculum_tree(curriculum, all_curriculum_course_infos)
+    for curriculum_id, run in zip(curriculum_ids, runs):
+        finish_tree_run(curriculum_id, run)
+    return all_curriculum_course_infos
 
-    gecko_driver_path = GeckoDriverManager().install()
-    print("Installed Firefox Gecko driver to", gecko_driver_path)
-
-    thread_pool = None
-    try:
-        thread_pool = Pool(args.parallel_drivers, initializer=prepare_driver, initargs=(curriculum, gecko_driver_path))
-        time.sleep(4)
-        [(page1_url, num_pages)] = thread_pool.map(get_page1_url_and_num_pages, [curriculum])
-        results = tqdm.tqdm(thread_pool.imap(fetch_curriculum_course_infos,
-                        list(zip(range(1, num_pages+1), [page1_url]*num_pages))), desc="Pages")
-    finally:
-        if thread_pool is not None:
-            thread_pool.close()
-
-    # The first course nodes on page n+1 can belong to the last module node on page n (or even n-1, etc. if the module node has enough entries).
-    # Loop through all pages and set the module node of entries without module node that are at the page start to the previous page's last module node. 
-    last_credits_on_previous_page = None
-    last_module_name_on_previous_page = None
-    last_rule_node_names_by_levels_on_previous_page: Dict[int, str | None] = {}
-    all_curriculum_course_infos = []
-    for (curriculum_course_infos, last_credits_on_page, 
-         last_module_name_on_page, last_rule_node_names_by_levels) in results:
-        for course_info in curriculum_course_infos:
-            if course_info.num_credits is not None:
-                break
-            assert last_credits_on_previous_page is not None
-            course_info.num_credits = last_credits_on_previous_page
-            course_info.module_name = last_module_name_on_previous_page
-        for course_info in curriculum_course_infos:
-            course_info.rule_node_names_by_levels = {**last_rule_node_names_by_levels_on_previous_page, **course_info.rule_node_names_by_levels}
-            course_info.rule_node_names_by_levels = {key: value for key, value in course_info.rule_node_names_by_levels.items() if value is not None}
-        
-        last_module_name_on_previous_page = last_module_name_on_page or last_module_name_on_previous_page
-        last_credits_on_previous_page = last_credits_on_page or last_credits_on_previous_page
-        last_rule_node_names_by_levels_on_previous_page = {**last_rule_node_names_by_levels_on_previous_page, **last_rule_node_names_by_levels}
-
-        all_curriculum_course_infos.extend(curriculum_course_infos)
-
-    with open(curriculum.tree_file_path, "w") as f:
-        # save with indent=0 (will insert newlines, more diff-friendly)
-        json.dump([asdict(course_info) for course_info in all_curriculum_course_infos], f, indent=0)
-        print(f"""Results written to json file '{curriculum.tree_file_path}'""")
+def print_page_timings(page_names: List[str], page_timings: List[PageTimings]):
+    for page_name, timings in zip(page_names, page_timings):
+        print(f"{page_name}: {timings.expanding_seconds:.1f} s expanding, {timings.waiting_seconds:.1f} s waiting"
+              + (" (from checkpoint)" if timings.from_checkpoint else ""))
+    print(f"All pages ({sum(timings.from_checkpoint for timings in page_timings)} from checkpoints): {sum(timings.expanding_seconds for timings in page_timings):.1f} s expanding, "
+          f"{sum(timings.waiting_seconds for timings in page_timings):.1f} s waiting (summed over drivers)")
 
-    return all_curriculum_course_infos
+def click_buttons(driver, buttons, desc: str, timings: PageTimings):
+    start = time.perf_counter()
+    for button in tqdm.tqdm(buttons, leave=False, desc=desc):
+        click_button(driver, button)
+    timings.expanding_seconds += time.perf_counter() - start
+
+def timed_wait_until_not_loading(driver, timings: PageTimings, sleep_seconds: float = 0):
+    start = time.perf_counter()
+    wait_until_not_loading(driver)
+    time.sleep(sleep_seconds)
+    timings.waiting_seconds += time.perf_counter() - start
 
-def fetch_curriculum_course_infos(page_and_page1_url: Tuple[int, str]) -> Tuple[List[CourseCurriculumInformation], int | None, str | None, Dict[int, str | None]]:
+def fetch_curriculum_course_infos(driver: webdriver.Firefox, job: PageJob) -> Tuple[PageResult, PageTimings]:
     """
     Algorithm:
     - go to curriculum page
@@ -222,41 +245,103 @@ def fetch_curriculum_course_infos(page_and_page1_url: Tuple[int, str]) -> Tuple[
         - extract all module rows (which contain the number of credits, and the module name (often, not always, incl. the course ID)) and
           all course links; associate course links to modules based on order of appearance
         - go to the next page
+    Returns the page's result, and how long it spent expanding vs. waiting.
     """
-    page, page1_url = page_and_page1_url
-    global driver
-    assert isinstance(driver, selenium.webdriver.Firefox)
+    page, page1_url, expand_mode = job.page, job.page1_url, job.expand_mode
+    timings = PageTimings()
+    with metrics.span("tree.page", "tree", curriculum_id=job.curriculum_id, page=page) as span_args:
+        checkpoint = load_page_checkpoint(job.curriculum_id, page)
+        if checkpoint is not None and checkpoint.run == job.run:
+            timings.from_checkpoint = span_args["from_checkpoint"] = True
+            return checkpoint.result, timings
+
+        with metrics.span("tree.page.navigate", "tree"):
+            if page != 1 or driver.current_url != page1_url:
+                driver.get(tree_page_url(page1_url, page))
+                if expand_mode == "bulk":
+                    click_and_wait_until_idle(driver, None, timings)
+                else:
+                    timed_wait_until_not_loading(driver, timings, sleep_seconds=3)
+
+        # Skip the expansion if the page is unchanged since its checkpoint
+        with metrics.span("tree.page.fingerprint", "tree"):
+            fingerprint = page_fingerprint(extract_tree_nodes(driver))
+        if checkpoint is not None and checkpoint.fingerprint == fingerprint:
+            timings.from_checkpoint = span_args["from_checkpoint"] = True
+            return checkpoint.result, timings
+
+        # Open remaining Rule Nodes and contained Module Nodes (most will be open already, but in edge cases they remain closed;
+        # e.g. the Data Analytics Rule Node in Informatics curriculum, and its contained Module Nodes), then expand all
+        # offer nodes (click the plus buttons)
+        with metrics.span("tree.page.expand", "tree"):
+            for node_title, desc in [("Rule node", "Expanding rule nodes"), ("Module node", "Expanding offer nodes"),
+                                     ("Offer node", "Expanding course nodes")]:
+                if expand_mode == "bulk":
+                    click_and_wait_until_idle(driver, offer_node_plus_buttons_selector(node_title), timings)
+                else:
+                    click_buttons(driver, get_offer_node_plus_buttons(driver, node_title), desc, timings)
+
+            if expand_mode != "bulk":
+                timed_wait_until_not_loading(driver, timings)
+
+        # Go to previous years for course offer tables with no entries (max. 20 times)
+        with metrics.span("tree.page.year_back", "tree") as year_back_args:
+            for year_ago in range(20):
+                year_back_args["years"] = year_ago
+                if expand_mode == "bulk":
+                    if click_and_wait_until_idle(driver, PREVIOUS_YEAR_BUTTONS_SELECTOR, timings) == 0:
+                        break
+                    continue
+                previous_year_buttons = get_previous_year_buttons_for_courses_without_entries(driver)
+                if len(previous_year_buttons) == 0:
+                    break
+                click_buttons(driver, previous_year_buttons,
+                              f"Still searching last time offered for {len(previous_year_buttons)} modules: {year_ago+1} years ago...", timings)
+                timed_wait_until_not_loading(driver, timings)
+
+        with metrics.span("tree.page.extract", "tree"):
+            result = extract_courses_with_credits(driver)
+            save_page_checkpoint(job.curriculum_id, page, job.run, fingerprint, result)
+        span_args["from_checkpoint"] = False
+    return result, timings
 
-    if page != 1 or driver.current_url != page1_url:
-        driver.get(page1_url.replace("pPageNr=", f"pPageNr={page}"))
-        wait_until_not_loading(driver)
-        time.sleep(3)
 
-    # Open remaining Rule Nodes and contained Module Nodes (most will be open already, but in edge cases they remain closed;
-    # e.g. the Data Analytics Rule Node in Informatics curriculum, and its contained Module Nodes)
-    plus_buttons = get_offer_node_plus_buttons(driver, "Rule node")
-    for button in tqdm.tqdm(plus_buttons, leave=False, desc="Expanding rule nodes"):
-        click_button(driver, button)
-    plus_buttons = get_offer_node_plus_buttons(driver, "Module node")
-    for button in tqdm.tqdm(plus_buttons, leave=False, desc="Expanding offer nodes"):
-        click_button(driver, button)
-    # Expand all offer nodes (click the plus buttons)
-    plus_buttons = get_offer_node_plus_buttons(driver, "Offer node")
-    for button in tqdm.tqdm(plus_buttons, leave=False, desc="Expanding course nodes"):
-        click_button(driver, button)
+def main():
+    parser = argparse.ArgumentParser(usage=
+    """
+    fetch_curriculum_tree.py [-h] --curriculum CURRICULUM [--engine {selenium,http}] [--expand_mode {bulk,clicks}]
+    Curriculum: valid options are `master-informatics', 'master-dea'
+    """)
+    parser.add_argument("--curriculum", required=True, default="master-informatics",
+                        type=str, help="One of ['master-informatics', 'master-dea']")
+    parser.add_argument("--parallel_drivers", default=1,
+                        type=int, help="How many browser sessions to start in parallel to process different pages quicker")
+    parser.add_argument("--expand_mode", default="bulk", choices=EXPAND_MODES,
+                        help="bulk: expand all nodes of a kind in one script call and wait for the page to become idle, clicks: click every node separately and wait fixed times")
+    parser.add_argument("--first_version_only", action="store_true",
+                        help="Only scrape the tree of the first (newest) curriculum version instead of all versions")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run: reuse the checkpoints of the pages it already scraped without loading them again")
+    parser.add_argument("--engine", default="selenium", choices=["selenium", "http"],
+                        help="selenium: scrape the tree in headless Firefox instances, http: fetch and parse the tree pages without a browser")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    curriculum = curriculums[args.curriculum]
 
-    wait_until_not_loading(driver)
+    with instrumentation.recording("fetch_curriculum_tree", args.metrics, args.trace):
+        if args.engine == "http":
+            async def fetch_curriculum_tree_over_http():
+                async with TumOnlineClient() as client:
+                    await fetch_curriculum_tree_http.fetch_curriculum_tree(client, curriculum, args.parallel_drivers,
+                                                                        not args.first_version_only, args.resume)
+            asyncio.run(fetch_curriculum_tree_over_http())
+            return
 
-    # Go to previous years for course offer tables with no entries (max. 20 times)
-    for year_ago in range(20):
-        previous_year_buttons = get_previous_year_buttons_for_courses_without_entries(driver)
-        if len(previous_year_buttons) == 0:
-            break
-        for button in tqdm.tqdm(previous_year_buttons, leave=False, desc=f"Still searching last time offered for {len(previous_year_buttons)} modules: {year_ago+1} years ago..."):
-            click_button(driver, button)
-        wait_until_not_loading(driver)
+        gecko_driver_path = GeckoDriverManager().install()
+        print("Installed Firefox Gecko driver to", gecko_driver_path)
 
-    return extract_courses_with_credits(driver)
+        with BrowserPool(args.parallel_drivers, gecko_driver_path) as browser_pool:
+            fetch_curriculum_tree(curriculum, browser_pool, args.expand_mode, not args.first_version_only, args.resume)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,204 @@
+import asyncio
+import re
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urljoin
+
+import lxml.html
+import tqdm.asyncio
+
+from curriculum_tree import (MODULE_CREDITS_SELECTOR, MODULE_NAME_SELECTOR, MODULE_OR_COURSE_LINK_SELECTOR,
+                             PREVIOUS_YEAR_BUTTONS_SELECTOR, CourseCurriculumInformation, PageResult, checkpoint_term,
+                             extract_courses_from_nodes, finish_tree_run, load_page_checkpoint, merge_page_results,
+                             merge_version_results, offer_node_plus_buttons_selector, page_fingerprint, rank_levels,
+                             save_curriculum_tree, save_page_checkpoint, start_tree_run, tree_page1_url, tree_page_url)
+from curriculums import Curriculum, newest_versions_first
+from instrumentation import metrics
+from manifest import hash_inputs
+from tumonline_client import TumOnlineClient
+
+# Plus buttons and "previous year" buttons load the new table rows via AJAX. The URL of that request is the link's
+# href, or (for "javascript:" links) the first quoted URL with a query string in its onclick handler.
+ONCLICK_URL_REGEX = re.compile(r"""['"]([^'"\s]+\?[^'"\s]*)['"]""")
+# Indentation of tree nodes (see node_indent)
+INDENT_STYLE_REGEX = re.compile(r"(?:padding|margin)-left:\s*(\d+)px")
+INDENT_IMAGE_WIDTH = 20
+PAGE_COUNT_REGEX = re.compile(r"of\s*(\d+)")
+
+def normalized_text(element) -> str:
+    # Like the text Selenium reports for an element: whitespace collapsed, leading and trailing whitespace removed
+    return " ".join(element.text_content().split())
+
+def node_indent(span) -> int:
+    """
+    The indent of a tree node, in place of the rendered x position the Selenium engine uses: the left padding and
+    margin of the node and its ancestors within the table cell, plus the width of the indentation images before it.
+    Only the order of the indents matters: they are replaced by their ranks before the tree is saved (see rank_levels).
+    """
+    cell = next(span.iterancestors("td"))
+    indent = 0
+    for element in [span, *span.iterancestors()]:
+        indent += sum(int(pixels) for pixels in INDENT_STYLE_REGEX.findall(element.get("style", "")))
+        if element is cell:
+            break
+    for element in cell.iter():
+        if element is span:
+            break
+        if element.tag == "img":
+            indent += INDENT_IMAGE_WIDTH
+    return indent
+
+def tree_node_from_element(element, base_url: str) -> Dict[str, Any]:
+    """Reads an element matched by MODULE_OR_COURSE_LINK_SELECTOR into a node for extract_courses_from_nodes."""
+    if element.tag == "span": # Rule node or other node
+        return {"kind": "node", "title": element.get("title"), "text": normalized_text(element), "x": node_indent(element)}
+    elif element.tag == "tr": # Module node row
+        credits_elements = element.xpath(MODULE_CREDITS_SELECTOR)
+        return {"kind": "module", "name": normalized_text(element.xpath(MODULE_NAME_SELECTOR)[0]),
+                "credits": normalized_text(credits_elements[0]) if len(credits_elements) > 0 else None}
+    else: # Link to course
+        return {"kind": "course", "href": urljoin(base_url, element.get("href"))}
+
+def expansion_url(button, base_url: str) -> str | None:
+    href = button.get("href", "")
+    if href != "" and not href.startswith("javascript:") and href != "#":
+        return urljoin(base_url, href)
+    if (match := ONCLICK_URL_REGEX.search(button.get("onclick", ""))) is not None:
+        return urljoin(base_url, match.group(1))
+    return None
+
+def replace_with_fragment(target, fragment_html: str):
+    """Replaces the `target` element (a table row or a table) with the matching elements of an AJAX response."""
+    fragment_elements = lxml.html.fragments_fromstring(fragment_html)
+    replacements = [element for fragment_element in fragment_elements
+                    for element in ([fragment_element] if fragment_element.tag == target.tag else fragment_element.iter(target.tag))]
+    if target.tag == "table":
+        # Only the outermost table, not the tables nested inside it
+        replacements = replacements[:1]
+    parent = target.getparent()
+    index = parent.index(target)
+    parent.remove(target)
+    for offset, replacement in enumerate(replacements):
+        parent.insert(index + offset, replacement)
+
+async def expand_buttons(client: TumOnlineClient, document, base_url: str, selector: str, target_xpath: str) -> int:
+    """
+    Fetches the AJAX responses of all buttons matching `selector` in parallel, and replaces the button's target
+    element (`target_xpath`, relative to the button) with the response. Returns the number of expanded buttons.
+    """
+    expansions = [(button.xpath(target_xpath)[0], url) for button in document.xpath(selector)
+                  if (url := expansion_url(button, base_url)) is not None]
+    fragments = await asyncio.gather(*[client.get_text(url) for _, url in expansions])
+    for (target, _), fragment in zip(expansions, fragments):
+        replace_with_fragment(target, fragment)
+    return len(expansions)
+
+def tree_nodes(document, base_url: str) -> List[Dict[str, Any]]:
+    return [tree_node_from_element(element, base_url) for element in document.xpath(MODULE_OR_COURSE_LINK_SELECTOR)]
+
+async def expand_page(client: TumOnlineClient, document, url: str):
+    """Expands all nodes of a tree page (`document`, loaded from `url`) the way the Selenium engine clicks them."""
+    # Open Rule Nodes, contained Module Nodes, and Offer nodes (in this order, expanding a node can reveal the next kind)
+    with metrics.span("tree.page.expand", "tree"):
+        for node_title in ["Rule node", "Module node", "Offer node"]:
+            await expand_buttons(client, document, url, offer_node_plus_buttons_selector(node_title), "ancestor::tr[1]")
+
+    # Go to previous years for course offer tables with no entries (max. 20 times)
+    with metrics.span("tree.page.year_back", "tree") as year_back_args:
+        for year_ago in range(20):
+            year_back_args["years"] = year_ago
+            if await expand_buttons(client, document, url, PREVIOUS_YEAR_BUTTONS_SELECTOR, "ancestor::table[1]") == 0:
+                break
+
+async def fetch_page_course_infos(client: TumOnlineClient, curriculum_id: str, run: str, page: int, url: str,
+                                  html: str | None = None) -> Tuple[PageResult, bool]:
+    """
+    The HTTP version of fetch_curriculum_tree.fetch_curriculum_course_infos: expands and extracts one page, reusing
+    and writing its checkpoint in the same way. Returns the page's result, and whether it came from the checkpoint.
+    """
+    with metrics.span("tree.page", "tree", curriculum_id=curriculum_id, page=page) as span_args:
+        checkpoint = load_page_checkpoint(curriculum_id, page)
+        if checkpoint is not None and checkpoint.run == run:
+            span_args["from_checkpoint"] = True
+            return checkpoint.result, True
+        with metrics.span("tree.page.navigate", "tree"):
+            document = lxml.html.fromstring(html if html is not None else await client.get_text(url))
+        with metrics.span("tree.page.fingerprint", "tree"):
+            fingerprint = page_fingerprint(tree_nodes(document, url))
+        if checkpoint is not None and checkpoint.fingerprint == fingerprint:
+            span_args["from_checkpoint"] = True
+            return checkpoint.result, True
+
+        await expand_page(client, document, url)
+        with metrics.span("tree.page.extract", "tree"):
+            result = extract_courses_from_nodes(tree_nodes(document, url))
+            save_page_checkpoint(curriculum_id, page, run, fingerprint, result)
+        span_args["from_checkpoint"] = False
+    return result, False
+
+async def fetch_page1_and_num_pages(client: TumOnlineClient, curriculum_id: str) -> Tuple[str, str, int]:
+    """Returns the URL and HTML of the first tree page of a curriculum version, and its number of pages."""
+    page1_url = tree_page1_url(curriculum_id)
+    with metrics.span("tree.page1", "tree", curriculum_id=curriculum_id):
+        page1_html = await client.get_text(page1_url)
+    page_select_elements = lxml.html.fromstring(page1_html).find_class("coTableNaviPageSelect")
+    num_pages = int(PAGE_COUNT_REGEX.findall(page_select_elements[0].text_content())[-1]) if len(page_select_elements) > 0 else 1
+    if "Rule node" not in page1_html:
+        raise ValueError(f"No rule nodes found on '{page1_url}': the curriculum tree was probably not delivered in English")
+    return page1_url, page1_html, num_pages
+
+async def tree_inputs_hash(client: TumOnlineClient, curriculum: Curriculum, parallel_pages: int = 8, all_versions: bool = True) -> str:
+    """
+    Hash of everything a curriculum tree fetch (with either engine) works from: the curriculum versions, the code
+    that scrapes and merges the tree, the term (see checkpoint_term), and the fingerprints of all tree pages before
+    expanding them (see page_fingerprint). The pages are only loaded for this, which is much cheaper than expanding
+    them; like the page checkpoints, an unchanged hash means the tree is unchanged.
+    """
+    curriculum_ids = newest_versions_first(curriculum.curriculum_ids)
+    curriculum_ids = curriculum_ids if all_versions else curriculum_ids[:1]
+    with metrics.span("tree.inputs_hash", "tree", curriculum=curriculum.output_file_prefix):
+        versions = await asyncio.gather(*[fetch_page1_and_num_pages(client, curriculum_id) for curriculum_id in curriculum_ids])
+        page_semaphore = asyncio.Semaphore(parallel_pages)
+        async def fingerprint(page1_url: str, page1_html: str, page: int) -> str:
+            async with page_semaphore:
+                url = tree_page_url(page1_url, page)
+                html = page1_html if page == 1 else await client.get_text(url)
+            return page_fingerprint(tree_nodes(lxml.html.fromstring(html), url))
+        fingerprints = await asyncio.gather(*[fingerprint(page1_url, page1_html, page) for page1_url, page1_html, num_pages in versions
+                                              for page in range(1, num_pages + 1)])
+    source_files = ["curriculum_tree.py", "fetch_curriculum_tree.py", "fetch_curriculum_tree_http.py", "curriculums.py"]
+    return hash_inputs(source_files, [curriculum_ids, curriculum.tree_file_path, checkpoint_term(), fingerprints])
+
+async def fetch_curriculum_tree(client: TumOnlineClient, curriculum: Curriculum, parallel_pages: int = 8,
+                                all_versions: bool = True, resume: bool = False) -> List[CourseCurriculumInformation]:
+    """
+    Fetches the curriculum tree over plain HTTP (without a browser), writes the course infos to the curriculum's
+    tree file and returns them. Produces the same records as fetch_curriculum_tree.fetch_curriculum_tree (including
+    merging all curriculum versions if `all_versions` is set, and the page checkpoints).
+    """
+    curriculum_ids = newest_versions_first(curriculum.curriculum_ids)
+    curriculum_ids = curriculum_ids if all_versions else curriculum_ids[:1]
+    runs = {curriculum_id: start_tree_run(curriculum_id, resume) for curriculum_id in curriculum_ids}
+    versions = await asyncio.gather(*[fetch_page1_and_num_pages(client, curriculum_id) for curriculum_id in curriculum_ids])
+
+    page_semaphore = asyncio.Semaphore(parallel_pages)
+    async def fetch_page(curriculum_id: str, page1_url: str, page1_html: str, page: int) -> Tuple[PageResult, bool]:
+        async with page_semaphore:
+            return await fetch_page_course_infos(client, curriculum_id, runs[curriculum_id], page, tree_page_url(page1_url, page),
+                                                 page1_html if page == 1 else None)
+
+    # The pages of all versions are fetched together, and merged per version afterwards
+    results_and_from_checkpoint = await tqdm.asyncio.tqdm.gather(
+        *[fetch_page(curriculum_id, page1_url, page1_html, page) for curriculum_id, (page1_url, page1_html, num_pages) in zip(curriculum_ids, versions)
+          for page in range(1, num_pages + 1)], desc="Pages")
+    print(f"{sum(from_checkpoint for _, from_checkpoint in results_and_from_checkpoint)} of {len(results_and_from_checkpoint)} pages from checkpoints")
+    results = [result for result, _ in results_and_from_checkpoint]
+    with metrics.span("tree.merge", "tree", curriculum=curriculum.output_file_prefix):
+        version_results = []
+        for _, _, num_pages in versions:
+            version_results.append(merge_page_results(results[:num_pages]))
+            results = results[num_pages:]
+        all_curriculum_course_infos = rank_levels(merge_version_results(version_results))
+        save_curriculum_tree(curriculum, all_curriculum_course_infos)
+    for curriculum_id, run in runs.items():
+        finish_tree_run(curriculum_id, run)
+    return all_curriculum_course_infos
@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+from rate_controller import percentile
+
+METRICS_DIRECTORY = "../data/metrics"
+# Set while a run is recorded: worker processes hand their data to the run's process through this directory
+SPOOL_DIRECTORY_ENVIRONMENT_VARIABLE = "TUM_COURSES_METRICS_SPOOL"
+
+class Metrics:
+    """
+    Instrumentation of a run, which all scripts emit to (through the module-level `metrics`):
+    - spans: timed sections of the pipeline (e.g. a stage, a curriculum tree page and its phases, an HTTP request),
+      stored as Chrome trace events, so a run can be viewed on a timeline
+    - counters: e.g. HTTP requests by status, WebDriver round trips, bytes read and written
+    - distributions: e.g. HTTP request and WebDriver round trip latencies
+
+    Worker processes (the browser pool, the render processes) collect their own data and hand it to the run's
+    process with `flush` after every job. See `recording`.
+    """
+    def __init__(self):
+        self._clear()
+        self._recording_pid: int | None = None
+        # A forked worker starts without the data its parent had collected so far
+        os.register_at_fork(after_in_child=self._clear)
+
+    def _clear(self):
+        self._lock = threading.Lock()
+        self.events: List[Dict[str, Any]] = []
+        self.counters: Dict[str, float] = {}
+        self.observations: Dict[str, List[float]] = {}
+        # Timeline lanes (trace "tid") in use, by asyncio task or thread: (lane, number of open spans)
+        self._open_lanes: Dict[int, Tuple[int, int]] = {}
+
+    @staticmethod
+    def _lane_key() -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        return id(task) if task is not None else threading.get_ident()
+
+    @contextmanager
+    def span(self, name: str, category: str = "", **args) -> Iterator[Dict[str, Any]]:
+        """
+        Times the `with` block as a span. The span's `args` are returned, so details that are only known at the
+        end (e.g. whether a page came from its checkpoint) can be added to them.
+
+        Concurrent asyncio tasks and threads get separate timeline lanes (nested spans of a task share its lane),
+        and a lane is reused once all spans on it ended, so there are about as many lanes as concurrent tasks.
+        """
+        key = self._lane_key()
+        with self._lock:
+            lane, depth = self._open_lanes.get(key, (None, 0))
+            if lane is None:
+                lanes_in_use = {open_lane for open_lane, _ in self._open_lanes.values()}
+                lane = next(free_lane for free_lane in range(len(lanes_in_use) + 1) if free_lane not in lanes_in_use)
+            self._open_lanes[key] = (lane, depth + 1)
+        start = time.time_ns()
+        try:
+            yield args
+        finally:
+            end = time.time_ns()
+            with self._lock:
+                if depth > 0:
+                    self._open_lanes[key] = (lane, depth)
+                else:
+                    self._open_lanes.pop(key, None)
+                self.events.append({"name": name, "cat": category, "ph": "X", "ts": start // 1000, "dur": (end - start) // 1000,
+                                    "pid": os.getpid(), "tid": lane, "args": args})
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.observations.setdefault(name, []).append(value)
+
+    def flush(self):
+        """In a worker process of a recorded run: hands the data collected so far to the run's process."""
+        spool_directory = os.environ.get(SPOOL_DIRECTORY_ENVIRONMENT_VARIABLE)
+        if spool_directory is None or os.getpid() == self._recording_pid:
+            return
+        with self._lock:
+            data = {"events": self.events, "counters": self.counters, "observations": self.observations}
+            self.events, self.counters, self.observations = [], {}, {}
+        with open(os.path.join(spool_directory, f"{os.getpid()}.jsonl"), "a") as f:
+            f.write(json.dumps(data) + "\n")
+
+    def _merge(self, data: Dict[str, Any]):
+        with self._lock:
+            self.events.extend(data["events"])
+            for name, value in data["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, values in data["observations"].items():
+                self.observations.setdefault(name, []).extend(values)
+
+    def summary(self) -> Dict[str, Any]:
+        """Counters, distributions, and per span name: how often it ran and how long it took in total and at most."""
+        durations_by_span: Dict[str, List[float]] = {}
+        for event in self.events:
+            durations_by_span.setdefault(event["name"], []).append(event["dur"] / 1e6)
+        return {
+            "counters": dict(sorted(self.counters.items())),
+            "distributions": {name: describe(values) for name, values in sorted(self.observations.items())},
+            "spans": {name: {**describe(durations), "total": sum(durations)} for name, durations in sorted(durations_by_span.items())},
+        }
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """The spans in the Chrome trace event format (for chrome://tracing or https://ui.perfetto.dev)."""
+        process_names = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "main" if pid == self._recording_pid else f"worker {pid}"}}
+                         for pid in sorted({event["pid"] for event in self.events})]
+        return {"traceEvents": process_names + sorted(self.events, key=lambda event: event["ts"]), "displayTimeUnit": "ms"}
+
+def describe(values: List[float]) -> Dict[str, float]:
+    if len(values) == 0:
+        return {"count": 0}
+    sorted_values = sorted(values)
+    return {"count": len(values), "mean": sum(values) / len(values), "p50": percentile(sorted_values, 0.5),
+            "p95": percentile(sorted_values, 0.95), "max": sorted_values[-1]}
+
+metrics = Metrics()
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--metrics", help=f"Where to write the metrics of the run (JSON, default: a new file in {METRICS_DIRECTORY}/)")
+    parser.add_argument("--trace", help="Also write a Chrome trace of the run to this file (open it in chrome://tracing or https://ui.perfetto.dev)")
+
+@contextmanager
+def recording(script: str, metrics_path: str | None = None, trace_path: str | None = None) -> Iterator[Metrics]:
+    """
+    Records the metrics of a run of `script` (the `with` block, as a span). At the end (also if the run fails), the
+    metrics are written to `metrics_path` (default: a new file in METRICS_DIRECTORY), and if `trace_path` is given,
+    the spans are exported as a Chrome trace.
+    """
+    if metrics_path is None:
+        metrics_path = f"{METRICS_DIRECTORY}/{time.strftime('%Y%m%d-%H%M%S')}-{script}.json"
+    spool_directory = tempfile.mkdtemp(prefix="metrics-")
+    os.environ[SPOOL_DIRECTORY_ENVIRONMENT_VARIABLE] = spool_directory
+    metrics._recording_pid = os.getpid()
+    started_at = time.time()
+    succeeded = False
+    try:
+        with metrics.span(script, "run"):
+            yield metrics
+        succeeded = True
+    finally:
+        del os.environ[SPOOL_DIRECTORY_ENVIRONMENT_VARIABLE]
+        for path in glob.glob(f"{spool_directory}/*.jsonl"):
+            with open(path) as f:
+                for line in f:
+                    metrics._merge(json.loads(line))
+        shutil.rmtree(spool_directory)
+
+        os.makedirs(os.path.dirname(metrics_path) or ".", exist_ok=True)
+        with open(metrics_path, "w") as f:
+            json.dump({"script": script, "arguments": sys.argv[1:], "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started_at)),
+                       "seconds": time.time() - started_at, "succeeded": succeeded, **metrics.summary()}, f, indent=1)
+        print(f"Metrics written to '{metrics_path}'")
+        if trace_path is not None:
+            with open(trace_path, "w") as f:
+                json.dump(metrics.chrome_trace(), f)
+            print(f"Trace written to '{trace_path}'")
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable
+
+def hash_inputs(file_paths: Iterable[str], values: Any = None) -> str:
+    """Hash of the contents of `file_paths` (a missing file counts as empty) and of the JSON-serializable `values`."""
+    inputs_hash = hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode())
+    for path in sorted(file_paths):
+        inputs_hash.update(path.encode())
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                inputs_hash.update(hashlib.sha256(f.read()).digest())
+    return inputs_hash.hexdigest()
+
+def _file_sha256(path: str) -> str | None:
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class Manifest:
+    """
+    Records, for every (stage, key) that ran (e.g. ("render", curriculum key)), the hash of its inputs and of the
+    output files it wrote, so the next run can skip it if neither its inputs nor its outputs changed since.
+    """
+    def __init__(self, path: str = "../data/manifest.json"):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def is_up_to_date(self, stage: str, key: str, inputs_hash: str) -> bool:
+        entry = self.entries.get(stage, {}).get(key)
+        return (entry is not None and entry["inputs"] == inputs_hash
+                and all(_file_sha256(output) == output_hash for output, output_hash in entry["outputs"].items()))
+
+    def record(self, stage: str, key: str, inputs_hash: str, outputs: Iterable[str]):
+        self.entries.setdefault(stage, {})[key] = {"inputs": inputs_hash,
+                                                   "outputs": {output: _file_sha256(output) for output in outputs}}
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.entries, f, indent=0, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
@@ -1,17 +1,31 @@
-
 from __future__ import annotations
 
 import argparse
+import functools
+import glob
 import json
+import os
 import re
+import struct
+import zlib
 from collections import defaultdict
-from dataclasses import dataclass
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Tuple
 
 import jinja2
+try:
+    import brotli
+except ImportError:
+    # Optional: without it, only the .gz copies are written
+    brotli = None
 
+import instrumentation
 import util
-from curriculums import curriculums
+from course_store import CourseStore, EquivalenceClass
+from curriculums import Curriculum, curriculums
+from instrumentation import metrics
+from manifest import hash_inputs
 
 COURSE_CODE_REGEX = re.compile(r"\[([A-Z0-9_]+)\]")
 COURSE_CODE_PARENTHESIS_REGEX = re.compile(r"\s*\((?:[A-Z]+[0-9]+(?:_[A-Z0-9])*|English)(?:, (?:[A-Z]+[0-9]+(?:_[A-Z0-9])*|English))*\)|\[(?:[A-Z]+[0-9]+(?:_[A-Z0-9])*|English)(?:, (?:[A-Z]+[0-9]+(?:_[A-Z0-9])*|English))*\]")
@@ -19,6 +33,15 @@ COURSE_CODE_PARENTHESIS_REGEX = re.compile(r"\s*\((?:[A-Z]+[0-9]+(?:_[A-Z0-9])*|
 THEORY_NODE_NAMES = ["Theorie", "Theory"]
 
 COURSE_DETAILS_BASE_URL = "https://campus.tum.de/tumonline/ee/ui/ca2/app/desktop/#/slc.tm.cp/student/courses/"
+# Compiled templates (jinja bytecode cache)
+TEMPLATE_CACHE_DIRECTORY = "../data/template_cache"
+# Precompressed copies of the thin pages and their data files (for servers that serve e.g. `page.html.gz` directly)
+PRECOMPRESSED_SUFFIXES = [".gz", *([".br"] if brotli is not None else [])]
+
+# Rows of the "courses" list in the data file of a thin page (followed by the values of the extra columns)
+LITE_COURSE_COLUMNS = ["area", "course_code", "title", "course_id", "credits", "term", "flags", "previous_term"]
+LITE_FLAG_NEW = 1
+LITE_FLAG_RARE = 2
 
 @dataclass
 class Course:
@@ -28,133 +51,314 @@ class Course:
     term_id: int
     term_name: str
     credits: str
-    equivalent_courses: List[Course]
+    equivalence_class: EquivalenceClass
     curriculum_path: List[str]
 
-def main():
-    parser = argparse.ArgumentParser(usage=
+@functools.cache
+def jinja_environment() -> jinja2.Environment:
+    """The template environment of this process, with the compiled templates cached on disk between runs."""
+    os.makedirs(TEMPLATE_CACHE_DIRECTORY, exist_ok=True)
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader("../templates/"),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(TEMPLATE_CACHE_DIRECTORY),
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+
+@functools.cache
+def static_includes() -> Dict[str, str]:
+    """The static parts of the pages (which are the same on every page), rendered once per process."""
+    template = jinja_environment().from_string("{% import 'macros.jinja' as macros %}{{ macros.indented_include(template_name, 4) }}")
+    return {"style_css": template.render(template_name="style.css"),
+            "github_and_kofi": template.render(template_name="github_and_kofi.html"),
+            "lite_js": template.render(template_name="lite.js")}
+
+def deterministic_gzip(content: bytes) -> bytes:
     """
-    print_html_table.py [-h] --termid TERMID --curriculum CURRICULUM --output PATH [--oldtermsfrom OLDTERMID]
-    Please provide the term id: winter 2022/23 is 197, summer 2023 is 198, winter 2023/24 is 199, etc.
-    Curriculum: valid options are `master-informatics', 'master-dea'
-    """)
-    parser.add_argument('--termid', required=True, type=int, help="The term id (winter 2022/23 is 197, summer 2023 is 198, etc.)")
-    parser.add_argument("--curriculum", required=True, type=str, help="One of ['master-informatics', 'master-dea']")
-    parser.add_argument("--output", required=True, type=str, help="Path where to write the output html")
-    parser.add_argument("--oldtermsfrom", required=False, type=int, help="The term id starting at which old course availability data (last offered) should be fetched")
-    args = parser.parse_args()
+    gzip file of `content` that is the same on every platform and Python version: gzip.compress writes the current
+    platform (or, depending on the Python version, "unknown") into the header. Here, the header has no timestamp or
+    file name, and the operating system "unknown" (255), like the committed files.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS) # Raw deflate stream, without zlib header
+    deflated = compressor.compress(content) + compressor.flush()
+    # Magic number, deflate, no flags, no timestamp, maximum compression (XFL 2), unknown operating system
+    header = b"\x1f\x8b\x08\x00" + struct.pack("<I", 0) + b"\x02\xff"
+    trailer = struct.pack("<II", zlib.crc32(content), len(content) & 0xffffffff)
+    return header + deflated + trailer
+
+def write_precompressed(path: str, content: bytes):
+    """Writes `content` to `path`, and compressed copies of it to `path` + each of PRECOMPRESSED_SUFFIXES."""
+    compressed_contents = [deterministic_gzip(content)]
+    if brotli is not None:
+        compressed_contents.append(brotli.compress(content))
+    for suffix, file_content in zip(["", *PRECOMPRESSED_SUFFIXES], [content, *compressed_contents]):
+        with open(path + suffix, "wb") as f:
+            f.write(file_content)
+        metrics.count("bytes_written.render", len(file_content))
+
+@dataclass
+class TableView:
+    """One table of a curriculum: the courses offered in `term_id` (or, if `old_terms_from` is given, all courses
+    offered since `old_terms_from` with the term they were last offered in), written to the HTML file `output`."""
+    term_id: int
+    output: str
+    old_terms_from: int | None = None
+
+    @property
+    def outputs(self) -> List[str]:
+        return [self.output]
+
+@dataclass
+class LiteView:
+    """
+    The thin page of a curriculum: `page_output` only contains the page around the tables, which are rendered on the
+    client (see templates/lite.js) from the compact data file `data_output`, with all courses offered since
+    `old_terms_from`, and can be filtered by area, term and extra columns. `full_table_output` (if given) is linked
+    for browsers without JavaScript. Both files are also written precompressed.
+    """
+    term_id: int
+    old_terms_from: int
+    page_output: str
+    data_output: str
+    full_table_output: str | None = None
+
+    @property
+    def outputs(self) -> List[str]:
+        return [path + suffix for path in [self.page_output, self.data_output] for suffix in ["", *PRECOMPRESSED_SUFFIXES]]
+
+def docs_views(curriculum: Curriculum, term_id: int, old_terms_from: int) -> List[TableView | LiteView]:
+    """
+    The tables published in docs/: the current term's, the one with all terms since `old_terms_from`, and the thin
+    page with its data file in docs/data/.
+    """
+    term_name = util.term_id_to_name(term_id).lower().replace("/", "-")
+    output_path_prefix = f"../docs/{curriculum.output_file_prefix}"
+    return [TableView(term_id, f"{output_path_prefix}-{term_name}.html"),
+            TableView(term_id, f"{output_path_prefix}-all.html", old_terms_from),
+            LiteView(term_id, old_terms_from, f"{output_path_prefix}.html", f"../docs/data/{curriculum.output_file_prefix}.json",
+                     full_table_output=f"{output_path_prefix}-all.html")]
+
+class CurriculumTables:
+    """
+    The newest course of every equivalence class of a curriculum (from the course store's equivalence_classes
+    view), loaded once, from which any number of tables (see TableView) can be rendered.
+    """
+    def __init__(self, curriculum: Curriculum):
+        with metrics.span("render.load", "render", curriculum=curriculum.output_file_prefix):
+            self._load(curriculum)
 
-    curriculum = curriculums[args.curriculum]
-
-    with open(curriculum.all_offered_courses_path) as f:
-        available_data = json.load(f)
-        available_courses_dtos = available_data["courses"]
-    with open(curriculum.tree_file_path) as f:
-        curriculum_course_infos = json.load(f)
-    curriculum_courses_by_url = {url[url.rfind("/"):]: course_info for course_info in curriculum_course_infos for url in course_info["urls"]}
-
-    available_courses_dtos = sorted(available_courses_dtos, key=lambda course_dto: int(course_dto["semesterDto"]["id"]), reverse=True)
-    courses_by_area = defaultdict(lambda: [])
-    equivalent_courses_by_oldest_related_course_id = {}
-    for course_dto in available_courses_dtos:
-        is_in_term_range = int(course_dto["semesterDto"]["id"]) >= (args.oldtermsfrom or args.termid)
-        url = f"{COURSE_DETAILS_BASE_URL}{course_dto["id"]}"
-        equivalent_courses = equivalent_courses_by_oldest_related_course_id.get(int(course_dto["oldestRelatedCourseId"]), None)
-        if equivalent_courses == []:
-            continue
-        
-        area = None
-        course_code = None
-        credits = None
-        curriculum_path = None
-        if equivalent_courses is None:
-            # This is the youngest of its equivalence class, and we should extract the area
+    def _load(self, curriculum: Curriculum):
+        self.curriculum = curriculum
+        with CourseStore(curriculum) as store:
+            newest_courses = store.newest_courses()
+            curriculum_course_infos = store.curriculum_tree()
+            curriculum_courses_by_url = {url_suffix: curriculum_course_infos[position]
+                                         for url_suffix, position in store.curriculum_tree_positions_by_url_suffix().items()}
+
+        # The newest course of every equivalence class in the curriculum, newest first, with its area
+        self.youngest_courses_with_areas: List[Tuple[str, Course]] = []
+        for course_dto, equivalence_class in newest_courses:
+            url = f"{COURSE_DETAILS_BASE_URL}{course_dto["id"]}"
             curriculum_course_info = curriculum_courses_by_url.get(url[url.rfind("/"):])
             if curriculum_course_info is None:
                 print(f"Course {course_dto["title"]} ({util.term_id_to_name(course_dto["semesterDto"]["id"])}) belonging to URL {url} not found in curriculum!")
-                equivalent_courses_by_oldest_related_course_id[int(course_dto["oldestRelatedCourseId"])] = []
                 continue
-            assert curriculum_course_info is not None
             curriculum_path = list(curriculum_course_info["rule_node_names_by_levels"].values())
             area = curriculum.extract_area(curriculum_path)
             if area is None:
-                equivalent_courses_by_oldest_related_course_id[int(course_dto["oldestRelatedCourseId"])] = []
                 continue
-            course_code_match = COURSE_CODE_REGEX.match(curriculum_course_info["module_name"]) if curriculum_course_info is not None else None
-            course_code = course_code_match.groups()[0] if course_code_match is not None else "?"
-            credits = str(curriculum_course_info["num_credits"]) if curriculum_course_info is not None else "?"
-        else:
-            course_code = equivalent_courses[0].course_code
-            credits = equivalent_courses[0].credits
-            curriculum_path = equivalent_courses[0].curriculum_path
-        course = Course(
-            title=COURSE_CODE_PARENTHESIS_REGEX.sub("", course_dto["title"]),
-            url=url,
-            course_code=course_code,
-            credits=credits,
-            term_id = course_dto["semesterDto"]["id"],
-            term_name=util.term_id_to_name(course_dto["semesterDto"]["id"]),
-            equivalent_courses=[], # will be set later
-            curriculum_path=curriculum_path,
-        )
-        if equivalent_courses is None:
-            equivalent_courses = [course]
-            equivalent_courses_by_oldest_related_course_id[int(course_dto["oldestRelatedCourseId"])] = equivalent_courses
-            if is_in_term_range:
+            course_code_match = COURSE_CODE_REGEX.match(curriculum_course_info["module_name"])
+            course = Course(
+                title=COURSE_CODE_PARENTHESIS_REGEX.sub("", course_dto["title"]),
+                url=url,
+                course_code=course_code_match.groups()[0] if course_code_match is not None else "?",
+                credits=str(curriculum_course_info["num_credits"]),
+                term_id = course_dto["semesterDto"]["id"],
+                term_name=util.term_id_to_name(course_dto["semesterDto"]["id"]),
+                equivalence_class=equivalence_class,
+                curriculum_path=curriculum_path,
+            )
+            self.youngest_courses_with_areas.append((area, course))
+
+        curriculum_entry_paths = [list(curriculum_course_info["rule_node_names_by_levels"].values()) for curriculum_course_info in curriculum_course_infos]
+        self.areas_according_to_curriculum_tree = list({area: 0 for path in curriculum_entry_paths if (area := curriculum.extract_area(path)) is not None})
+
+        self.jinja_environment = jinja_environment()
+
+    def courses_by_area(self, first_term_id: int) -> List[Tuple[str, List[Course]]]:
+        """The courses last offered in or after `first_term_id`, by area (in curriculum tree order), in table order."""
+        courses_by_area = defaultdict(lambda: [])
+        for area, course in self.youngest_courses_with_areas:
+            if course.term_id >= first_term_id:
                 courses_by_area[area].append(course)
-        else:
-            equivalent_courses.append(course)
+        # Table order: newest first, then by title (case-insensitive, like jinja's sort filter); both sorts are stable
+        for area, courses_in_area in courses_by_area.items():
+            courses_in_area.sort(key=lambda course: course.title.lower())
+            courses_in_area.sort(key=lambda course: course.term_id, reverse=True)
+        return sorted(courses_by_area.items(), key=lambda area_and_val: self.areas_according_to_curriculum_tree.index(area_and_val[0]))
 
-        course.equivalent_courses = equivalent_courses
+    def render(self, view: TableView):
+        curriculum, term_id, old_terms_from = self.curriculum, view.term_id, view.old_terms_from
+        courses_by_area = self.courses_by_area(old_terms_from or term_id)
 
-    terms = [(term_id, util.term_id_to_name(term_id)) for term_id in range(args.oldtermsfrom if args.oldtermsfrom is not None else args.termid, args.termid+1) if term_id not in [201, 202]]
-    terms_dict = {term_name: term_id for term_id, term_name in terms}
-    terms_dict["?"] = 0 # sort "unknown" last
-    include_last_offered = args.oldtermsfrom is not None
-    title = f"{curriculum.heading} - offered in {terms[-1][1]}{(' and in previous semesters') if include_last_offered else ''}"
+        terms = [(listed_term_id, util.term_id_to_name(listed_term_id)) for listed_term_id in range(old_terms_from if old_terms_from is not None else term_id, term_id+1) if listed_term_id not in [201, 202]]
+        include_last_offered = old_terms_from is not None
+        title = f"{curriculum.heading} - offered in {terms[-1][1]}{(' and in previous semesters') if include_last_offered else ''}"
 
-    print(f"""\nCreating table "{title}"...""")
+        print(f"""\nCreating table "{title}"...""")
+        print("Areas:", self.areas_according_to_curriculum_tree)
 
+        def is_rare_course(course: Course) -> bool:
+            return course.equivalence_class.is_rare(term_id)
 
-    curriculum_entry_paths = [list(curriculum_course_info["rule_node_names_by_levels"].values()) for curriculum_course_info in curriculum_course_infos]
-    areas_according_to_curriculum_tree = list({area: 0 for path in curriculum_entry_paths if (area := curriculum.extract_area(path)) is not None})
-    print("Areas:", areas_according_to_curriculum_tree)
+        def course_last_offered_in(course: Course) -> str:
+            return util.term_id_to_name(course.equivalence_class.previous_term_id)
 
-    def is_rare_course(course: Course) -> bool:
-        equivalent_courses = course.equivalent_courses
-        return (
-            len(equivalent_courses) > 1
-            and equivalent_courses[0].term_id == args.termid
-            and util.term_id_distance(equivalent_courses[0].term_id, equivalent_courses[1].term_id) > 2
-        )
-    
-    def course_last_offered_in(course: Course) -> str:
-        return util.term_id_to_name(course.equivalent_courses[1].term_id)
+        # The filters depend on the view's term
+        self.jinja_environment.filters = {
+            **self.jinja_environment.filters,
+            "is_rare_course": is_rare_course,
+            "course_last_offered_in": course_last_offered_in
+        }
+        jinja_context = {
+            "title": title,
+            "with_rare_and_new_courses": old_terms_from is None,
+            "courses_by_area": courses_by_area,
+            "extra_column_keys": curriculum.extra_columns.keys(),
+            "extra_column_extractors": curriculum.extra_columns.values(),
+            "include_last_offered": include_last_offered,
+            **static_includes(),
+        }
+        template = self.jinja_environment.get_template("base.html")
 
-    jinja_environment = jinja2.Environment(
-        loader=jinja2.FileSystemLoader("../templates/"),
-        trim_blocks=True,
-        lstrip_blocks=True,
-    )
-    jinja_environment.filters = {
-        **jinja_environment.filters,
-        "is_rare_course": is_rare_course,
-        "course_last_offered_in": course_last_offered_in
-    }
-    jinja_context = {
-        "title": title,
-        "with_rare_and_new_courses": args.oldtermsfrom is None,
-        "courses_by_area": sorted(courses_by_area.items(), key=lambda area_and_val: areas_according_to_curriculum_tree.index(area_and_val[0])),
-        "extra_column_keys": curriculum.extra_columns.keys(),
-        "extra_column_extractors": curriculum.extra_columns.values(),
-        "include_last_offered": include_last_offered,
-    }
-    template = jinja_environment.get_template("base.html")
-    rendered = template.render(**jinja_context)
-    
-    with open(args.output, "w") as file:
-        file.write(rendered)
-    print("Wrote table to file", args.output)
+        with metrics.span("render.table", "render", output=view.output), open(view.output, "w") as file:
+            file.writelines(template.generate(**jinja_context))
+        metrics.count("bytes_written.render", os.path.getsize(view.output))
+        print("Wrote table to file", view.output)
+
+    def render_lite(self, view: LiteView):
+        """Writes the thin page of `view` and its data file (see LiteView)."""
+        with metrics.span("render.lite", "render", output=view.page_output):
+            self._render_lite(view)
+
+    def _render_lite(self, view: LiteView):
+        curriculum = self.curriculum
+        # Newest first, so the current term has index 0
+        terms = [term_id for term_id in range(view.term_id, view.old_terms_from - 1, -1) if term_id not in [201, 202]]
+        term_indices = {term_id: index for index, term_id in enumerate(terms)}
+        areas, courses = [], []
+        for area, courses_in_area in self.courses_by_area(view.old_terms_from):
+            for course in courses_in_area:
+                if course.term_id not in term_indices:
+                    continue
+                is_rare = course.equivalence_class.is_rare(view.term_id)
+                courses.append([
+                    len(areas), course.course_code, course.title, course.url.removeprefix(COURSE_DETAILS_BASE_URL),
+                    course.credits, term_indices[course.term_id],
+                    (LITE_FLAG_NEW if course.equivalence_class.is_new() else 0) | (LITE_FLAG_RARE if is_rare else 0),
+                    util.term_id_to_name(course.equivalence_class.previous_term_id) if is_rare else None,
+                    *(value_extractor(course) for value_extractor in curriculum.extra_columns.values()),
+                ])
+            areas.append(area)
+        data = {
+            "title": curriculum.heading,
+            "terms": [[term_id, util.term_id_to_name(term_id)] for term_id in terms],
+            "areas": areas,
+            "extra_columns": list(curriculum.extra_columns.keys()),
+            "course_url_prefix": COURSE_DETAILS_BASE_URL,
+            "columns": [*LITE_COURSE_COLUMNS, *curriculum.extra_columns.keys()],
+            "courses": courses,
+        }
+        os.makedirs(os.path.dirname(view.data_output), exist_ok=True)
+        write_precompressed(view.data_output, json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode())
+
+        page_directory = os.path.dirname(view.page_output)
+        page = "".join(self.jinja_environment.get_template("lite.html").generate(
+            title=curriculum.heading,
+            with_rare_and_new_courses=True,
+            data_url=os.path.relpath(view.data_output, page_directory),
+            full_table_url=os.path.relpath(view.full_table_output, page_directory) if view.full_table_output is not None else None,
+            **static_includes(),
+        ))
+        write_precompressed(view.page_output, page.encode())
+        print(f"Wrote thin page to file {view.page_output} ({len(courses)} courses in {view.data_output})")
+
+def print_html_table(curriculum: Curriculum, term_id: int, output: str, old_terms_from: int | None = None):
+    """
+    Render the table of courses of `curriculum` offered in `term_id` (or, if `old_terms_from` is given, the table of
+    all courses offered since `old_terms_from` with the term they were last offered in) to the HTML file `output`.
+    """
+    CurriculumTables(curriculum).render(TableView(term_id, output, old_terms_from))
+
+def render_inputs_hash(curriculum: Curriculum, views: List[TableView | LiteView]) -> str:
+    """
+    Hash of everything the tables of `curriculum` are rendered from: the curriculum's data files, the code that
+    renders them (including the curriculum configuration in curriculums.py), the templates, and the views.
+    """
+    source_files = [curriculum.all_offered_courses_path, curriculum.tree_file_path,
+                    "print_html_table.py", "curriculums.py", "course_store.py", "util.py",
+                    *glob.glob("../templates/*")]
+    return hash_inputs(source_files, [[type(view).__name__, asdict(view)] for view in views] + [PRECOMPRESSED_SUFFIXES])
+
+def render_curriculum_tables(curriculum: Curriculum, views: List[TableView | LiteView]):
+    """Loads a curriculum once and renders all `views` of it (run in worker processes)."""
+    try:
+        tables = CurriculumTables(curriculum)
+        for view in views:
+            if isinstance(view, LiteView):
+                tables.render_lite(view)
+            else:
+                tables.render(view)
+    finally:
+        metrics.flush()
+
+def limit_worker_memory(max_megabytes: int | None):
+    """
+    Initializer of render worker processes: a worker that allocates more than `max_megabytes` on top of the address
+    space it inherits from the main process (forked workers start with all of its mappings, often hundreds of MiB of
+    virtual memory) fails with MemoryError.
+    """
+    if max_megabytes is not None:
+        import resource # Unix only
+        inherited_bytes = 0
+        if os.path.isfile("/proc/self/statm"): # Linux: the first field is the address space size in pages
+            with open("/proc/self/statm") as f:
+                inherited_bytes = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        resource.setrlimit(resource.RLIMIT_AS, (inherited_bytes + max_megabytes * 1024**2, resource.RLIM_INFINITY))
+
+def render_docs(curriculum_keys: List[str], term_id: int, old_terms_from: int):
+    """Renders the docs/ tables of all `curriculum_keys`, one process per curriculum."""
+    with ProcessPoolExecutor() as executor:
+        for future in [executor.submit(render_curriculum_tables, curriculums[curriculum_key], docs_views(curriculums[curriculum_key], term_id, old_terms_from))
+                       for curriculum_key in curriculum_keys]:
+            future.result()
+
+def main():
+    parser = argparse.ArgumentParser(usage=
+    """
+    print_html_table.py [-h] --termid TERMID --curriculum CURRICULUM --output PATH [--oldtermsfrom OLDTERMID]
+    print_html_table.py [-h] --termid TERMID --oldtermsfrom OLDTERMID --docs [--curriculum CURRICULUM ...]
+    Please provide the term id: winter 2022/23 is 197, summer 2023 is 198, winter 2023/24 is 199, etc.
+    Curriculum: valid options are `master-informatics', 'master-dea'
+    """)
+    parser.add_argument('--termid', required=True, type=int, help="The term id (winter 2022/23 is 197, summer 2023 is 198, etc.)")
+    parser.add_argument("--curriculum", nargs="+", type=str, choices=list(curriculums.keys()), help="One of ['master-informatics', 'master-dea'] (with --docs: any number, default all)")
+    parser.add_argument("--output", required=False, type=str, help="Path where to write the output html")
+    parser.add_argument("--oldtermsfrom", required=False, type=int, help="The term id starting at which old course availability data (last offered) should be fetched")
+    parser.add_argument("--docs", action="store_true", help="Render both tables and the thin page of every curriculum to docs/ (curriculums in parallel processes)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.docs:
+        if args.oldtermsfrom is None:
+            parser.error("--docs requires --oldtermsfrom")
+        with instrumentation.recording("print_html_table", args.metrics, args.trace):
+            render_docs(args.curriculum or list(curriculums.keys()), args.termid, args.oldtermsfrom)
+    else:
+        if args.curriculum is None or len(args.curriculum) != 1 or args.output is None:
+            parser.error("Please provide one --curriculum and --output (or --docs)")
+        with instrumentation.recording("print_html_table", args.metrics, args.trace):
+            print_html_table(curriculums[args.curriculum[0]], args.termid, args.output, args.oldtermsfrom)
 
 if __name__ == "__main__":
     main()
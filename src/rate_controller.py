@@ -0,0 +1,86 @@
+import asyncio
+import math
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+class AimdRateController:
+    """
+    Adaptive limit for the number of requests in flight (additive increase, multiplicative decrease, like TCP
+    congestion control). The window grows by one request per window of healthy responses, and is halved on
+    throttling/server errors (429, 5xx), timeouts and connection errors, or when the p95 latency of the recent
+    responses of a kind (e.g. an endpoint) rises to more than `latency_factor` times the lowest p95 seen so far for
+    that kind: slow endpoints are only compared with themselves. After a decrease, the window isn't decreased again
+    until the requests sent at the old window size have completed.
+    """
+    def __init__(self, initial_window: float = 8, min_window: float = 1, max_window: float = 64,
+                 increase: float = 1, decrease_factor: float = 0.5, latency_factor: float = 2.0, latency_samples: int = 50):
+        self.window = initial_window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.peak_window = initial_window
+        self.decreases = 0
+        self.in_flight = 0
+        # Latencies of the most recent responses by kind (for the p95 checks) and of all responses (for the run metrics)
+        self._recent_latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=latency_samples))
+        self.latencies: List[float] = []
+        self._baseline_p95: Dict[str, float] = defaultdict(lambda: math.inf)
+        self._responses_until_next_decrease = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Waits until the window allows another request in flight, and holds that slot while the request runs."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < max(self.min_window, math.floor(self.window)))
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self, latency: float, kind: str = ""):
+        """A healthy response of kind `kind` (whose latencies are compared with each other) arrived after `latency` s."""
+        self.latencies.append(latency)
+        recent_latencies = self._recent_latencies[kind]
+        recent_latencies.append(latency)
+        self._responses_until_next_decrease -= 1
+        if len(recent_latencies) == recent_latencies.maxlen:
+            recent_p95 = percentile(sorted(recent_latencies), 0.95)
+            self._baseline_p95[kind] = min(self._baseline_p95[kind], recent_p95)
+            if recent_p95 > self.latency_factor * self._baseline_p95[kind]:
+                self._decrease()
+                return
+        self.window = min(self.max_window, self.window + self.increase / self.window)
+        self.peak_window = max(self.peak_window, self.window)
+
+    def on_failure(self):
+        """Throttling, server error, timeout or connection error."""
+        self._responses_until_next_decrease -= 1
+        self._decrease()
+
+    def _decrease(self):
+        if self._responses_until_next_decrease > 0:
+            return
+        self.window = max(self.min_window, self.window * self.decrease_factor)
+        self.decreases += 1
+        self._responses_until_next_decrease = self.in_flight
+        # Judge the latencies at the new window size on their own
+        self._recent_latencies.clear()
+
+    def summary(self) -> str:
+        if len(self.latencies) == 0:
+            latencies = "no responses"
+        else:
+            sorted_latencies = sorted(self.latencies)
+            latencies = f"latency p50 {percentile(sorted_latencies, 0.5):.2f}s, p95 {percentile(sorted_latencies, 0.95):.2f}s"
+        return f"concurrency window {self.window:.1f} (peak {self.peak_window:.1f}, {self.decreases} decreases), {latencies}"
@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from webdriver_manager.firefox import GeckoDriverManager
+
+import fetch_curriculum_tree
+import fetch_curriculum_tree_http
+import instrumentation
+import print_html_table
+import update_course_database
+from browser_pool import BrowserPool
+from curriculums import CURRICULUM_LIST_PATH, PROGRAMS_DIRECTORY, Curriculum, curriculums, program_curriculums
+from equivalence_index import EquivalenceIndex
+from instrumentation import metrics
+from manifest import Manifest
+from response_cache import CACHE_MODES, ResponseCache
+from tumonline_client import TumOnlineClient
+
+STAGES = ["update", "tree", "render"]
+
+@dataclass
+class Task:
+    curriculum_key: str
+    stage: str
+    run: Callable[[], Awaitable[None]]
+    dependencies: List["Task"] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return f"{self.curriculum_key}/{self.stage}"
+
+async def run_task_graph(tasks: List[Task]) -> Dict[str, Tuple[float, float]]:
+    """
+    Runs every task as soon as all of its dependencies have finished (dependencies must appear before their
+    dependents in `tasks`). Returns the (start, end) wall-clock times of all tasks that ran.
+    Tasks whose dependencies failed are not run; the first failure is re-raised after all other tasks are done.
+    """
+    timings: Dict[str, Tuple[float, float]] = {}
+    futures: Dict[str, asyncio.Future] = {}
+
+    async def run_task(task: Task):
+        await asyncio.gather(*(futures[dependency.name] for dependency in task.dependencies))
+        start = time.perf_counter()
+        try:
+            with metrics.span(task.stage, "stage", curriculum=task.curriculum_key):
+                await task.run()
+        except Exception:
+            print(f"[{task.name}] failed after {time.perf_counter() - start:.1f}s")
+            raise
+        timings[task.name] = (start, time.perf_counter())
+        print(f"[{task.name}] done in {timings[task.name][1] - start:.1f}s")
+
+    for task in tasks:
+        futures[task.name] = asyncio.ensure_future(run_task(task))
+    results = await asyncio.gather(*futures.values(), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return timings
+
+# How often run_in_pool checks that the worker process running its task is still alive
+WORKER_CHECK_SECONDS = 1.0
+
+class WorkerLostError(Exception):
+    pass
+
+# In WorkerPool worker processes: where a worker reports which task it started
+_task_started_queue: Any = None
+
+def _init_pool_worker(task_started_queue, initializer: Callable[..., None] | None, initargs: Tuple):
+    global _task_started_queue
+    _task_started_queue = task_started_queue
+    if initializer is not None:
+        initializer(*initargs)
+
+def _run_pool_task(task_id: int, function: Callable[..., Any], args: Tuple) -> Any:
+    _task_started_queue.put((task_id, os.getpid()))
+    return function(*args)
+
+class WorkerPool(multiprocessing.pool.Pool):
+    """
+    multiprocessing.Pool whose workers report the process that runs each task, so run_in_pool can tell when a worker
+    died in the middle of a task (e.g. killed by the OOM killer): Pool replaces such a worker, but never completes
+    (or fails) its task.
+    """
+    def __init__(self, processes: int | None = None, initializer: Callable[..., None] | None = None, initargs: Tuple = (),
+                 maxtasksperchild: int | None = None):
+        self._task_started_queue = multiprocessing.SimpleQueue()
+        self._task_pids: Dict[int, int] = {}
+        self.task_ids = itertools.count()
+        super().__init__(processes, _init_pool_worker, (self._task_started_queue, initializer, initargs), maxtasksperchild)
+
+    def pop_task_pid(self, task_id: int) -> int | None:
+        while not self._task_started_queue.empty():
+            started_task_id, pid = self._task_started_queue.get()
+            self._task_pids[started_task_id] = pid
+        return self._task_pids.pop(task_id, None)
+
+async def run_in_pool(pool: WorkerPool, function: Callable[..., Any], *args) -> Any:
+    """
+    Runs `function(*args)` in a worker process of `pool` and returns its result, without blocking the event loop.
+    Raises WorkerLostError if the worker process dies before the task finishes.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    task_id = next(pool.task_ids)
+    pool.apply_async(_run_pool_task, (task_id, function, args),
+                     callback=lambda result: loop.call_soon_threadsafe(future.set_result, result),
+                     error_callback=lambda exception: loop.call_soon_threadsafe(future.set_exception, exception))
+    pid = None
+    try:
+        while True:
+            done, _ = await asyncio.wait([future], timeout=WORKER_CHECK_SECONDS)
+            if len(done) > 0:
+                return future.result()
+            pid = pid or pool.pop_task_pid(task_id)
+            if pid is not None and pid not in {process.pid for process in multiprocessing.active_children()}:
+                # A worker also exits right after sending the result of its last task (see maxtasksperchild)
+                done, _ = await asyncio.wait([future], timeout=WORKER_CHECK_SECONDS)
+                if len(done) > 0:
+                    return future.result()
+                raise WorkerLostError(f"The worker process running {function.__name__} (pid {pid}) died")
+    finally:
+        if pid is None:
+            pool.pop_task_pid(task_id)
+
+def print_timings(timings: Dict[str, Tuple[float, float]], start: float):
+    print("\nWall-clock time per task:")
+    for name, (task_start, task_end) in sorted(timings.items()):
+        print(f"  {name:<45} {task_end - task_start:7.1f}s")
+    print("Wall-clock time per stage (first start to last end):")
+    for stage in STAGES:
+        stage_timings = [timing for name, timing in timings.items() if name.endswith(f"/{stage}")]
+        if len(stage_timings) > 0:
+            print(f"  {stage:<45} {max(end for _, end in stage_timings) - min(start for start, _ in stage_timings):7.1f}s")
+    print(f"Total: {time.perf_counter() - start:.1f}s")
+
+def is_up_to_date(manifest: Manifest | None, force: bool, stage: str, curriculum_key: str, inputs_hash: str) -> bool:
+    """Whether `stage` of a curriculum can be skipped: its inputs and outputs are unchanged since the last run."""
+    if manifest is None or force or not manifest.is_up_to_date(stage, curriculum_key, inputs_hash):
+        return False
+    print(f"[{curriculum_key}/{stage}] inputs and outputs unchanged since the last run, skipping it")
+    metrics.count(f"{stage}.skipped_curriculums")
+    return True
+
+def build_tasks(client: TumOnlineClient, selected_curriculums: Dict[str, Curriculum], stages: List[str], term_id: int, old_terms_from: int,
+                parallel_drivers: int, parallel_trees: int, tree_engine: str, render_pool: WorkerPool,
+                expand_mode: str = "bulk", browser_pool: BrowserPool | None = None, all_versions: bool = True,
+                resume_trees: bool = False, manifest: Manifest | None = None, force: bool = False,
+                parallel_updates: int = 8) -> List[Task]:
+    """
+    Builds the (curriculum x stage) task graph of `selected_curriculums` (by key): updating the course database and
+    fetching the curriculum tree are independent of each other, rendering the HTML tables of a curriculum depends on
+    both. At most `parallel_updates` course databases are updated and `parallel_trees` trees fetched at the same
+    time, and the tables are rendered by the workers of `render_pool`, so however many curriculums there are,
+    the work in progress is bounded.
+    With the selenium tree engine, all curriculum trees are fetched with the browsers of `browser_pool`.
+    Every stage of a curriculum is skipped if its inputs and outputs are unchanged since the run recorded in
+    `manifest`, unless `force` is set. The inputs of the update and tree stages include what they would fetch from
+    TUMonline: the current term's course listings and the fingerprints of the unexpanded tree pages (see
+    update_course_database.update_inputs_hash and fetch_curriculum_tree_http.tree_inputs_hash), which take a few
+    requests instead of the whole fetch.
+    """
+    # Shared between all curriculums, so courses that appear in several curriculums are only resolved once
+    equivalence_index = EquivalenceIndex()
+    update_semaphore = asyncio.Semaphore(parallel_updates)
+    tree_semaphore = asyncio.Semaphore(parallel_trees)
+
+    tasks: List[Task] = []
+    for curriculum_key, curriculum in selected_curriculums.items():
+        update_task = tree_task = None
+
+        if "update" in stages:
+            async def update(curriculum_key=curriculum_key, curriculum=curriculum):
+                async with update_semaphore:
+                    inputs_hash = await update_course_database.update_inputs_hash(client, curriculum, term_id, old_terms_from) if manifest is not None else ""
+                    if is_up_to_date(manifest, force, "update", curriculum_key, inputs_hash):
+                        return
+                    await update_course_database.update_course_database(
+                        client, curriculum, term_id, old_terms_from, equivalence_index)
+                    if manifest is not None:
+                        manifest.record("update", curriculum_key, inputs_hash, [curriculum.all_offered_courses_path])
+            update_task = Task(curriculum_key, "update", update)
+            tasks.append(update_task)
+
+        if "tree" in stages:
+            async def tree(curriculum_key=curriculum_key, curriculum=curriculum):
+                async with tree_semaphore:
+                    # Both engines produce the same tree, so the pages are fingerprinted over HTTP either way
+                    inputs_hash = await fetch_curriculum_tree_http.tree_inputs_hash(client, curriculum, parallel_drivers, all_versions) if manifest is not None else ""
+                    if is_up_to_date(manifest, force, "tree", curriculum_key, inputs_hash):
+                        return
+                    if tree_engine == "http":
+                        await fetch_curriculum_tree_http.fetch_curriculum_tree(client, curriculum, parallel_drivers, all_versions, resume_trees)
+                    else:
+                        await asyncio.to_thread(fetch_curriculum_tree.fetch_curriculum_tree,
+                                                curriculum, browser_pool, expand_mode, all_versions, resume_trees)
+                    if manifest is not None:
+                        manifest.record("tree", curriculum_key, inputs_hash, [curriculum.tree_file_path])
+            tree_task = Task(curriculum_key, "tree", tree)
+            tasks.append(tree_task)
+
+        if "render" in stages:
+            async def render(curriculum_key=curriculum_key, curriculum=curriculum):
+                views = print_html_table.docs_views(curriculum, term_id, old_terms_from)
+                # Hashed when the update and tree stages have written the data
+                inputs_hash = print_html_table.render_inputs_hash(curriculum, views)
+                if is_up_to_date(manifest, force, "render", curriculum_key, inputs_hash):
+                    return
+                # Both tables are rendered from one load of the curriculum, in a worker process
+                await run_in_pool(render_pool, print_html_table.render_curriculum_tables, curriculum, views)
+                if manifest is not None:
+                    manifest.record("render", curriculum_key, inputs_hash, [output for view in views for output in view.outputs])
+            tasks.append(Task(curriculum_key, "render", render,
+                              dependencies=[task for task in [update_task, tree_task] if task is not None]))
+    return tasks
+
+async def main():
+    parser = argparse.ArgumentParser(usage=
+    """
+    regenerate.py [-h] --termid TERMID --oldtermsfrom OLDTERMID [--curriculum CURRICULUM ...] [--stages STAGE ...] [--programs [--program_filter REGEX]]
+    Regenerates the course databases, curriculum trees and HTML tables of all (or the selected) curriculums in one process.
+    With --programs, also those of all study programs in data/curriculums-list.json.
+    Please provide the term id: winter 2023/24 is 199, summer 2024 is 200, winter 2024/25 is 203 (!), etc.
+    """)
+    parser.add_argument('--termid', required=True, type=int, help="The current term id (winter 2023/24 is 199, summer 2024 is 200, winter 2024/25 is 203 (!), etc)")
+    parser.add_argument('--oldtermsfrom', required=True, type=int, help="The first term included in the course database and the \"all\" tables")
+    parser.add_argument("--curriculum", nargs="+", default=list(curriculums.keys()), choices=list(curriculums.keys()),
+                        help="The curriculums to regenerate (default: all)")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES, help="The stages to run (default: all)")
+    parser.add_argument("--parallel_drivers", default=8, type=int, help="How many browser sessions to share between the curriculum tree fetches (or, with --engine http, how many pages each tree fetch requests at the same time)")
+    parser.add_argument("--engine", default="selenium", choices=["selenium", "http"],
+                        help="How to fetch the curriculum trees: in headless Firefox instances, or over plain HTTP without a browser")
+    parser.add_argument("--expand_mode", default="bulk", choices=fetch_curriculum_tree.EXPAND_MODES,
+                        help="With --engine selenium: expand all tree nodes of a kind in one script call (bulk), or click every node separately (clicks)")
+    parser.add_argument("--first_version_only", action="store_true",
+                        help="Only fetch the curriculum tree of the first (newest) version of each curriculum instead of all versions")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse the checkpoints of already scraped curriculum tree pages without loading them again (e.g. after an interrupted run)")
+    parser.add_argument("--parallel_trees", default=2, type=int, help="How many curriculum trees are fetched at the same time")
+    parser.add_argument("--force", action="store_true", help="Run all stages of all curriculums, even those whose inputs did not change since the last run")
+    parser.add_argument("--programs", action="store_true",
+                        help=f"Batch mode: also regenerate every study program in {CURRICULUM_LIST_PATH} that has a currently valid version (with a generic area extractor, to data/{PROGRAMS_DIRECTORY}/ and docs/{PROGRAMS_DIRECTORY}/)")
+    parser.add_argument("--program_filter", default="", help="With --programs: only the programs whose key matches this regular expression (e.g. 'master-of-science$')")
+    parser.add_argument("--parallel_updates", default=8, type=int, help="How many course databases are updated at the same time")
+    parser.add_argument("--parallel_renders", default=None, type=int, help="How many worker processes render tables (default: one per CPU core)")
+    parser.add_argument("--worker_max_tasks", default=20, type=int, help="Replace a render worker process after it rendered this many curriculums (bounds what it accumulates)")
+    parser.add_argument("--worker_memory_mb", default=None, type=int, help="Limit how much address space every render worker process may allocate beyond what it inherits from the main process, in MiB (Unix only)")
+    parser.add_argument('--cache-mode', default="use", choices=CACHE_MODES, help="use: answer requests about past terms from the on-disk response cache, refresh: always fetch, offline: only use the cache")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    selected_curriculums = {curriculum_key: curriculums[curriculum_key] for curriculum_key in args.curriculum}
+    if args.programs:
+        programs = {program_key: program for program_key, program in program_curriculums().items() if re.search(args.program_filter, program_key)}
+        print(f"Batch mode: {len(programs)} programs from '{CURRICULUM_LIST_PATH}' in addition to {len(selected_curriculums)} curriculums")
+        selected_curriculums.update(programs)
+        for directory in [f"../data/{PROGRAMS_DIRECTORY}", f"../docs/{PROGRAMS_DIRECTORY}"]:
+            os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    manifest = Manifest()
+    with instrumentation.recording("regenerate", args.metrics, args.trace):
+        # One response cache, TUMonline client and equivalence index (see build_tasks) are shared by all curriculums
+        async with TumOnlineClient(cache=ResponseCache(args.termid, args.cache_mode)) as client:
+            # The browsers are started once, and shared by the tree fetches of all curriculums
+            uses_browsers = "tree" in args.stages and args.engine == "selenium"
+            with WorkerPool(args.parallel_renders, print_html_table.limit_worker_memory, (args.worker_memory_mb,),
+                            maxtasksperchild=args.worker_max_tasks) as render_pool, \
+                    (BrowserPool(args.parallel_drivers, GeckoDriverManager().install()) if uses_browsers else nullcontext()) as browser_pool:
+                tasks = build_tasks(client, selected_curriculums, args.stages, args.termid, args.oldtermsfrom,
+                                    args.parallel_drivers, args.parallel_trees, args.engine, render_pool, args.expand_mode, browser_pool,
+                                    not args.first_version_only, args.resume, manifest, args.force, args.parallel_updates)
+                try:
+                    timings = await run_task_graph(tasks)
+                finally:
+                    # Also record the stages that finished before a failure
+                    manifest.save()
+    print_timings(timings, start)
+    print("TUMonline requests:", client.stats.summary())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
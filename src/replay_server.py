@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import glob
+import json
+import math
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from html import escape
+from typing import Any, Dict, List, Tuple
+from urllib.parse import unquote, urlsplit
+
+from aiohttp import web
+
+from curriculums import Curriculum, curriculums
+
+# Local stand-in for the parts of TUMonline the fetchers use: the course listing and same-courses REST endpoints and
+# the curriculum tree pages. Point the fetchers at it with the TUMONLINE_BASE_URL environment variable (see
+# tumonline_client.py) to run them, or a whole regeneration, without access to campus.tum.de.
+
+# Course entries per curriculum tree page
+TREE_PAGE_SIZE = 50
+# Indent per level (rank, see curriculum_tree.rank_levels) of the rule nodes on the tree pages
+TREE_LEVEL_INDENT = 20
+# Indent of module nodes on the tree pages: deeper than all rule nodes, so a module node never resets a rule node
+MODULE_NODE_INDENT = 1000
+FILTER_REGEX = re.compile(r"(\w+)-eq=([^;]*)")
+
+@dataclass
+class Faults:
+    """What the server does to the requests, on top of answering them (see the command line options)."""
+    latency_median_seconds: float = 0
+    latency_sigma: float = 0
+    error_rate: float = 0
+    requests_per_second: float | None = None
+    max_concurrency: int | None = None
+    max_page_size: int | None = None
+    total_count: bool = True
+
+class TokenBucket:
+    """Throttling: allows `rate` requests per second on average, and bursts of up to `rate` requests."""
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float | None:
+        """Takes a token, or returns the number of seconds until the next token if there is none."""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return None
+
+def load_recordings(directory: str) -> Dict[str, Any]:
+    """
+    Reads the responses of a response cache directory (see response_cache.py), by the path and query of their URL.
+    Where responses from several hosts have the same path and query, the newest one is served.
+    """
+    entries = []
+    for path in glob.glob(f"{directory}/*/*.json"):
+        with open(path) as f:
+            entries.append(json.load(f))
+    recordings = {}
+    for entry in sorted(entries, key=lambda entry: entry["fetched_at"]):
+        url = urlsplit(entry["url"])
+        recordings[unquote(f"{url.path}?{url.query}")] = entry["body"]
+    return recordings
+
+def listing_course_dto(course_dto: Dict[str, Any]) -> Dict[str, Any]:
+    """A course of the course database as the course listing returns it (before update_course_database cleans it)."""
+    title = course_dto["title"]
+    return {"id": course_dto["id"], "courseTypeDto": course_dto["courseTypeDto"], "semesterDto": course_dto["semesterDto"],
+            "courseTitle": {"value": title, "translations": {"translation": [{"lang": "en", "value": title}]}}}
+
+# The language menu of TUMonline's pages, which the Selenium engine clicks to switch to English (see
+# browser_pool.start_driver). The stand-in always answers in English, so choosing a language does nothing.
+LANGUAGE_MENU = ('<coa-desktop-language-menu onclick="document.getElementById(\'language-options\').hidden = false">Language</coa-desktop-language-menu>'
+                 '<div id="language-options" hidden><button type="button" title="Language English">English</button></div>')
+
+def tree_page_html(page: int, num_pages: int, rows: List[str]) -> str:
+    # The Selenium engine reads the number of pages from the last line of the page select, the HTTP engine from "of <n>"
+    page_select = f'<div class="coTableNaviPageSelect">Page {page}<br>of {num_pages}</div>'
+    return f"<html><body>{LANGUAGE_MENU}{page_select}<table>{''.join(rows)}</table></body></html>"
+
+def tree_rule_row(level: int, name: str | None) -> str:
+    # A node without name resets the rule node at its level (see curriculum_tree.extract_courses_from_nodes)
+    title, text = ("Rule node", escape(name)) if name is not None else ("Other node", "")
+    return f'<tr><td><span style="padding-left:{TREE_LEVEL_INDENT * (level + 1)}px"><span title="{title}">{text}</span></span></td></tr>'
+
+def tree_module_row(course_info: Dict[str, Any], expansion_url: str | None = None) -> str:
+    plus_button = f'<a class="KnotenLink" href="{escape(expansion_url)}">+</a>' if expansion_url is not None else ""
+    credits = course_info["num_credits"] if course_info["num_credits"] is not None else ""
+    return (f'<tr><td><span style="padding-left:{MODULE_NODE_INDENT}px"><span title="Module node">{escape(course_info["module_name"] or "")}</span></span>{plus_button}</td>'
+            f'<td></td><td></td><td><span>{credits}</span></td></tr>')
+
+def tree_course_rows(course_info: Dict[str, Any]) -> str:
+    # The links are the absolute URLs of the tree file, so the fetched tree is the same as the one served
+    return "".join(f'<tr><td><a href="{escape(url)}">{escape(url[url.rfind("/") + 1:])}</a></td></tr>' for url in course_info["urls"])
+
+class CurriculumFixture:
+    """The responses about one curriculum, synthesized from its course database export and curriculum tree file."""
+    def __init__(self, curriculum: Curriculum, collapsed_modules: bool):
+        self.curriculum = curriculum
+        self.collapsed_modules = collapsed_modules
+        with open(curriculum.all_offered_courses_path) as f:
+            self.course_dtos = json.load(f)["courses"]
+        self.listings: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        for course_dto in sorted(self.course_dtos, key=lambda course_dto: course_dto["title"].casefold()):
+            self.listings[course_dto["semesterDto"]["id"]].append(listing_course_dto(course_dto))
+        with open(curriculum.tree_file_path) as f:
+            self.course_infos = json.load(f)
+        self.tree_pages = self._split_tree_pages()
+
+    def _split_tree_pages(self) -> List[List[int]]:
+        """The indices of the course entries on every tree page."""
+        pages: List[List[int]] = [[]]
+        for index, course_info in enumerate(self.course_infos):
+            # A page can't start with an entry without credits: it would get the credits of the previous page's last
+            # module (see curriculum_tree.merge_page_results)
+            if len(pages[-1]) >= TREE_PAGE_SIZE and course_info["num_credits"] is not None:
+                pages.append([])
+            pages[-1].append(index)
+        return pages
+
+    def tree_page(self, curriculum_id: str, page: int, expansion_url: str) -> str:
+        """
+        The HTML of a curriculum tree page. The newest curriculum version has all entries, older versions only a
+        root node (their entries are the same as the newest version's after merge_version_results). The rule nodes
+        are only repeated where they change, like on TUMonline. With `collapsed_modules`, the course links of every
+        module are behind a plus button that loads them (the HTTP engine expands them, the Selenium engine can't).
+        Every page has TUMonline's language menu, so the Selenium engine's browsers can start on any of them.
+        """
+        if curriculum_id != self.curriculum.curriculum_ids[0]:
+            return tree_page_html(1, 1, [tree_rule_row(0, self.curriculum.heading)])
+        rows = []
+        # The rule nodes active at the start of the page
+        first_index = self.tree_pages[page - 1][0]
+        rule_node_names_by_levels = {int(level): name for level, name in self.course_infos[first_index - 1]["rule_node_names_by_levels"].items()} if first_index > 0 else {}
+        for index in self.tree_pages[page - 1]:
+            course_info = self.course_infos[index]
+            levels = {int(level): name for level, name in course_info["rule_node_names_by_levels"].items()}
+            rows += [tree_rule_row(level, None) for level in rule_node_names_by_levels if level not in levels]
+            rows += [tree_rule_row(level, name) for level, name in levels.items() if rule_node_names_by_levels.get(level) != name]
+            rule_node_names_by_levels = levels
+            if self.collapsed_modules:
+                rows.append(tree_module_row(course_info, f"{expansion_url}?pStpStpNr={curriculum_id}&pEntry={index}"))
+            else:
+                rows += [tree_module_row(course_info), tree_course_rows(course_info)]
+        return tree_page_html(page, len(self.tree_pages), rows)
+
+    def tree_module(self, index: int) -> str:
+        """The rows that replace a collapsed module row when its plus button is clicked."""
+        course_info = self.course_infos[index]
+        return tree_module_row(course_info) + tree_course_rows(course_info)
+
+class ReplayServer:
+    """
+    Serves recorded responses (a response cache directory, see response_cache.py) where it has them, and otherwise
+    answers from the committed data of all curriculums: the course listings from the course database exports, the
+    same-courses lists from their equivalence classes, and the curriculum tree pages from the curriculum tree files.
+    Every request is delayed, failed or throttled according to `faults`.
+    """
+    def __init__(self, faults: Faults, recordings_directory: str | None = None, collapsed_modules: bool = False, seed: int = 0):
+        self.faults = faults
+        self.random = random.Random(seed)
+        self.recordings = load_recordings(recordings_directory) if recordings_directory is not None else {}
+        self.fixtures = [CurriculumFixture(curriculum, collapsed_modules) for curriculum in curriculums.values()]
+        self.fixtures_by_curriculum_id = {curriculum_id: fixture for fixture in self.fixtures for curriculum_id in fixture.curriculum.curriculum_ids}
+        # Equivalence classes, by the id of their oldest course
+        self.course_dtos_by_id: Dict[int, Dict[str, Any]] = {}
+        self.equivalence_classes: Dict[int, Dict[int, Dict[str, Any]]] = defaultdict(dict)
+        for fixture in self.fixtures:
+            for course_dto in fixture.course_dtos:
+                self.course_dtos_by_id[course_dto["id"]] = course_dto
+                self.equivalence_classes[course_dto["oldestRelatedCourseId"]][course_dto["id"]] = course_dto
+        self.throttle = TokenBucket(faults.requests_per_second) if faults.requests_per_second is not None else None
+        self.requests_in_flight = 0
+        self.responses = Counter()
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.inject_faults, self.replay_recordings])
+        app.router.add_get("/tumonline/ee/rest/slc.tm.cp/student/courses", self.course_listing)
+        app.router.add_get("/tumonline/ee/rest/slc.tm.cp/student/courses/same-courses/{course_id}", self.same_courses)
+        app.router.add_get("/tumonline/wbstpcs.showSpoTree", self.tree_page)
+        app.router.add_get("/tumonline/wbstpcs.showSpoTreeModule", self.tree_module)
+        return app
+
+    @web.middleware
+    async def inject_faults(self, request: web.Request, handler) -> web.StreamResponse:
+        endpoint = request.match_info.route.resource.canonical if request.match_info.route.resource is not None else "other"
+        if self.throttle is not None and (retry_after := self.throttle.take()) is not None:
+            status = 429
+            response = web.Response(status=429, headers={"Retry-After": str(math.ceil(retry_after))})
+        elif self.faults.max_concurrency is not None and self.requests_in_flight >= self.faults.max_concurrency:
+            status = 503
+            response = web.Response(status=503)
+        else:
+            self.requests_in_flight += 1
+            try:
+                if self.faults.latency_median_seconds > 0:
+                    await asyncio.sleep(self.random.lognormvariate(math.log(self.faults.latency_median_seconds), self.faults.latency_sigma))
+                if self.random.random() < self.faults.error_rate:
+                    response = web.Response(status=self.random.choice([500, 502, 503, 504]))
+                else:
+                    response = await handler(request)
+            except web.HTTPException as exception:
+                self.responses[endpoint, exception.status] += 1
+                raise
+            finally:
+                self.requests_in_flight -= 1
+            status = response.status
+        self.responses[endpoint, status] += 1
+        return response
+
+    @web.middleware
+    async def replay_recordings(self, request: web.Request, handler) -> web.StreamResponse:
+        recorded_body = self.recordings.get(unquote(request.path_qs))
+        if recorded_body is None:
+            return await handler(request)
+        if isinstance(recorded_body, str):
+            return web.Response(text=recorded_body, content_type="text/html")
+        return web.json_response(recorded_body)
+
+    async def course_listing(self, request: web.Request) -> web.Response:
+        filters = dict(FILTER_REGEX.findall(request.query.get("$filter", "")))
+        fixture = self.fixtures_by_curriculum_id.get(filters.get("curriculumVersionId"))
+        listing = fixture.listings.get(int(filters.get("termId", 0)), []) if fixture is not None else []
+        skip = int(request.query.get("$skip", 0))
+        top = int(request.query.get("$top", len(listing)))
+        if self.faults.max_page_size is not None:
+            top = min(top, self.faults.max_page_size)
+        body: Dict[str, Any] = {"courses": listing[skip:skip + top]}
+        if self.faults.total_count:
+            body["totalCount"] = len(listing)
+        return web.json_response(body)
+
+    async def same_courses(self, request: web.Request) -> web.Response:
+        course_dto = self.course_dtos_by_id.get(int(request.match_info["course_id"]))
+        if course_dto is None:
+            return web.json_response({"courses": []})
+        oldest_related_course_id = course_dto["oldestRelatedCourseId"]
+        equivalence_class = self.equivalence_classes[oldest_related_course_id]
+        related_courses = [{"id": related_course_id, "semesterDto": related_course_dto["semesterDto"]}
+                           for related_course_id, related_course_dto in equivalence_class.items()]
+        if oldest_related_course_id not in equivalence_class:
+            # The oldest course was offered before the first term in the data
+            oldest_term_id = min(related_course_dto["semesterDto"]["id"] for related_course_dto in equivalence_class.values())
+            related_courses.append({"id": oldest_related_course_id, "semesterDto": {"id": oldest_term_id - 1}})
+        return web.json_response({"courses": related_courses})
+
+    async def tree_page(self, request: web.Request) -> web.Response:
+        curriculum_id = request.query.get("pStpStpNr", "")
+        if (fixture := self.fixtures_by_curriculum_id.get(curriculum_id)) is None:
+            raise web.HTTPNotFound()
+        page = int(request.query.get("pPageNr") or 1)
+        if not 1 <= page <= len(fixture.tree_pages):
+            raise web.HTTPNotFound()
+        return web.Response(text=fixture.tree_page(curriculum_id, page, "wbstpcs.showSpoTreeModule"), content_type="text/html")
+
+    async def tree_module(self, request: web.Request) -> web.Response:
+        if (fixture := self.fixtures_by_curriculum_id.get(request.query.get("pStpStpNr", ""))) is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=fixture.tree_module(int(request.query["pEntry"])), content_type="text/html")
+
+    def summary(self) -> str:
+        responses_by_endpoint: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for (endpoint, status), count in sorted(self.responses.items()):
+            responses_by_endpoint[endpoint].append((status, count))
+        return "\n".join(f"  {endpoint}: " + ", ".join(f"{status}: {count}" for status, count in statuses)
+                         for endpoint, statuses in responses_by_endpoint.items()) or "  no requests"
+
+def main():
+    parser = argparse.ArgumentParser(usage=
+        "python replay_server.py [--port PORT] [--latency_median_ms MS] [--latency_sigma SIGMA] [--error_rate RATE] "
+        "[--requests_per_second RPS] [--max_concurrency N] [--max_page_size N] [--no_total_count] [--recordings DIR] "
+        "[--collapsed_modules]")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=8080, type=int)
+    parser.add_argument("--latency_median_ms", default=0, type=float, help="Median delay of the responses (log-normally distributed)")
+    parser.add_argument("--latency_sigma", default=0.5, type=float, help="Spread of the delays: sigma of the log-normal distribution (0: every response takes the median)")
+    parser.add_argument("--error_rate", default=0, type=float, help="Fraction of the requests answered with a 500, 502, 503 or 504 error")
+    parser.add_argument("--requests_per_second", default=None, type=float, help="Throttling: answer requests beyond this rate with 429 Too Many Requests")
+    parser.add_argument("--max_concurrency", default=None, type=int, help="Answer requests beyond this many in flight with 503 Service Unavailable")
+    parser.add_argument("--max_page_size", default=None, type=int, help="Return at most this many courses per listing page, whatever $top asks for")
+    parser.add_argument("--no_total_count", action="store_true", help="Leave out the totalCount of the course listings")
+    parser.add_argument("--recordings", default=None, help="A response cache directory (e.g. ../data/http_cache) whose responses are served where they exist")
+    parser.add_argument("--collapsed_modules", action="store_true", help="Load the course links of the tree pages' modules on request (only for --engine http)")
+    parser.add_argument("--seed", default=0, type=int, help="Seed of the latencies and errors")
+    args = parser.parse_args()
+
+    faults = Faults(args.latency_median_ms / 1000, args.latency_sigma, args.error_rate, args.requests_per_second,
+                    args.max_concurrency, args.max_page_size, not args.no_total_count)
+    server = ReplayServer(faults, args.recordings, args.collapsed_modules, args.seed)
+    app = server.app()
+    async def print_summary(_):
+        print("Responses by endpoint and status:")
+        print(server.summary())
+    app.on_cleanup.append(print_summary)
+    print(f"Serving {len(server.recordings)} recorded responses and the data of {len(server.fixtures)} curriculums. Run the scripts with:")
+    print(f"  export TUMONLINE_BASE_URL=http://{args.host}:{args.port}/tumonline")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Any, Iterator, Tuple
+
+import util
+from instrumentation import metrics
+
+CACHE_MODES = ["use", "refresh", "offline"]
+
+# How long responses about a term stay valid, by distance (in terms) to the current term:
+# the current term always revalidates, the previous term can still change for a while, older terms never change
+MAX_AGE_SECONDS_BY_TERM_DISTANCE = {0: 0, 1: 7 * 24 * 3600}
+
+class ResponseCacheMiss(Exception):
+    pass
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of TUMonline REST responses: every response is stored as a JSON file named after
+    the SHA-256 hash of its URL (i.e. endpoint and parameters). Whether a cached response can be used depends on the
+    term it is about (see MAX_AGE_SECONDS_BY_TERM_DISTANCE). The least recently used responses are evicted when the
+    cache grows beyond `max_size_bytes`.
+
+    Modes: "use" answers from the cache where the entry is still valid, "refresh" always fetches (and updates the
+    cache), "offline" only answers from the cache (regardless of age) and raises ResponseCacheMiss otherwise.
+    """
+    def __init__(self, current_term_id: int, mode: str = "use", directory: str = "../data/http_cache",
+                 max_size_bytes: int = 1024**3):
+        assert mode in CACHE_MODES
+        self.current_term_id = current_term_id
+        self.mode = mode
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size_bytes = sum(os.path.getsize(path) for path, _ in self._entry_paths())
+
+    def _entry_paths(self) -> Iterator[Tuple[str, float]]:
+        if not os.path.isdir(self.directory):
+            return
+        for subdirectory in os.scandir(self.directory):
+            if subdirectory.is_dir():
+                for entry in os.scandir(subdirectory.path):
+                    yield entry.path, entry.stat().st_mtime
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def max_age_seconds(self, term_id: int | None) -> float:
+        if term_id is None or term_id >= self.current_term_id:
+            return 0
+        return MAX_AGE_SECONDS_BY_TERM_DISTANCE.get(util.term_id_distance(term_id, self.current_term_id), math.inf)
+
+    def get(self, url: str, term_id: int | None) -> Any | None:
+        """Returns the cached response for `url` if it may be used in the current mode, else None."""
+        if self.mode == "refresh":
+            return None
+        path = self._path(url)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+                metrics.count("bytes_read.http_cache", os.fstat(f.fileno()).st_size)
+        except FileNotFoundError:
+            entry = None
+        except json.JSONDecodeError:
+            # A damaged entry (e.g. from before writes were atomic): drop it and fetch again
+            self._size_bytes -= os.path.getsize(path)
+            os.remove(path)
+            entry = None
+        if entry is None or (self.mode == "use" and time.time() - entry["fetched_at"] > self.max_age_seconds(term_id)):
+            self.misses += 1
+            if self.mode == "offline":
+                raise ResponseCacheMiss(f"No cached response for {url} (cache mode is 'offline')")
+            return None
+        self.hits += 1
+        os.utime(path) # mark as recently used for the eviction
+        return entry["body"]
+
+    def put(self, url: str, term_id: int | None, body: Any):
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+        # Write to a temporary file first, so a crash or a concurrent reader never sees a partial entry
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"url": url, "term_id": term_id, "fetched_at": time.time(), "body": body}, f)
+        new_size = os.path.getsize(temporary_path)
+        os.replace(temporary_path, path)
+        metrics.count("bytes_written.http_cache", new_size)
+        self._size_bytes += new_size - old_size
+        if self._size_bytes > self.max_size_bytes:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache is below 90% of its maximum size."""
+        for path, _ in sorted(self._entry_paths(), key=lambda path_and_mtime: path_and_mtime[1]):
+            if self._size_bytes <= 0.9 * self.max_size_bytes:
+                break
+            self._size_bytes -= os.path.getsize(path)
+            os.remove(path)
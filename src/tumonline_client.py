@@ -0,0 +1,146 @@
+import asyncio
+import os
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from instrumentation import metrics
+from rate_controller import AimdRateController
+from response_cache import ResponseCache
+
+# Set TUMONLINE_BASE_URL to run the fetchers against a stand-in server instead of campus.tum.de (see replay_server.py)
+TUMONLINE_BASE_URL = os.environ.get("TUMONLINE_BASE_URL", "https://campus.tum.de/tumonline").rstrip("/")
+TUMONLINE_REST_BASE_URL = f"{TUMONLINE_BASE_URL}/ee/rest"
+
+def endpoint_class(url: str) -> str:
+    """The endpoint of `url` without ids, e.g. ".../courses/N/same-courses": the latencies of one class are comparable."""
+    return re.sub(r"\d+", "N", urlsplit(url).path)
+
+# Responses with these status codes are transient (throttling, overloaded or restarting server) and are retried
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class RetryableResponseError(Exception):
+    pass
+
+@dataclass
+class ClientStats:
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+    cache_hits: int = 0
+    responses_by_status: Counter = field(default_factory=Counter)
+    rate_controller: AimdRateController | None = None
+
+    def summary(self) -> str:
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(self.responses_by_status.items()))
+        summary = f"{self.requests} requests, {self.retries} retries, {self.failures} failed, {self.cache_hits} answered from cache (responses by status: {statuses or '-'})"
+        if self.rate_controller is not None:
+            summary += f", {self.rate_controller.summary()}"
+        return summary
+
+class TumOnlineClient:
+    """
+    HTTP client shared by all TUMonline REST calls: keeps connections to campus.tum.de alive in one pool,
+    limits the number of concurrent requests, and retries transient errors (connection errors, timeouts,
+    throttling and 5xx responses) with jittered exponential backoff. Use as `async with TumOnlineClient() as client`.
+    If a `cache` is given, responses are looked up in and stored to it.
+
+    The number of concurrent requests adapts to the server (see AimdRateController): it starts at
+    `initial_concurrent_requests` and stays between 1 and `max_concurrent_requests`.
+    """
+    def __init__(self, max_concurrent_requests: int = 64, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 30, timeout: float = 60, cache: ResponseCache | None = None,
+                 initial_concurrent_requests: int = 8):
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.cache = cache
+        self.rate_controller = AimdRateController(initial_window=initial_concurrent_requests, max_window=max_concurrent_requests)
+        self.stats = ClientStats(rate_controller=self.rate_controller)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_concurrent_requests, keepalive_timeout=30)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                              headers={"Accept": "application/json"})
+        return self
+
+    async def __aexit__(self, *exc_info):
+        assert self._session is not None
+        await self._session.close()
+        self._session = None
+
+    async def get_json(self, url: str, term_id: int | None = None) -> Any:
+        """
+        Returns the JSON response for `url`. `term_id` is the term the response is about (if any), which decides
+        whether a cached response is still valid.
+        """
+        return await self._get(url, term_id, as_json=True)
+
+    async def get_text(self, url: str, term_id: int | None = None) -> str:
+        """Returns the response for `url` as text (e.g. HTML pages), see get_json."""
+        return await self._get(url, term_id, as_json=False)
+
+    async def _get(self, url: str, term_id: int | None, as_json: bool) -> Any:
+        if self.cache is not None and (cached_response := self.cache.get(url, term_id)) is not None:
+            self.stats.cache_hits += 1
+            metrics.count("http.cache_hits")
+            return cached_response
+        response_body = await self._fetch(url, as_json)
+        if self.cache is not None:
+            self.cache.put(url, term_id, response_body)
+        return response_body
+
+    async def _fetch(self, url: str, as_json: bool) -> Any:
+        assert self._session is not None, "TumOnlineClient must be used as an async context manager"
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.rate_controller.slot():
+                    with metrics.span("http.request", "http", url=url, attempt=attempt) as span_args:
+                        self.stats.requests += 1
+                        metrics.count("http.requests")
+                        start = time.perf_counter()
+                        try:
+                            async with self._session.get(url, headers=None if as_json else {"Accept": "text/html", "Accept-Language": "en"}) as response:
+                                self.stats.responses_by_status[response.status] += 1
+                                metrics.count(f"http.status.{response.status}")
+                                span_args["status"] = response.status
+                                if response.status in RETRY_STATUSES:
+                                    raise RetryableResponseError(f"HTTP {response.status} for {url}")
+                                response.raise_for_status()
+                                # Read first to count the bytes (json() and text() decode the body read here)
+                                metrics.count("bytes_read.http", len(await response.read()))
+                                response_body = await response.json() if as_json else await response.text()
+                            metrics.observe("http.latency_seconds", time.perf_counter() - start)
+                        except aiohttp.ClientResponseError as error:
+                            # A course that doesn't exist (any more) is no sign of overload; other client errors
+                            # (e.g. 400, 403) may be answered early, so their latency says nothing about the server
+                            if error.status == 404:
+                                self.rate_controller.on_success(time.perf_counter() - start, endpoint_class(url))
+                            raise
+                        except (RetryableResponseError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+                            self.rate_controller.on_failure()
+                            raise
+                        self.rate_controller.on_success(time.perf_counter() - start, endpoint_class(url))
+                        return response_body
+            except aiohttp.ClientResponseError:
+                self.stats.failures += 1
+                metrics.count("http.failures")
+                raise
+            except (RetryableResponseError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    self.stats.failures += 1
+                    metrics.count("http.failures")
+                    raise
+            self.stats.retries += 1
+            metrics.count("http.retries")
+            # "Full jitter" backoff: spreads out the retries of many requests that failed at the same time
+            await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
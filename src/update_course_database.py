@@ -1,37 +1,99 @@
 import argparse
 import asyncio
-import json
-import os
-from typing import Dict, List
-
-import aiohttp
+from typing import Callable, Dict, List, Tuple
 
 import curriculums
 import fetch_course_details
+import instrumentation
 import util
+from course_store import CourseStore
+from equivalence_index import EquivalenceIndex
+from instrumentation import metrics
+from manifest import hash_inputs
+from response_cache import CACHE_MODES, ResponseCache
+from tumonline_client import TUMONLINE_REST_BASE_URL, TumOnlineClient
+from update_journal import UpdateJournal
 
 allowed_course_types = ["VI", "VO"]
+# Number of courses requested per page of the course listing
+PAGE_SIZE = 100
+# Number of same-courses lookups per journal record
+RESOLUTION_BATCH_SIZE = 50
 
-async def fetch_course_dtos(term_id, curriculum_version_id, allowed_course_types) -> List[Dict]:
+async def fetch_course_dtos(client: TumOnlineClient, term_id, curriculum_version_id, allowed_course_types,
+                            on_page: Callable[[List[Dict]], None] | None = None) -> List[Dict]:
+    """
+    Fetches the offered courses of a curriculum version in a term. `on_page` (if given) is called with the courses of
+    every page as soon as that page arrives.
+    """
     # term_id = "196" # SS 2022
     curriculum_filter = f"curriculumVersionId-eq={curriculum_version_id};"
     term_id_filter = f"termId-eq={term_id};"
     filter = f"$filter={curriculum_filter}{term_id_filter}&"
 
-    async with aiohttp.ClientSession() as session:
-        responses = await asyncio.gather(*[
-            session.get(f"https://campus.tum.de/tumonline/ee/rest/slc.tm.cp/student/courses?{filter}$orderBy=title=ascnf&$skip={pagination_skip}&$top=100", headers={"Accept": "application/json"})
-            for pagination_skip in range(0, 1500, 100)
-        ])
-        course_dto_pages = await asyncio.gather(*[
-            response.json() for response in responses
-        ])
-        if len(course_dto_pages[-1]["courses"]) > 0:
-            print("Warning! Pagination limit of 1500 not sufficient, last page still contains courses")
-        course_dtos = [course_dto for page in course_dto_pages for course_dto in page["courses"] if course_dto["courseTypeDto"]["key"] in allowed_course_types]
+    def page_url(pagination_skip: int) -> str:
+        return f"{TUMONLINE_REST_BASE_URL}/slc.tm.cp/student/courses?{filter}$orderBy=title=ascnf&$skip={pagination_skip}&$top={PAGE_SIZE}"
+
+    def allowed_course_dtos(page) -> List[Dict]:
+        return [course_dto for course_dto in page["courses"] if course_dto["courseTypeDto"]["key"] in allowed_course_types]
+
+    async def fetch_page(pagination_skip: int):
+        page = await client.get_json(page_url(pagination_skip), term_id)
+        if on_page is not None:
+            on_page(allowed_course_dtos(page))
+        return page
+
+    course_dto_pages = [await fetch_page(0)]
+    total_count = course_dto_pages[0].get("totalCount")
+    # The server may return fewer courses than $top asks for, so step by the length of the pages that actually arrive
+    page_length = len(course_dto_pages[0]["courses"])
+    next_skip = page_length
+    if isinstance(total_count, int):
+        # The first page tells how many courses there are: fetch the remaining pages in parallel, then keep going
+        # page by page in case some of them came back shorter than the first one
+        if page_length > 0:
+            skips = range(next_skip, total_count, page_length)
+            course_dto_pages += await asyncio.gather(*[fetch_page(pagination_skip) for pagination_skip in skips])
+            if len(skips) > 0:
+                next_skip = skips[-1] + len(course_dto_pages[-1]["courses"])
+        while 0 < len(course_dto_pages[-1]["courses"]) and next_skip < total_count:
+            course_dto_pages.append(await fetch_page(next_skip))
+            next_skip += len(course_dto_pages[-1]["courses"])
+    else:
+        # Otherwise, fetch pages in parallel batches of doubling size (up to 8 pages) until a page is not full
+        batch_size = 1
+        while page_length > 0 and len(course_dto_pages[-1]["courses"]) == page_length:
+            course_dto_pages += await asyncio.gather(*[
+                fetch_page(next_skip + i * page_length) for i in range(batch_size)
+            ])
+            next_skip += batch_size * page_length
+            batch_size = min(2 * batch_size, 8)
+
+    fetched_count = sum(len(page["courses"]) for page in course_dto_pages)
+    if isinstance(total_count, int) and fetched_count != total_count:
+        message = (f"Expected {total_count} courses of curriculum version {curriculum_version_id} in "
+                   f"{util.term_id_to_name(term_id)}, but got {fetched_count}")
+        if fetched_count < total_count:
+            raise RuntimeError(message)
+        print(f"Warning: {message}")
+    course_dtos = [course_dto for page in course_dto_pages for course_dto in allowed_course_dtos(page)]
 
     return course_dtos
 
+async def update_inputs_hash(client: TumOnlineClient, curriculum: curriculums.Curriculum, term_id: int,
+                             old_terms_from: int | None = None) -> str:
+    """
+    Hash of everything update_course_database works from for `curriculum`: the term arguments, the curriculum
+    versions, the code that updates the course database, and the current term's course listings on TUMonline
+    (fetched for this; the listings of old terms don't change). Unchanged, an update would write the same data.
+    """
+    with metrics.span("update.inputs_hash", "update", curriculum=curriculum.output_file_prefix):
+        listings = await asyncio.gather(*[fetch_course_dtos(client, term_id, curriculum_id, allowed_course_types)
+                                          for curriculum_id in curriculum.curriculum_ids])
+    source_files = ["update_course_database.py", "course_store.py", "fetch_course_details.py", "equivalence_index.py", "curriculums.py"]
+    return hash_inputs(source_files, [term_id, old_terms_from, curriculum.curriculum_ids, curriculum.all_offered_courses_path,
+                                      sorted((course_dto for listing in listings for course_dto in listing), key=lambda course_dto: course_dto["id"])])
+
 def clean_dto(dto, fields):
     out = {}
     for field, field_selector in fields.items():
@@ -43,7 +105,7 @@ def clean_dto(dto, fields):
 
 
 # What this file should do (after refactor):
-# - read in course "database" (i.e. all_offered_courses JSON file; or maybe we want an actual database?)
+# - read in course database (course_store.CourseStore; exported to the all_offered_courses JSON file)
 #   - the "database" should contain: an entry for each course offered since 200x; its ID; the "equivalence class ID", let's define it as the ID of the oldest equivalent course
 # - download all offered courses for the selected curriculum in the current semester (and the old semesters, if they don't exist yet)
 # - for each new course, download the curriculum position data (-> fetch_course_details)
@@ -52,95 +114,197 @@ def clean_dto(dto, fields):
 #     go through semesters backwards and only fetch details for non-associated courses. Store curriculum information per association ID.
 # (should there be an extra DB per curriculum?)
 
-async def main():
-    parser = argparse.ArgumentParser(
-        usage="""
-        fetch_offered_courses.py [-h] --termid TERMID --jsonpath JSONPATH [--oldtermsfrom OLDTERMSFROMID] ]
-        
-        Please provide the term id: winter 2023/24 is 199, summer 2024 is 200, winter 2024/25 is 203 (!), etc.
-        """)
+async def update_course_database(client: TumOnlineClient, curriculum: curriculums.Curriculum, term_id: int,
+                                 old_terms_from: int | None = None,
+                                 equivalence_index: EquivalenceIndex | None = None,
+                                 parallel_listings: int = 8, parallel_resolutions: int = 20):
+    """
+    Fetch the offered courses of `curriculum` for `term_id` (and all terms from `old_terms_from` on that are not
+    in the course database yet), resolve their equivalence classes and write the updated course database.
 
-    parser.add_argument("--curriculum", required=True, type=str, help="One of ['master-informatics', 'master-dea']")
-    parser.add_argument('--termid', required=True, type=int, help="The term id (winter 2023/24 is 199, summer 2024 is 200, winter 2024/25 is 203 (!), etc)")
-    parser.add_argument('--oldtermsfrom', required=False, type=int, help="The first included term when fetching courses for a range of terms (in this case, --termid specifies the last one)")
-    args = parser.parse_args()
+    Equivalence classes are resolved through `equivalence_index` (by default, the one persisted in data/), so only
+    courses that are not in the index yet are looked up. Passing the same index for several curriculums shares it.
+    The course listings of up to `parallel_listings` (term, curriculum version) pairs are fetched at the same time,
+    and their courses are resolved by `parallel_resolutions` concurrent workers while the listings are still arriving.
+
+    Finished terms and batches of lookups are recorded in an UpdateJournal, so if the run is interrupted, the next
+    run continues where it stopped. The journal is removed once the results are written.
+    """
+    if equivalence_index is None:
+        equivalence_index = EquivalenceIndex()
 
-    curriculum = curriculums.curriculums[args.curriculum]
-
-    existing_courses: List = []
-    existing_terms = []
-    if os.path.isfile(curriculum.all_offered_courses_path):
-        with open(curriculum.all_offered_courses_path) as f:
-            existing_data = json.load(f)
-            # Remove existing entries for current semester: this should always be fetched (this is likely to have changed)
-            existing_courses = [dto for dto in existing_data["courses"] if dto["semesterDto"]["id"] != args.termid]
-        existing_terms = list(set(dto["semesterDto"]["id"] for dto in existing_data["courses"]).difference({args.termid}))
-        print(f"Found data for old terms in '{curriculum.all_offered_courses_path}'. This data is not downloaded again.")
-        print(f"Old terms found: {', '.join(util.term_id_to_name(term_id) for term_id in sorted(existing_terms))}" )
-
-    terms_to_fetch = [term_id
-             for term_id in range(args.oldtermsfrom if args.oldtermsfrom is not None else args.termid, args.termid+1)
-             if term_id not in [201, 202]
-             and term_id not in existing_terms
+    with CourseStore(curriculum) as store:
+        # Courses of old terms in the database have been resolved before, no need to look them up again. The current
+        # term's rows are replaced by this run, so its courses are resolved from the fresh listings.
+        for dto in store.course_dtos():
+            if dto["semesterDto"]["id"] == term_id:
+                continue
+            equivalence_index.add_related_courses([int(dto["id"]), int(dto["oldestRelatedCourseId"])], int(dto["oldestRelatedCourseId"]))
+        # Existing entries for the current semester are replaced: this should always be fetched (this is likely to have changed)
+        existing_terms = store.term_ids().difference({term_id})
+    if len(existing_terms) > 0:
+        print(f"Found data for old terms in '{curriculum.database_path}'. This data is not downloaded again.")
+        print(f"Old terms found: {', '.join(util.term_id_to_name(existing_term_id) for existing_term_id in sorted(existing_terms))}" )
+
+    terms_to_fetch = [fetched_term_id
+             for fetched_term_id in range(old_terms_from if old_terms_from is not None else term_id, term_id+1)
+             if fetched_term_id not in [201, 202]
+             and fetched_term_id not in existing_terms
     ]
 
+    journal = UpdateJournal(curriculum)
+    # Resume an interrupted run: replay its lookups, and reuse the listings of the terms it finished
+    for oldest_related_course_id, course_ids in journal.related_courses:
+        equivalence_index.add_related_courses(course_ids, oldest_related_course_id)
+    journaled_terms = [fetched_term_id for fetched_term_id in terms_to_fetch if fetched_term_id in journal.listings_by_term
+                       and set(curriculum.curriculum_ids) <= journal.listings_by_term[fetched_term_id].keys()]
+    if len(journaled_terms) > 0:
+        print(f"Resuming from '{journal.path}': {len(journaled_terms)} terms and {len(journal.related_courses)} lookups already done")
+
     print(f"Fetching offered courses from {util.term_id_to_name(terms_to_fetch[0])} to {util.term_id_to_name(terms_to_fetch[-1])}")
-    # Fetch all offered courses in the terms to fetch, from newest to oldest
-    available_courses_dtos_per_term = []
+    # Streaming pipeline: the courses of every listing page are queued for resolution as soon as the page arrives,
+    # while the other listings are still being fetched. Newer terms are resolved first (their same-courses lists
+    # usually cover the older terms' courses, which then need no lookup of their own).
+    resolution_queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+    queued_course_ids = set()
+    def queue_for_resolution(fetched_term_id: int, course_dtos: List[Dict]):
+        for course_dto in course_dtos:
+            if (course_id := int(course_dto["id"])) not in queued_course_ids and course_id not in equivalence_index:
+                queued_course_ids.add(course_id)
+                resolution_queue.put_nowait((-fetched_term_id, course_id, course_dto["title"]))
+
+    # Lookups in flight, by course title: equivalent courses mostly share their title, so a course first waits for
+    # the running lookup of a course with the same title, and needs no lookup of its own if that lookup covers it.
+    # Otherwise (a different course with the same title, e.g. a seminar), it is looked up right after, without
+    # waiting for further lookups.
+    lookups_in_flight: Dict[str, asyncio.Event] = {}
+    num_lookups = 0
+    # Lookups not journaled yet
+    resolution_batch: List[Tuple[int, List[int]]] = []
+    async def resolve(fetched_term_id: int, course_id: int, title: str):
+        nonlocal num_lookups
+        if (lookup_in_flight := lookups_in_flight.get(title)) is not None:
+            await lookup_in_flight.wait()
+        if course_id in equivalence_index:
+            return
+        # The first of several concurrent lookups of same-titled courses is the one later courses wait for
+        if (waited_for := title not in lookups_in_flight):
+            lookups_in_flight[title] = asyncio.Event()
+        try:
+            num_lookups += 1
+            with metrics.span("update.lookup", "update", course_id=course_id, term_id=fetched_term_id):
+                related_course_ids = await fetch_course_details.fetch_related_course_ids(client, course_id, fetched_term_id)
+            # The oldest related course id (equivalence class ID); merging classes keeps the minimum, so the
+            # result doesn't depend on the order of the lookups
+            oldest_related_course_id = min(course_id, related_course_ids[-1] if len(related_course_ids) > 0 else course_id)
+            equivalence_index.add_related_courses([course_id, *related_course_ids], oldest_related_course_id)
+            resolution_batch.append((oldest_related_course_id, [course_id, *related_course_ids]))
+            if len(resolution_batch) >= RESOLUTION_BATCH_SIZE:
+                journal.append_resolutions(resolution_batch[:])
+                resolution_batch.clear()
+        finally:
+            if waited_for:
+                lookups_in_flight.pop(title).set()
+
+    async def resolver():
+        while True:
+            negative_term_id, course_id, title = await resolution_queue.get()
+            try:
+                await resolve(-negative_term_id, course_id, title)
+            finally:
+                resolution_queue.task_done()
+
+    # Fetch the offered courses of all (term, curriculum version) pairs concurrently, at most `parallel_listings` at a time
+    listing_semaphore = asyncio.Semaphore(parallel_listings)
+    async def fetch_listing(fetched_term_id: int, curriculum_id: str) -> List[Dict]:
+        term_name = util.term_id_to_name(fetched_term_id)
+        def clean_page(course_dtos: List[Dict]) -> List[Dict]:
+            for course_dto in course_dtos:
+                course_dto["termName"] = term_name
+                course_dto["title"] = next((t["value"] for t in course_dto["courseTitle"]["translations"]["translation"] if t["lang"] == "en" and "value" in t), course_dto["courseTitle"]["value"])
+            # Clean the retrieved DTOs (remove unneeded fields) to save a significant amount of space and json parsing time
+            return [clean_dto(course_dto, field_selector) for course_dto in course_dtos]
+        async with listing_semaphore:
+            with metrics.span("update.listing", "update", term_id=fetched_term_id, curriculum_id=curriculum_id) as span_args:
+                course_dtos = await fetch_course_dtos(client, fetched_term_id, curriculum_id, allowed_course_types,
+                                                      on_page=lambda course_dtos: queue_for_resolution(fetched_term_id, clean_page(course_dtos)))
+                span_args["courses"] = len(course_dtos)
+            return clean_page(course_dtos)
+
+    async def fetch_term(fetched_term_id: int) -> Dict[str, List[Dict]]:
+        if fetched_term_id in journaled_terms:
+            listings = journal.listings_by_term[fetched_term_id]
+            for curriculum_id in curriculum.curriculum_ids:
+                queue_for_resolution(fetched_term_id, listings[curriculum_id])
+            return listings
+        listings = dict(zip(curriculum.curriculum_ids, await asyncio.gather(*[
+            fetch_listing(fetched_term_id, curriculum_id) for curriculum_id in curriculum.curriculum_ids])))
+        journal.append_term(fetched_term_id, listings)
+        return listings
+
     field_selector = {"courseTypeDto": {"key": True}, "termName": True, "semesterDto": {"id": True}, "title": True, "id": True,}
-    for term_id in reversed(terms_to_fetch):
-        term_name = util.term_id_to_name(term_id)
+    with journal:
+        async with asyncio.TaskGroup() as task_group:
+            resolvers = [task_group.create_task(resolver()) for _ in range(parallel_resolutions)]
+            listings_by_term = dict(zip(reversed(terms_to_fetch), await asyncio.gather(*[
+                fetch_term(fetched_term_id) for fetched_term_id in reversed(terms_to_fetch)])))
+            await resolution_queue.join()
+            for resolver_task in resolvers:
+                resolver_task.cancel()
+        journal.append_resolutions(resolution_batch)
+    print(f"Looked up related courses for {num_lookups} of {len(queued_course_ids)} new courses")
+    metrics.count("update.lookups", num_lookups)
+    metrics.count("update.new_courses", len(queued_course_ids))
+
+    # Deduplicate in the order of the pairs (terms from newest to oldest, curriculum versions in the configured order),
+    # so the result does not depend on the order in which the listings arrived
+    available_courses_dtos_per_term = []
+    for fetched_term_id in reversed(terms_to_fetch):
         seen_course_ids = set()
         all_term_course_dtos = []
         for curriculum_id in curriculum.curriculum_ids:
-            term_course_dtos = await fetch_course_dtos(term_id, curriculum_id, allowed_course_types)
-            term_course_dtos = [course_dto for course_dto in term_course_dtos if str(course_dto["id"]) not in seen_course_ids]
+            term_course_dtos = [course_dto for course_dto in listings_by_term[fetched_term_id][curriculum_id] if str(course_dto["id"]) not in seen_course_ids]
             for course_dto in term_course_dtos:
-                course_dto["termName"] = term_name
-                course_dto["title"] = next((t["value"] for t in course_dto["courseTitle"]["translations"]["translation"] if t["lang"] == "en" and "value" in t), course_dto["courseTitle"]["value"])
-                # Clean the retrieved DTOs (remove unneeded fields) to save a significant amount of space and json parsing time
-            term_course_dtos = [clean_dto(course_dto, field_selector) for course_dto in term_course_dtos]
+                course_dto["oldestRelatedCourseId"] = equivalence_index.oldest_related_course_id(int(course_dto["id"]))
             seen_course_ids.update(str(course_dto["id"]) for course_dto in term_course_dtos)
             all_term_course_dtos.extend(term_course_dtos)
-        print(len(all_term_course_dtos), "courses found in total for", term_name)
+        print(len(all_term_course_dtos), "courses found in total for", util.term_id_to_name(fetched_term_id))
         available_courses_dtos_per_term.append(all_term_course_dtos)
 
+    # Only the fetched terms' rows change in the database; the JSON export is kept for diff-friendly commits
+    with CourseStore(curriculum) as store, metrics.span("update.compaction", "update", curriculum=curriculum.output_file_prefix):
+        for available_courses_dtos_term, fetched_term_id in zip(available_courses_dtos_per_term, reversed(terms_to_fetch)):
+            store.upsert_term(fetched_term_id, available_courses_dtos_term)
+        store.export_json()
+        # Compaction: everything in the journal is in the course database and the equivalence index now
+        equivalence_index.save()
+        journal.remove()
+
+    print(f"Results written to '{curriculum.database_path}' and JSON file '{curriculum.all_offered_courses_path}'")
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        usage="""
+        fetch_offered_courses.py [-h] --termid TERMID --jsonpath JSONPATH [--oldtermsfrom OLDTERMSFROMID] ]
+        
+        Please provide the term id: winter 2023/24 is 199, summer 2024 is 200, winter 2024/25 is 203 (!), etc.
+        """)
+
+    parser.add_argument("--curriculum", required=True, type=str, help="One of ['master-informatics', 'master-dea']")
+    parser.add_argument('--termid', required=True, type=int, help="The term id (winter 2023/24 is 199, summer 2024 is 200, winter 2024/25 is 203 (!), etc)")
+    parser.add_argument('--oldtermsfrom', required=False, type=int, help="The first included term when fetching courses for a range of terms (in this case, --termid specifies the last one)")
+    parser.add_argument('--parallel_listings', default=8, type=int, help="How many (term, curriculum version) course listings to fetch at the same time")
+    parser.add_argument('--parallel_resolutions', default=20, type=int, help="How many courses to look up related courses for at the same time")
+    parser.add_argument('--cache-mode', default="use", choices=CACHE_MODES, help="use: answer requests about past terms from the on-disk response cache, refresh: always fetch, offline: only use the cache")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
 
-    # Map course ids to the id of the ldest related course (which identifies the equivalence class)
-    oldest_related_course_id_by_course_id = {}
-
-    async with aiohttp.ClientSession() as session:
-        # The available_courses_dtos are already sorted by term from newest to oldest.
-        for available_courses_dtos_term, term_id  in zip(available_courses_dtos_per_term, reversed(terms_to_fetch)):
-            print("Fetching related courses for", util.term_id_to_name(term_id))
-            # Fetch details only for courses where no newer equivalent course was seen yet
-            course_dtos_to_fetch_details_for = []
-            for course_dto in available_courses_dtos_term:
-                if (oldest_related_course_id := oldest_related_course_id_by_course_id.get(int(course_dto["id"]), None)) is not None:
-                    course_dto["oldestRelatedCourseId"] = oldest_related_course_id
-                else:
-                    course_dtos_to_fetch_details_for.append(course_dto)
-
-            # Asynchronously fetch the curriculum path and related courses for each of the courses
-            (all_related_course_ids,) = await asyncio.gather(
-                asyncio.gather(*[fetch_course_details.fetch_related_course_ids(session, course_dto["id"])
-                    for course_dto in course_dtos_to_fetch_details_for]
-            ))
-
-            # Identify the oldest related course ID (equivalence class ID)
-            for course_dto, related_course_ids in zip(course_dtos_to_fetch_details_for, all_related_course_ids):
-                oldest_related_course_id = min(int(course_dto["id"]), related_course_ids[-1] if len(related_course_ids) > 0 else float("inf"))
-                course_dto["oldestRelatedCourseId"] = oldest_related_course_id
-                for related_course_id in related_course_ids:
-                    oldest_related_course_id_by_course_id[int(related_course_id)] = oldest_related_course_id
-
-    with open(curriculum.all_offered_courses_path, "w") as f:
-        # Sort data, and save it with indent=0 which will add newlines (more diff-friendly)
-        courses_to_save = sorted(existing_courses + sum(reversed(available_courses_dtos_per_term), []), key=lambda dto: (int(dto["semesterDto"]["id"]), int(dto["id"]))) # type: ignore
-        saved_data = {"courses": courses_to_save}
-        json.dump(saved_data, f, indent=0)
-
-    print(f"Results written to JSON file '{curriculum.all_offered_courses_path}'")
+    with instrumentation.recording("update_course_database", args.metrics, args.trace):
+        async with TumOnlineClient(cache=ResponseCache(args.termid, args.cache_mode)) as client:
+            await update_course_database(client, curriculums.curriculums[args.curriculum], args.termid, args.oldtermsfrom,
+                                         parallel_listings=args.parallel_listings, parallel_resolutions=args.parallel_resolutions)
+    print("TUMonline requests:", client.stats.summary())
 
 
 if __name__ == "__main__":
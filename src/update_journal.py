@@ -0,0 +1,71 @@
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+from curriculums import Curriculum
+
+class UpdateJournal:
+    """
+    Append-only journal of an update_course_database run, so an interrupted run (e.g. a long backfill of old terms)
+    can be restarted without repeating finished work. Every line is one JSON record:
+    - {"kind": "term", "term_id": ..., "listings": {curriculum_id: [course dtos]}}: all listings of a term arrived
+    - {"kind": "resolutions", "related_courses": [[oldest related course id, [course ids]], ...]}: a batch of
+      same-courses lookups
+
+    When the run has written its results (the compaction into the course database), the journal is removed. A record
+    cut off by a crash (the last line) is ignored and removed from the file.
+    """
+    def __init__(self, curriculum: Curriculum):
+        self.path = curriculum.database_path.removesuffix(".sqlite3") + ".journal.jsonl"
+        self.listings_by_term: Dict[int, Dict[str, List[Dict[str, Any]]]] = {}
+        self.related_courses: List[Tuple[int, List[int]]] = []
+        if os.path.isfile(self.path):
+            # Byte offset of the end of the last complete record
+            valid_length = 0
+            with open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line) if line.endswith(b"\n") else None
+                    except json.JSONDecodeError:
+                        record = None
+                    if record is None:
+                        break
+                    valid_length += len(line)
+                    if record["kind"] == "term":
+                        self.listings_by_term[record["term_id"]] = record["listings"]
+                    else:
+                        self.related_courses.extend((oldest, course_ids) for oldest, course_ids in record["related_courses"])
+            # Cut off the partial record, so records appended by this run start on a line of their own
+            if valid_length < os.path.getsize(self.path):
+                os.truncate(self.path, valid_length)
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _append(self, record: Dict[str, Any]):
+        if self._file is None:
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append_term(self, term_id: int, listings: Dict[str, List[Dict[str, Any]]]):
+        self.listings_by_term[term_id] = listings
+        self._append({"kind": "term", "term_id": term_id, "listings": listings})
+
+    def append_resolutions(self, related_courses: List[Tuple[int, List[int]]]):
+        if len(related_courses) == 0:
+            return
+        self.related_courses.extend(related_courses)
+        self._append({"kind": "resolutions", "related_courses": related_courses})
+
+    def remove(self):
+        self.__exit__()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
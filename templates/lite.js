@@ -0,0 +1,149 @@
+"use strict";
+// Renders the course tables of a curriculum from its compact data file (written by print_html_table.py, see
+// CurriculumTables.render_lite), filtered by area, term and the extra columns (e.g. THEO). The rows of an area are
+// only created when the area comes close to the viewport.
+(function () {
+  const FLAG_NEW = 1;
+  const FLAG_RARE = 2;
+  // Position of the first extra column value in a course row (see "columns" in the data file)
+  const EXTRA_COLUMNS_START = 8;
+  // Estimated height of a table row, to reserve the space of areas that are not rendered yet
+  const ROW_HEIGHT_REM = 2.7;
+
+  const script = document.currentScript;
+  const areaFilter = document.getElementById("area-filter");
+  const termFilter = document.getElementById("term-filter");
+  const extraColumnFilters = document.getElementById("extra-column-filters");
+  const areasContainer = document.getElementById("areas");
+  const status = document.getElementById("status");
+  let data = null;
+  // Area sections whose rows are not rendered yet -> what to render
+  const pendingSections = new Map();
+
+  const observer = "IntersectionObserver" in window ? new IntersectionObserver(entries => {
+    for (const entry of entries) {
+      if (entry.isIntersecting) {
+        fillSection(entry.target);
+      }
+    }
+  }, { rootMargin: "1000px 0px" }) : null;
+
+  function createElement(tag, text, properties) {
+    const element = document.createElement(tag);
+    if (text !== undefined) {
+      element.textContent = text;
+    }
+    return Object.assign(element, properties);
+  }
+
+  function createTable(withLastOffered) {
+    const table = createElement("table");
+    const headerRow = createElement("tr");
+    headerRow.style.textAlign = "right";
+    headerRow.append(createElement("th", "ID"), createElement("th", "Title", { className: "titleheader" }), createElement("th", "Credits"));
+    for (const column of data.extra_columns) {
+      headerRow.append(createElement("th", column));
+    }
+    if (withLastOffered) {
+      headerRow.append(createElement("th", "Last offered"));
+    }
+    table.append(createElement("thead"), createElement("tbody"));
+    table.tHead.append(headerRow);
+    return table;
+  }
+
+  function createRow(course, withTags, withLastOffered) {
+    const [, courseCode, title, courseId, credits, termIndex, flags, previousTerm] = course;
+    const row = createElement("tr");
+    const codeCell = createElement("td", courseCode);
+    if (withTags && (flags & FLAG_NEW)) {
+      codeCell.append(" ", createElement("span", "🌟", { className: "tagIcon", title: "New course: offered for the first time!" }));
+    }
+    if (withTags && (flags & FLAG_RARE)) {
+      codeCell.append(" ", createElement("span", "💎", { className: "tagIcon", title: `Rare course: last offered in ${previousTerm}` }));
+    }
+    const titleCell = createElement("td");
+    titleCell.append(createElement("a", title, { href: data.course_url_prefix + courseId }));
+    row.append(codeCell, titleCell, createElement("td", credits));
+    for (const value of course.slice(EXTRA_COLUMNS_START)) {
+      row.append(createElement("td", value));
+    }
+    if (withLastOffered) {
+      row.append(createElement("td", data.terms[termIndex][1]));
+    }
+    return row;
+  }
+
+  function fillSection(section) {
+    const pending = pendingSections.get(section);
+    if (pending === undefined) {
+      return;
+    }
+    pendingSections.delete(section);
+    observer?.unobserve(section);
+    const rows = document.createDocumentFragment();
+    for (const course of pending.courses) {
+      rows.append(createRow(course, pending.withTags, pending.withLastOffered));
+    }
+    section.querySelector("tbody").append(rows);
+    section.style.minHeight = "";
+  }
+
+  function applyFilters() {
+    const area = areaFilter.value === "" ? null : Number(areaFilter.value);
+    // Terms are listed newest first: index 0 is the current term
+    const maxTermIndex = Number(termFilter.value);
+    const requiredColumns = Array.from(extraColumnFilters.querySelectorAll("input:checked"), input => Number(input.value));
+
+    // The courses are sorted by area (in curriculum order), then like the tables
+    const coursesByArea = new Map();
+    for (const course of data.courses) {
+      if ((area === null || course[0] === area) && course[5] <= maxTermIndex
+          && requiredColumns.every(column => course[EXTRA_COLUMNS_START + column] !== "")) {
+        if (!coursesByArea.has(course[0])) {
+          coursesByArea.set(course[0], []);
+        }
+        coursesByArea.get(course[0]).push(course);
+      }
+    }
+
+    observer?.disconnect();
+    pendingSections.clear();
+    areasContainer.replaceChildren();
+    let numCourses = 0;
+    for (const [areaIndex, courses] of coursesByArea) {
+      const section = createElement("section");
+      section.style.minHeight = `${courses.length * ROW_HEIGHT_REM}rem`;
+      section.append(createElement("h3", data.areas[areaIndex]), createTable(maxTermIndex > 0));
+      areasContainer.append(section);
+      pendingSections.set(section, { courses, withTags: maxTermIndex === 0, withLastOffered: maxTermIndex > 0 });
+      numCourses += courses.length;
+      if (observer !== null) {
+        observer.observe(section);
+      } else {
+        fillSection(section);
+      }
+    }
+    status.textContent = `${numCourses} courses in ${coursesByArea.size} areas`;
+  }
+
+  fetch(script.dataset.coursesUrl).then(response => {
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+    return response.json();
+  }).then(courseData => {
+    data = courseData;
+    data.areas.forEach((area, index) => areaFilter.append(new Option(area, index)));
+    data.terms.forEach(([, termName], index) => termFilter.append(new Option(index === 0 ? `in ${termName}` : `since ${termName}`, index)));
+    data.extra_columns.forEach((column, index) => {
+      const label = createElement("label");
+      label.append(createElement("input", undefined, { type: "checkbox", value: index }), ` ${column} only`);
+      extraColumnFilters.append(label);
+    });
+    document.getElementById("filters").addEventListener("change", applyFilters);
+    applyFilters();
+  }).catch(error => {
+    status.textContent = `Could not load the courses (${error.message}).`;
+  });
+})();